@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for tagging a whole music library in one run.
+"""
+
+import argparse
+import json
+
+from music.batch import run_batch
+from music.config import (BATCH_FETCH_CONCURRENCY, BATCH_WINDOW, BATCH_WORKERS,
+                          RESULTS_LIMIT_DEFAULT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Match every MP3 under a directory against iTunes.')
+    parser.add_argument('root', help='Directory to scan')
+    parser.add_argument('-o', '--report', default='batch_report.jsonl',
+                        help='JSONL report, also used as resume checkpoint')
+    parser.add_argument('-w', '--workers', type=int, default=BATCH_WORKERS,
+                        help='Processes used to read tags')
+    parser.add_argument('-c', '--concurrency', type=int, default=BATCH_FETCH_CONCURRENCY,
+                        help='Maximum concurrent iTunes lookups')
+    parser.add_argument('--window', type=int, default=BATCH_WINDOW,
+                        help='Files processed per step')
+    parser.add_argument('--limit', type=int, default=RESULTS_LIMIT_DEFAULT,
+                        help='Candidates requested per file')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore the existing report and start over')
+    parser.add_argument('--per-track', action='store_true',
+                        help='Search every file on its own instead of once per album')
+    parser.add_argument('--no-dedupe', action='store_true',
+                        help='Search copies of one recording separately')
+    args = parser.parse_args()
+
+    summary = run_batch(args.root, args.report, workers=args.workers,
+                        fetch_concurrency=args.concurrency, window=args.window,
+                        limit=args.limit, resume=not args.restart,
+                        albums=not args.per_track, dedupe=not args.no_dedupe)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Throughput of fingerprint extraction, in files per second.
+
+Fingerprints --files synthetic 30-second tracks with one process and with
+--workers processes. With --library, real files are decoded with ffmpeg
+instead (the whole decode + fingerprint path), which needs ffmpeg installed.
+
+Usage: python benchmarks/bench_fingerprint.py [--files 200] [--workers 4] [--library DIR]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from common import add_report_arguments, finish
+
+from music.services import fingerprint  # noqa: E402
+
+
+def synthetic_fingerprint(seed: int) -> int:
+    # Random chords, generated in the worker so only an int crosses the process boundary
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(2.0 * fingerprint.RATE)) / fingerprint.RATE
+    parts = [sum(np.sin(2 * np.pi * 440.0 * 2 ** ((n - 69) / 12) * t)
+                 for n in rng.choice(np.arange(48, 72), size=3, replace=False))
+             for _ in range(15)]
+    return len(fingerprint.fingerprint(np.concatenate(parts).astype(np.float32)))
+
+
+def file_fingerprint(path: str) -> int:
+    return len(fingerprint.fingerprint_file(path))
+
+
+def throughput(func, items: list, workers: int) -> dict:
+    started = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(func, items, chunksize=4))
+    else:
+        list(map(func, items))
+    elapsed = time.perf_counter() - started
+    return {"files": len(items), "seconds": round(elapsed, 3),
+            "files_per_second": round(len(items) / elapsed, 2)}
+
+
+def main(files: int = 200, workers: int = 4, library: str = None) -> dict:
+    if library:
+        items = [os.path.join(d, name) for d, _, names in os.walk(library)
+                 for name in names if name.lower().endswith('.mp3')][:files]
+        func, label = file_fingerprint, 'decode_and_fingerprint'
+    else:
+        items, func, label = list(range(files)), synthetic_fingerprint, 'fingerprint'
+    return {f"{label}[workers=1]": throughput(func, items, 1),
+            f"{label}[workers={workers}]": throughput(func, items, workers)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--library', help='directory of MP3 files to decode with ffmpeg')
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    if args.library and not fingerprint.decoder_available():
+        sys.exit("ffmpeg is needed to fingerprint real files")
+    params = {"files": args.files, "workers": args.workers, "library": args.library}
+    sys.exit(finish(args, 'fingerprint', params, main(args.files, args.workers, args.library)))
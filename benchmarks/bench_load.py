@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test of the search, refresh and save endpoints.
+
+Serves the app on a local port against a mock iTunes server with injected
+latency (log-normal around --latency seconds) and a share --error-rate of
+failed calls, then has --concurrency clients post to ``/``,
+``/refresh_metadata`` and ``/save_metadata`` in turn. Every client works on
+its own MP3 fixtures so saves never race. Reports p50/p95/p99 latency, errors
+and throughput per endpoint.
+
+Usage: python benchmarks/bench_load.py [--requests 300] [--concurrency 8] [--output load.json]
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from common import TAGS, add_report_arguments, finish, make_image, percentiles, write_mp3
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from fake_itunes import FakeItunesServer, make_track  # noqa: E402
+from music import create_app  # noqa: E402
+from music.config import SEARCH_CONCURRENCY  # noqa: E402
+from music.services import async_search, itunes_api  # noqa: E402
+from music.services.cache import MemoryCache, ResultCache  # noqa: E402
+from music.services.http_service import HttpService  # noqa: E402
+from music.utils import thumbnail  # noqa: E402
+from music.utils.logger import get_logger  # noqa: E402
+
+ENDPOINTS = ('index', 'refresh_metadata', 'save_metadata')
+
+
+def serve(app):
+    """Run the app on a free local port in a background thread."""
+    # Per-request access and info logs would swamp the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    get_logger().setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def client(base_url: str, files: list, count: int, artwork_url: str, seed: int) -> list:
+    """Send count requests, cycling through the endpoints; return (endpoint, seconds, ok)."""
+    rng = random.Random(seed)
+    session = requests.Session()
+    samples = []
+    for i in range(count):
+        endpoint = ENDPOINTS[i % len(ENDPOINTS)]
+        path = rng.choice(files)
+        form = dict(TAGS, filepath=path)
+        if endpoint == 'index':
+            url, headers = f'{base_url}/', {}
+        elif endpoint == 'refresh_metadata':
+            # A new title each time, so refreshes miss the result cache like edited searches do
+            form['title'] = f"{TAGS['title']} {seed}-{i}"
+            url, headers = f'{base_url}/refresh_metadata', {}
+        else:
+            form['thumbnailUrl'] = artwork_url
+            url, headers = f'{base_url}/save_metadata', {'X-Requested-With': 'XMLHttpRequest'}
+        started = time.perf_counter()
+        try:
+            response = session.post(url, data=form, headers=headers, timeout=60)
+            ok = response.status_code == 200 and (
+                endpoint == 'index' or response.json().get('success', False))
+        except (requests.RequestException, ValueError):
+            ok = False
+        samples.append((endpoint, time.perf_counter() - started, ok))
+    return samples
+
+
+def summarise(samples: list, elapsed: float) -> dict:
+    results = {}
+    for endpoint in ENDPOINTS + ('all',):
+        chosen = [s for s in samples if endpoint in ('all', s[0])]
+        if not chosen:
+            continue
+        stats = percentiles([seconds for _, seconds, _ in chosen])
+        stats["errors"] = sum(1 for *_, ok in chosen if not ok)
+        stats["throughput_rps"] = round(len(chosen) / elapsed, 2)
+        results[endpoint] = stats
+    return results
+
+
+def main(total: int = 300, concurrency: int = 8, latency: float = 0.05,
+         error_rate: float = 0.0, seed: int = 1) -> dict:
+    workdir = tempfile.mkdtemp(prefix='bench-load-')
+    rng = random.Random(seed)
+
+    def delay(path, query):
+        return rng.lognormvariate(0, 0.6) * latency
+
+    def results(query):
+        return [make_track(i, TAGS['title'], TAGS['artist'], artworkUrl100=artwork_url)
+                for i in range(1, 11)]
+
+    try:
+        files = [[write_mp3(os.path.join(workdir, f'client{c}', f'{n}.mp3'), seconds=60,
+                            tags=TAGS) for n in range(4)] for c in range(concurrency)]
+        with FakeItunesServer(search_results=results, delay=delay, error_rate=error_rate,
+                              seed=seed, artwork=make_image()) as itunes:
+            artwork_url = f'{itunes.base_url}/image/cover/1000x1000bb.jpg'
+            # No rate limit, no catalog and a fresh cache: every search goes to the mock.
+            # Search variants run on a pool of the run's own, drained before the patches end
+            variants = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix='search')
+            with patch.object(itunes_api, 'service', HttpService(itunes.base_url)), \
+                    patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())), \
+                    patch.object(itunes_api, 'catalog', None), \
+                    patch.object(async_search, '_executor', variants), \
+                    patch.object(thumbnail, 'artwork_cache',
+                                 thumbnail.ArtworkCache(os.path.join(workdir, 'artwork'))):
+                server = serve(create_app({'UPLOAD_FOLDER': workdir, 'LIBRARY_ROOTS': []}))
+                base_url = f'http://127.0.0.1:{server.port}'
+                try:
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                        futures = [pool.submit(client, base_url, files[c], total // concurrency,
+                                               artwork_url, seed + c) for c in range(concurrency)]
+                        samples = [s for future in futures for s in future.result()]
+                    elapsed = time.perf_counter() - started
+                finally:
+                    server.shutdown()
+                    variants.shutdown(wait=True)
+        return summarise(samples, elapsed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=300, help='total requests')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help='mock iTunes latency (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of mock iTunes calls that fail with 503')
+    parser.add_argument('--seed', type=int, default=1)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    params = {"requests": args.requests, "concurrency": args.concurrency,
+              "latency": args.latency, "error_rate": args.error_rate, "seed": args.seed}
+    sys.exit(finish(args, 'load', params, main(args.requests, args.concurrency, args.latency,
+                                               args.error_rate, args.seed)))
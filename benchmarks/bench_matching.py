@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark of candidate scoring over a synthetic corpus.
+
+Builds random local tag sets and candidate lists shaped like iTunes results,
+then times rank_candidates per file and per candidate.
+
+Usage: python benchmarks/bench_matching.py [--files 2000] [--candidates 25]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from music.utils.matching import rank_candidates  # noqa: E402
+
+
+def words(rng: random.Random, count: int) -> str:
+    return ' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+                    for _ in range(count))
+
+
+def corpus(files: int, candidates: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    artists = [words(rng, 2) for _ in range(max(1, files // 10))]
+    albums = [words(rng, 3) for _ in range(max(1, files // 8))]
+    data = []
+    for _ in range(files):
+        local = {'title': words(rng, rng.randint(1, 5)), 'artist': rng.choice(artists),
+                 'album': rng.choice(albums), 'duration': rng.uniform(120, 420),
+                 'tracknumber': f"{rng.randint(1, 14)}/14", 'discnumber': '1'}
+        results = [{'trackName': words(rng, rng.randint(1, 5)), 'artistName': rng.choice(artists),
+                    'collectionName': rng.choice(albums),
+                    'trackTimeMillis': rng.randint(120000, 420000),
+                    'trackNumber': rng.randint(1, 14), 'discNumber': 1}
+                   for _ in range(candidates)]
+        data.append((local, results))
+    return data
+
+
+def main(files: int = 2000, candidates: int = 25) -> dict:
+    data = corpus(files, candidates)
+    started = time.perf_counter()
+    for local, results in data:
+        rank_candidates(local, results)
+    elapsed = time.perf_counter() - started
+    report = {
+        "files": files,
+        "candidates_per_file": candidates,
+        "us_per_file": round(elapsed / files * 1e6, 1),
+        "us_per_candidate": round(elapsed / (files * candidates) * 1e6, 2),
+    }
+    print("  ".join(f"{k}={v}" for k, v in report.items()))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--candidates', type=int, default=25)
+    args = parser.parse_args()
+    main(args.files, args.candidates)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the per-file hot paths.
+
+Times tag reading (eager and lazy) on MP3 fixtures of several sizes with and
+without ID3 tags and cover art, format_time, itunes_parse, embedding a
+thumbnail and re-tagging a file (with the bytes each save writes). Results
+are per call, in milliseconds.
+
+Usage: python benchmarks/bench_micro.py [--iterations 200] [--output micro.json]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from common import SAMPLE_TRACK, add_report_arguments, finish, make_fixtures, make_image, time_calls
+
+from music.modules import AudioTags, ExtendedAudioTags  # noqa: E402
+from music.utils.datetime import format_time  # noqa: E402
+from music.utils.thumbnail import embed_thumbnail  # noqa: E402
+
+
+def bench_tags(fixtures: dict, iterations: int) -> dict:
+    results = {}
+    for name, path in fixtures.items():
+        results[f"read_tags[{name}]"] = time_calls(lambda: AudioTags(path), iterations)
+        results[f"read_tags_lazy[{name}]"] = time_calls(
+            lambda: AudioTags(path, lazy=True), iterations)
+    return results
+
+
+def bench_embed(fixtures: dict, workdir: str, iterations: int) -> dict:
+    # embed_thumbnail deletes the thumbnail it was given, so write a new one each call
+    artwork = make_image(600, 'PNG')
+    thumbnail = os.path.join(workdir, 'thumbnail.png')
+    results = {}
+    for name in ('short_bare', 'long_cover'):
+        target = os.path.join(workdir, f'embed_{name}.mp3')
+        shutil.copy(fixtures[name], target)
+
+        def embed():
+            with open(thumbnail, 'wb') as f:
+                f.write(artwork)
+            embed_thumbnail(target, thumbnail)
+
+        results[f"embed_thumbnail[{name}]"] = time_calls(embed, iterations, warmup=1)
+    return results
+
+
+def bench_retag(fixtures: dict, workdir: str, iterations: int) -> dict:
+    # Alternate two titles of different lengths on the largest file
+    target = os.path.join(workdir, 'retag.mp3')
+    shutil.copy(fixtures['long_cover'], target)
+    titles = ['Short', 'A considerably longer title than the other one']
+    count = [0]
+
+    def retag():
+        audio = AudioTags(target, lazy=True)
+        audio.title = titles[count[0] % 2]
+        count[0] += 1
+        return audio.save()
+
+    stats = time_calls(retag, iterations, warmup=1)
+    stats["bytes_written"] = retag()["bytes_written"]
+    stats["file_size"] = os.path.getsize(target)
+    return {"retag[long_cover]": stats}
+
+
+def main(iterations: int = 200) -> dict:
+    workdir = tempfile.mkdtemp(prefix='bench-micro-')
+    try:
+        fixtures = make_fixtures(workdir)
+        results = bench_tags(fixtures, iterations)
+        results["format_time"] = time_calls(lambda: format_time(3725.4), iterations * 10)
+        results["itunes_parse"] = time_calls(
+            lambda: ExtendedAudioTags().itunes_parse(SAMPLE_TRACK), iterations * 10)
+        # embed_thumbnail prints a line per call
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            results.update(bench_embed(fixtures, workdir, max(1, iterations // 10)))
+            results.update(bench_retag(fixtures, workdir, max(1, iterations // 10)))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=200)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(finish(args, 'micro', {"iterations": args.iterations}, main(args.iterations)))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: memory and serialization cost of tag records.
+
+Compares the dict-backed AudioTags/ExtendedAudioTags with the slotted
+AudioRecord/ExtendedAudioRecord and the columnar export.
+
+Usage: python benchmarks/bench_records.py [count]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from music.modules import (AudioRecord, AudioTags, ExtendedAudioRecord,  # noqa: E402
+                           ExtendedAudioTags, records_to_columns, records_to_rows)
+
+SAMPLE = {
+    "trackName": "Close Your Eyes (VIP Mix)",
+    "artistName": "KSHMR & Tungevaag",
+    "collectionName": "Close Your Eyes (VIP Mix) - Single",
+    "primaryGenreName": "Dance",
+    "trackNumber": 1,
+    "discNumber": 1,
+    "releaseDate": "2022-01-14T12:00:00Z",
+    "artworkUrl100": "https://is1-ssl.mzstatic.com/image/thumb/Music116/100x100bb.jpg",
+}
+
+
+def build(factory, count: int) -> list:
+    records = []
+    for i in range(count):
+        record = factory()
+        record.itunes_parse(SAMPLE)
+        record.filepath = f"/music/library/{i:06d}.mp3"
+        record.bitrate = 320
+        record.duration = 180.5 + i % 60
+        records.append(record)
+    return records
+
+
+def measure(name: str, factory, count: int) -> dict:
+    tracemalloc.start()
+    records = build(factory, count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for record in records:
+        record.to_dict()
+    to_dict_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for record in records:
+        record.to_dict()
+    repeat_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    records_to_rows(records)
+    rows_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    records_to_columns(records)
+    columns_seconds = time.perf_counter() - started
+
+    return {
+        "name": name,
+        "count": count,
+        "bytes_per_record": round(size / count, 1),
+        "to_dict_us": round(to_dict_seconds / count * 1e6, 3),
+        "to_dict_repeat_us": round(repeat_seconds / count * 1e6, 3),
+        "rows_us": round(rows_seconds / count * 1e6, 3),
+        "columns_us": round(columns_seconds / count * 1e6, 3),
+    }
+
+
+def main(count: int = 100000) -> list:
+    results = [
+        measure("AudioTags", AudioTags, count),
+        measure("AudioRecord", AudioRecord, count),
+        measure("ExtendedAudioTags", ExtendedAudioTags, count),
+        measure("ExtendedAudioRecord", ExtendedAudioRecord, count),
+    ]
+    print(f"{'class':<22}{'bytes/rec':>12}{'to_dict us':>12}{'repeat us':>12}"
+          f"{'rows us':>10}{'cols us':>10}")
+    for r in results:
+        print(f"{r['name']:<22}{r['bytes_per_record']:>12}{r['to_dict_us']:>12}"
+              f"{r['to_dict_repeat_us']:>12}{r['rows_us']:>10}{r['columns_us']:>10}")
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
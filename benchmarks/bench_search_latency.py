@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tail latency of the variant search against a local mock iTunes server.
+
+The mock server answers with a random latency (log-normal around --latency
+seconds) and returns nothing for queries containing the noisy album name, the
+case where a single combined query fails. Compares one combined query followed
+by a title+artist retry (what users do by hand today) with search_variants.
+
+Usage: python benchmarks/bench_search_latency.py [--runs 50] [--latency 0.05]
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import common  # noqa: F401  (paths and a temporary data directory)
+
+from fake_itunes import FakeItunesServer, make_track  # noqa: E402
+from music.config import SEARCH_CONCURRENCY  # noqa: E402
+from music.services import async_search, itunes_api  # noqa: E402
+from music.services.async_search import search_variants  # noqa: E402
+from music.services.cache import MemoryCache, ResultCache  # noqa: E402
+from music.services.http_service import HttpService  # noqa: E402
+
+TAGS = {'title': 'Close Your Eyes', 'artist': 'KSHMR', 'album': 'Noisy Album (Deluxe)'}
+
+
+def percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "mean_ms": round(statistics.mean(ordered) * 1000, 1)}
+
+
+def sequential(tags: dict) -> list:
+    results = itunes_api.get_song_info([tags['title'], tags['artist'], tags['album']])
+    if not results:
+        results = itunes_api.get_song_info([tags['title'], tags['artist']])
+    return results
+
+
+def run(strategy, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        # A fresh cache and no catalog per run, so every run pays the network cost.
+        # Variants abandoned at the budget run on a pool of the run's own, which is
+        # drained before the patches are undone
+        executor = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix='search')
+        with patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())), \
+                patch.object(itunes_api, 'catalog', None), \
+                patch.object(async_search, '_executor', executor):
+            try:
+                started = time.perf_counter()
+                strategy(TAGS)
+                samples.append(time.perf_counter() - started)
+            finally:
+                executor.shutdown(wait=True)
+    return percentiles(samples)
+
+
+def main(runs: int = 50, latency: float = 0.05) -> dict:
+    def delay(path, query):
+        return random.lognormvariate(0, 0.6) * latency
+
+    def results(query):
+        if 'Noisy' in query['term'][0]:
+            return []
+        return [make_track(1, TAGS['title'], TAGS['artist'])]
+
+    with FakeItunesServer(search_results=results, delay=delay) as server:
+        with patch.object(itunes_api, 'service', HttpService(server.base_url)):
+            report = {
+                "sequential": run(sequential, runs),
+                "variants": run(lambda tags: search_variants(tags), runs),
+            }
+    for name, stats in report.items():
+        print(f"{name:<12}" + "  ".join(f"{k}={v}" for k, v in stats.items()))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    main(args.runs, args.latency)
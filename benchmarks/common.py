@@ -0,0 +1,180 @@
+"""
+Shared helpers for the benchmark scripts: percentiles, fixtures and JSON reports.
+
+Reports are written as JSON together with the commit they were measured on,
+so two runs can be compared with ``compare_reports`` (or ``--compare`` on the
+command line of each benchmark).
+
+Importing this module points the app's data directory at a temporary one,
+removed on exit, so benchmarks never write mock results into the user's
+catalog, caches or indexes. Import it before anything from ``music``.
+"""
+import atexit
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+DATA_DIR = tempfile.mkdtemp(prefix='bench-data-')
+os.environ['MUSIC_FINDER_DATA'] = DATA_DIR
+# Paths set one by one would still point at the user's files
+for _name in ('SEARCH_CACHE_PATH', 'CATALOG_PATH', 'LIBRARY_DB_PATH', 'FINGERPRINT_DB_PATH',
+              'DEDUPE_DB_PATH', 'ARTWORK_CACHE_DIR', 'BATCH_REPORT_DIR'):
+    os.environ.pop(_name, None)
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+
+from mp3_fixtures import write_mp3  # noqa: E402
+
+# (name, seconds of audio, ID3 tags, embedded cover)
+FIXTURES = (
+    ('short_bare', 5, False, False),
+    ('short_tagged', 5, True, False),
+    ('medium_tagged', 60, True, False),
+    ('medium_cover', 60, True, True),
+    ('long_cover', 300, True, True),
+)
+
+TAGS = {'title': 'Close Your Eyes', 'artist': 'KSHMR', 'album': 'Close Your Eyes - Single',
+        'genre': 'Dance', 'tracknumber': '1/1', 'date': '2022'}
+
+SAMPLE_TRACK = {
+    "trackName": "Close Your Eyes (VIP Mix)",
+    "artistName": "KSHMR & Tungevaag",
+    "collectionName": "Close Your Eyes (VIP Mix) - Single",
+    "primaryGenreName": "Dance",
+    "trackNumber": 1,
+    "trackCount": 1,
+    "discNumber": 1,
+    "releaseDate": "2022-01-14T12:00:00Z",
+    "trackTimeMillis": 5000,
+    "artworkUrl100": "https://is1-ssl.mzstatic.com/image/thumb/Music116/100x100bb.jpg",
+}
+
+
+def make_image(size: int = 1000, fmt: str = 'JPEG') -> bytes:
+    """Solid-colour test image, as cover art of a realistic size."""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), (200, 10, 10)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def make_fixtures(directory: str, artwork: bytes = None) -> dict:
+    """
+    Write the standard set of MP3 fixtures.
+
+    :param directory: where to write them
+    :param artwork: cover to embed in the fixtures that have one
+    :return: dict mapping fixture name to path
+    """
+    artwork = artwork or make_image()
+    return {name: write_mp3(os.path.join(directory, f'{name}.mp3'), seconds=seconds,
+                            tags=TAGS if tagged else None, artwork=artwork if cover else None)
+            for name, seconds, tagged, cover in FIXTURES}
+
+
+def percentiles(samples: list) -> dict:
+    """Latency summary of samples in seconds, reported in milliseconds."""
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "mean_ms": round(statistics.mean(ordered) * 1000, 3)}
+
+
+def time_calls(func, iterations: int, warmup: int = 3) -> dict:
+    """Call func repeatedly and summarise the latency of each call."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def environment() -> dict:
+    """Where and on what code a benchmark ran."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+
+def write_report(path: str, benchmark: str, params: dict, results: dict) -> dict:
+    """
+    Save benchmark results as JSON.
+
+    :param path: output file
+    :param benchmark: benchmark name
+    :param params: parameters the benchmark ran with
+    :param results: dict mapping case name to its measurements
+    :return: the report written
+    """
+    report = {"benchmark": benchmark, "environment": environment(), "params": params,
+              "results": results}
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare_reports(current: dict, baseline: dict, metric: str = 'p95_ms',
+                    threshold: float = 0.10) -> list:
+    """
+    Find cases that got slower than a baseline report.
+
+    :param metric: measurement compared in each case
+    :param threshold: relative slowdown tolerated before a case is reported
+    :return: list of (case, baseline value, current value) for regressed cases
+    """
+    regressions = []
+    for case, stats in current["results"].items():
+        before = baseline["results"].get(case, {}).get(metric)
+        after = stats.get(metric)
+        if before and after is not None and after > before * (1 + threshold):
+            regressions.append((case, before, after))
+    return regressions
+
+
+def add_report_arguments(parser):
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative p95 slowdown reported as a regression')
+
+
+def finish(args, benchmark: str, params: dict, results: dict) -> int:
+    """Print, save and compare results; the exit status is 1 if anything regressed."""
+    for case, stats in results.items():
+        print(f"{case:<32}" + "  ".join(f"{k}={v}" for k, v in stats.items()))
+    report = {"results": results}
+    if args.output:
+        report = write_report(args.output, benchmark, params, results)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, threshold=args.threshold)
+        for case, before, after in regressions:
+            print(f"REGRESSION {case}: p95 {before} ms -> {after} ms")
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for finding copies of the same recording in a music library.
+"""
+
+import argparse
+import json
+import os
+
+from music.config import DEDUPE_WORKERS
+from music.services.dedupe import duplicate_index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Hash the audio of every MP3 under some directories and list the '
+                    'files that are copies of one recording.')
+    parser.add_argument('roots', nargs='+', help='Directories to scan')
+    parser.add_argument('-w', '--workers', type=int, default=DEDUPE_WORKERS,
+                        help='Processes used to hash files')
+    args = parser.parse_args()
+
+    duplicate_index.workers = args.workers
+    summary = duplicate_index.scan(args.roots)
+    roots = [os.path.abspath(root) for root in args.roots]
+    groups = [g for g in duplicate_index.groups()
+              if any(path.startswith(root + os.sep) for path in g for root in roots)]
+    print(json.dumps({"summary": summary, "duplicates": groups}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
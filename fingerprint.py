@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for fingerprinting the tagged files of a music library.
+"""
+
+import argparse
+import json
+import sys
+
+from music.config import FINGERPRINT_WORKERS
+from music.services.fingerprint import FingerprintUnavailable, fingerprint_index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fingerprint every tagged MP3 under some directories, so untagged '
+                    'copies can be recognised.')
+    parser.add_argument('roots', nargs='+', help='Directories to scan')
+    parser.add_argument('-w', '--workers', type=int, default=FINGERPRINT_WORKERS,
+                        help='Processes used to decode and fingerprint')
+    args = parser.parse_args()
+
+    fingerprint_index.workers = args.workers
+    try:
+        summary = fingerprint_index.scan(args.roots)
+    except FingerprintUnavailable as e:
+        sys.exit(str(e))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
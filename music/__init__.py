@@ -5,6 +5,10 @@ Song Info Finder - A Flask application for finding and editing MP3 metadata.
 from flask import Flask
 import os
 
+from music.config import (ARTWORK_HOSTS, COMPRESS_MIN_SIZE, JOB_INLINE_WAIT, LIBRARY_ROOTS,
+                          LIBRARY_WATCH, SERVER_TIMING, SLOW_REQUEST_THRESHOLD,
+                          TEMPLATES_AUTO_RELOAD, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_SIZE, UPLOAD_TTL)
+
 
 def create_app(config=None):
     """Application factory pattern for Flask app."""
@@ -13,9 +17,21 @@ def create_app(config=None):
     # Default configuration
     app.config.update(
         UPLOAD_FOLDER='uploads',
+        UPLOAD_MAX_SIZE=UPLOAD_MAX_SIZE,
+        UPLOAD_CHUNK_SIZE=UPLOAD_CHUNK_SIZE,
+        UPLOAD_TTL=UPLOAD_TTL,
         SECRET_KEY='a_very_secret_key',
         ALLOWED_EXTENSIONS={'mp3'},
-        SEARCH_TERMS=['title', 'artist', 'album']
+        SEARCH_TERMS=['title', 'artist', 'album'],
+        SERVER_TIMING=SERVER_TIMING,
+        SLOW_REQUEST_THRESHOLD=SLOW_REQUEST_THRESHOLD,
+        # None checks templates for changes only in debug mode; production keeps them compiled
+        TEMPLATES_AUTO_RELOAD=TEMPLATES_AUTO_RELOAD,
+        COMPRESS_MIN_SIZE=COMPRESS_MIN_SIZE,
+        LIBRARY_ROOTS=LIBRARY_ROOTS,
+        LIBRARY_WATCH=LIBRARY_WATCH,
+        JOB_INLINE_WAIT=JOB_INLINE_WAIT,
+        ARTWORK_HOSTS=ARTWORK_HOSTS
     )
 
     # Override with custom config if provided
@@ -30,4 +46,9 @@ def create_app(config=None):
     from music.routes import main_bp
     app.register_blueprint(main_bp)
 
+    # Index the configured library roots and keep following changes
+    if app.config['LIBRARY_ROOTS'] and app.config['LIBRARY_WATCH']:
+        from music.services.library import start_watcher
+        start_watcher(app.config['LIBRARY_ROOTS'])
+
     return app
@@ -0,0 +1,409 @@
+"""
+Batch tagging pipeline for whole music libraries.
+
+Files are discovered lazily and processed in fixed-size windows: tags are read
+in a process pool, iTunes is queried through a bounded thread pool, and every
+file gets one line in a JSONL report as soon as it is done. The report doubles
+as the checkpoint, so an interrupted run picks up where it stopped.
+
+Before matching, the audio of every file is hashed (see music.services.dedupe).
+Only one of several copies of a recording is searched for; the others get its
+match.
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from music.config import (BATCH_FETCH_CONCURRENCY, BATCH_REPORT_DIR, BATCH_WINDOW,
+                          BATCH_WORKERS, RESULTS_LIMIT_DEFAULT, SAVE_WORKERS, SEARCH_TERMS)
+from music.modules import TAG_FRAMES, AudioTags
+from music.services.albums import group_albums, match_album
+from music.services.dedupe import duplicate_index
+from music.services.fingerprint import identify_untagged
+from music.services.itunes_api import get_song_info
+from music.services.jobs import jobs
+from music.services.rate_limit import BATCH, lane
+from music.utils.logger import get_logger
+from music.utils.matching import is_confident, rank_candidates
+from music.utils.thumbnail import get_artwork
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = get_logger()
+
+
+def iter_audio_files(root: str, extensions: set = None):
+    """
+    Walk a directory tree and yield audio file paths in a stable order.
+
+    :param root: directory to scan
+    :param extensions: allowed extensions without the dot (default: mp3)
+    """
+    extensions = extensions or {'mp3'}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions:
+                yield os.path.join(dirpath, filename)
+
+
+def read_tags(filepath: str) -> dict:
+    """Read the tags of one file; runs inside the worker processes."""
+    return AudioTags(filepath).to_dict()
+
+
+def load_checkpoint(report_path: str) -> set:
+    """
+    Get the files already recorded in a report.
+
+    A truncated last line left by a crash is ignored, so that file is redone.
+
+    :param report_path: JSONL report of a previous run
+    :return: set of finished file paths
+    """
+    done = set()
+    if not os.path.exists(report_path):
+        return done
+    with open(report_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['filepath'])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def match_file(tags: dict, limit: int = RESULTS_LIMIT_DEFAULT) -> dict:
+    """
+    Search iTunes for one file and pick the best scoring candidate.
+
+    A file without any of the search terms is first looked up in the local
+    fingerprint index, and searched for with the tags of the file it matches.
+
+    :param tags: local tags as returned by AudioTags.to_dict
+    :param limit: number of candidates to request
+    :return: report record for the file
+    """
+    record = {"filepath": tags.get("filepath"), "tags": tags, "status": "unmatched",
+              "score": 0.0, "auto": False, "candidates": 0, "match": None}
+    search_terms = [tags.get(t) for t in SEARCH_TERMS if tags.get(t)]
+    if not search_terms:
+        tags = dict(tags)
+        identified = identify_untagged(tags, SEARCH_TERMS)
+        if identified is None:
+            record["status"] = "no_tags"
+            return record
+        record.update(tags=tags, identified_as=identified["path"])
+        search_terms = [tags.get(t) for t in SEARCH_TERMS if tags.get(t)]
+    try:
+        # Batch lookups give way to interactive searches for iTunes quota
+        with lane(BATCH):
+            candidates = get_song_info(search_terms, limit=limit)
+    except Exception as e:
+        record.update(status="error", error=str(e))
+        return record
+    record["candidates"] = len(candidates)
+    ranked = rank_candidates(tags, candidates)
+    if ranked:
+        score, best = ranked[0]
+        record.update(status="matched", score=round(score, 4), auto=is_confident(score),
+                      match=best)
+    return record
+
+
+def match_group(group: list, limit: int = RESULTS_LIMIT_DEFAULT) -> list:
+    """
+    Match a group of files from group_albums, as one album when it has several.
+
+    Files that cannot be placed confidently on the album's tracklist, and
+    whole albums that cannot be resolved, are matched one by one.
+
+    :param group: local tags of the files
+    :param limit: number of candidates to request
+    :return: report records in group order
+    """
+    if len(group) == 1:
+        return [match_file(group[0], limit)]
+    try:
+        with lane(BATCH):
+            collection_id, tracklist, assigned = match_album(group, limit)
+    except Exception as e:
+        return [{"filepath": tags.get("filepath"), "tags": tags, "status": "error",
+                 "score": 0.0, "auto": False, "candidates": 0, "match": None, "error": str(e)}
+                for tags in group]
+    records = []
+    for tags, (score, track) in zip(group, assigned):
+        if track is None:
+            records.append(match_file(tags, limit))
+            continue
+        records.append({"filepath": tags.get("filepath"), "tags": tags, "status": "matched",
+                        "score": round(score, 4), "auto": is_confident(score),
+                        "candidates": len(tracklist), "match": track,
+                        "collection_id": collection_id})
+    return records
+
+
+def save_file(filepath: str, tags: dict, artwork: bytes = None) -> dict:
+    """
+    Apply tag edits and cover art to one file in a single atomic write.
+
+    Fields missing from ``tags`` keep their current value; empty strings clear them.
+
+    :param filepath: MP3 file to update
+    :param tags: new values keyed by tag name (title, artist ...)
+    :param artwork: image data for the front cover, or None to keep the current one
+    :return: status record for the file
+    """
+    record = {"filepath": filepath, "status": "saved", "error": None}
+    unknown = sorted(set(tags) - set(TAG_FRAMES))
+    if unknown:
+        return dict(record, status="error", error=f"Unknown tag fields: {', '.join(unknown)}")
+    if not filepath or not os.path.isfile(filepath):
+        return dict(record, status="not_found", error="File not found.")
+    started = time.perf_counter()
+    try:
+        audio = AudioTags(filepath, lazy=True)
+        for field, value in tags.items():
+            setattr(audio, field, value)
+        report = audio.save(artwork=artwork, atomic=True)
+    except Exception as e:
+        log.error(f"Could not save {filepath} -> {e}")
+        return dict(record, status="error", error=str(e))
+    record["elapsed_seconds"] = round(time.perf_counter() - started, 4)
+    record["bytes_written"] = report["bytes_written"]
+    return record
+
+
+def save_many(edits: list, workers: int = SAVE_WORKERS) -> list:
+    """
+    Save tag edits to many files in parallel, one atomic write per file.
+
+    Artwork may be given as image data or as a URL; each distinct URL is
+    fetched and prepared once. A file whose artwork cannot be fetched is not
+    written at all.
+
+    :param edits: list of dicts with filepath, tags and optional artwork
+    :param workers: number of files written concurrently
+    :return: one status record per edit, in order
+    """
+    urls = {e.get("artwork") for e in edits if isinstance(e.get("artwork"), str) and e.get("artwork")}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {url: pool.submit(get_artwork, url) for url in urls}
+        artwork = {}
+        for url, future in futures.items():
+            try:
+                artwork[url] = future.result()
+            except Exception as e:
+                artwork[url] = e
+
+        def save(edit):
+            data = edit.get("artwork") or None
+            if isinstance(data, str):
+                data = artwork[data]
+                if isinstance(data, Exception):
+                    return {"filepath": edit.get("filepath"), "status": "error",
+                            "error": f"Could not fetch artwork: {data}"}
+            return save_file(edit.get("filepath"), edit.get("tags") or {}, data)
+
+        return list(pool.map(save, edits))
+
+
+def peak_memory_mb() -> float | None:
+    """Peak resident memory of this process in megabytes, if the OS reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def _terminate_last_line(report_path: str):
+    # A crash can leave a partial line behind; start the next record on a new one
+    if not os.path.exists(report_path) or not os.path.getsize(report_path):
+        return
+    with open(report_path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def _windows(iterable, size: int):
+    window = []
+    for item in iterable:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _split_copies(tags_list: list, digests: dict, shared: set, known: dict) -> tuple[list, list]:
+    # One file per recording is searched for, the best tagged one; recordings
+    # matched in an earlier window are not searched for again
+    best = {}
+    for tags in tags_list:
+        digest = digests.get(tags["filepath"])
+        if digest in shared and digest not in known:
+            terms = sum(1 for t in SEARCH_TERMS if tags.get(t))
+            if digest not in best or terms > best[digest][0]:
+                best[digest] = (terms, tags)
+    searched = {tags["filepath"] for _, tags in best.values()}
+    to_match, copies = [], []
+    for tags in tags_list:
+        digest = digests.get(tags["filepath"])
+        if digest in shared and tags["filepath"] not in searched:
+            copies.append(tags)
+        else:
+            to_match.append(tags)
+    return to_match, copies
+
+
+def _match_window(tags_list: list, fetcher, limit: int, albums: bool, summary: dict,
+                  digests: dict, shared: set, known: dict) -> dict:
+    to_match, copies = _split_copies(tags_list, digests, shared, known)
+    groups = group_albums(to_match) if albums else [[t] for t in to_match]
+    records = {}
+    for group_records in fetcher.map(lambda g: match_group(g, limit), groups):
+        if any(r.get("collection_id") for r in group_records):
+            summary["albums"] += 1
+        records.update((r["filepath"], r) for r in group_records)
+
+    for tags in to_match:
+        record, digest = records[tags["filepath"]], digests.get(tags["filepath"])
+        if digest in shared and digest not in known and record["status"] == "matched":
+            known[digest] = {k: v for k, v in record.items() if k != "tags"}
+    unresolved = []
+    for tags in copies:
+        source = known.get(digests[tags["filepath"]])
+        if source is None:
+            unresolved.append(tags)
+            continue
+        records[tags["filepath"]] = dict(source, filepath=tags["filepath"], tags=tags,
+                                         duplicate_of=source["filepath"])
+        summary["duplicates"] += 1
+    # Copies of a recording that found no match are searched for with their own tags
+    for record in fetcher.map(lambda t: match_file(t, limit), unresolved):
+        records[record["filepath"]] = record
+    return records
+
+
+def run_batch(root: str, report_path: str, workers: int = BATCH_WORKERS,
+              fetch_concurrency: int = BATCH_FETCH_CONCURRENCY, window: int = BATCH_WINDOW,
+              limit: int = RESULTS_LIMIT_DEFAULT, resume: bool = True, albums: bool = True,
+              dedupe: bool = True, progress=None) -> dict:
+    """
+    Match every audio file under a directory against iTunes.
+
+    :param root: directory to scan
+    :param report_path: JSONL report, appended to and used as checkpoint
+    :param workers: processes used to read tags (0 reads in this process)
+    :param fetch_concurrency: maximum concurrent iTunes lookups
+    :param window: number of files read and matched per step
+    :param limit: candidates requested per file
+    :param resume: skip files already present in the report
+    :param albums: match the tracks of an album together (see music.services.albums)
+    :param dedupe: search once for copies of one recording (see music.services.dedupe)
+    :param progress: optional callable receiving the running summary
+    :return: summary with counts, throughput and peak memory
+    """
+    done = load_checkpoint(report_path) if resume else set()
+    directory = os.path.dirname(report_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    if resume:
+        _terminate_last_line(report_path)
+
+    summary = {"root": root, "report": report_path, "processed": 0,
+               "skipped": 0, "matched": 0, "errors": 0, "albums": 0, "duplicates": 0}
+    started = time.perf_counter()
+
+    def pending():
+        for path in iter_audio_files(root):
+            if path in done:
+                summary["skipped"] += 1
+            else:
+                yield path
+
+    reader = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    fetcher = ThreadPoolExecutor(max_workers=max(1, fetch_concurrency))
+    # Matches of recordings with several copies, by audio digest
+    shared, known = set(), {}
+    try:
+        if dedupe:
+            # Copies can be anywhere in the library, so every file is hashed up front;
+            # only new and changed files are actually read
+            hashed = duplicate_index.add_files(
+                [p for p in iter_audio_files(root) if p not in done], executor=reader)
+            summary["hashed"] = hashed["hashed"]
+            shared = duplicate_index.shared_digests()
+        with open(report_path, 'a' if resume else 'w', encoding='utf-8') as report:
+            for paths in _windows(pending(), window):
+                if reader:
+                    tags_list = list(reader.map(read_tags, paths, chunksize=16))
+                else:
+                    tags_list = [read_tags(p) for p in paths]
+                digests = duplicate_index.digests(paths) if shared else {}
+                records = _match_window(tags_list, fetcher, limit, albums, summary,
+                                        digests, shared, known)
+                # Report in file order, whatever the grouping
+                for record in (records[t.get("filepath")] for t in tags_list):
+                    report.write(json.dumps(record) + '\n')
+                    summary["processed"] += 1
+                    if record["status"] == "matched":
+                        summary["matched"] += 1
+                    elif record["status"] == "error":
+                        summary["errors"] += 1
+                report.flush()
+                if progress:
+                    progress(dict(summary))
+    finally:
+        fetcher.shutdown()
+        if reader:
+            reader.shutdown()
+
+    elapsed = time.perf_counter() - started
+    summary["elapsed_seconds"] = round(elapsed, 3)
+    summary["files_per_second"] = round(summary["processed"] / elapsed, 2) if elapsed else 0.0
+    summary["peak_memory_mb"] = peak_memory_mb()
+    log.info(f"Batch finished: {summary}")
+    return summary
+
+
+def start_batch_job(root: str, report_name: str = None, **options) -> str:
+    """
+    Run a batch as a background job.
+
+    Reports always go to BATCH_REPORT_DIR; naming an existing report resumes it.
+
+    :param root: directory to scan
+    :param report_name: file name of the JSONL report (default: a new one)
+    :return: job id to poll with get_batch_job
+    :raises ValueError: if report_name is not a plain file name
+    """
+    if report_name is not None and (not report_name or secure_filename(report_name) != report_name):
+        raise ValueError(f"Invalid report name: {report_name!r}")
+    report_path = os.path.join(BATCH_REPORT_DIR, report_name or f"{uuid.uuid4().hex}.jsonl")
+    return jobs.submit('batch', run_batch, root, report_path, progress=True, **options)
+
+
+def get_batch_job(job_id: str) -> dict | None:
+    """
+    Get a batch job's state, or None if unknown.
+
+    The summary is the final one once the job has finished, the running one before.
+    """
+    job = jobs.get(job_id)
+    if job is None or job["kind"] != 'batch':
+        return None
+    summary = job["result"] or job["progress"] or {}
+    return {"id": job["id"], "status": job["status"], "summary": summary, "error": job["error"]}
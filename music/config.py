@@ -12,6 +12,114 @@ SEARCH_TERMS = ['title', 'artist', 'album']
 # App Defaults
 RESULTS_LIMIT_DEFAULT = int(os.environ.get('RESULTS_LIMIT_DEFAULT', 5))
 
+# Local data directory for caches and indexes
+DATA_DIR = os.environ.get('MUSIC_FINDER_DATA', '.music_finder')
+
+# iTunes API Configuration
+ITUNES_BASE_URL = os.environ.get('ITUNES_BASE_URL', 'https://itunes.apple.com')
+
+# Matching Configuration
+AUTO_TAG_THRESHOLD = float(os.environ.get('AUTO_TAG_THRESHOLD', 0.85))
+
+# Search Variant Configuration
+SEARCH_CONCURRENCY = int(os.environ.get('SEARCH_CONCURRENCY', 8))
+SEARCH_BUDGET = float(os.environ.get('SEARCH_BUDGET', 4.0))
+
+# HTTP Client Configuration
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 20))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 10))
+
+# iTunes Rate Limit Configuration (0 disables the limiter)
+ITUNES_RATE_LIMIT = float(os.environ.get('ITUNES_RATE_LIMIT', 20))  # calls per minute
+ITUNES_RATE_BURST = int(os.environ.get('ITUNES_RATE_BURST', 5))
+# Tokens one search leaves in the bucket for other users' searches when picking its query variants
+SEARCH_TOKEN_RESERVE = int(os.environ.get('SEARCH_TOKEN_RESERVE', 2))
+
+# Search Result Cache Configuration
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 512))
+SEARCH_CACHE_DISK_SIZE = int(os.environ.get('SEARCH_CACHE_DISK_SIZE', 50000))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 7 * 24 * 60 * 60))
+SEARCH_CACHE_PATH = os.environ.get(
+    'SEARCH_CACHE_PATH', os.path.join(DATA_DIR, 'search_cache.db'))
+
+# Local Catalog Configuration
+CATALOG_PATH = os.environ.get('CATALOG_PATH', os.path.join(DATA_DIR, 'catalog.db'))
+
+# Library Index Configuration
+LIBRARY_ROOTS = [p for p in os.environ.get('LIBRARY_ROOTS', '').split(os.pathsep) if p]
+LIBRARY_DB_PATH = os.environ.get('LIBRARY_DB_PATH', os.path.join(DATA_DIR, 'library.db'))
+LIBRARY_POLL_INTERVAL = float(os.environ.get('LIBRARY_POLL_INTERVAL', 30))
+LIBRARY_WORKERS = int(os.environ.get('LIBRARY_WORKERS', os.cpu_count() or 1))
+LIBRARY_PAGE_SIZE = int(os.environ.get('LIBRARY_PAGE_SIZE', 50))
+LIBRARY_WATCH = os.environ.get('LIBRARY_WATCH', 'true').lower() in ('1', 'true', 'yes')
+
+# Tag Writing Configuration: padding reserved in new tags, and growth when one outgrows its space
+ID3_PADDING = int(os.environ.get('ID3_PADDING', 16 * 1024))
+ID3_PADDING_GROWTH = float(os.environ.get('ID3_PADDING_GROWTH', 1.5))
+
+# Fingerprint Configuration (decoding needs ffmpeg)
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+FINGERPRINT_DB_PATH = os.environ.get(
+    'FINGERPRINT_DB_PATH', os.path.join(DATA_DIR, 'fingerprints.db'))
+FINGERPRINT_SECONDS = float(os.environ.get('FINGERPRINT_SECONDS', 30))
+FINGERPRINT_THRESHOLD = float(os.environ.get('FINGERPRINT_THRESHOLD', 0.9))
+FINGERPRINT_WORKERS = int(os.environ.get('FINGERPRINT_WORKERS', os.cpu_count() or 1))
+
+# Upload Configuration: largest file, bytes copied per read and lifetime of idle uploads
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 1024 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 64 * 1024))
+UPLOAD_TTL = int(os.environ.get('UPLOAD_TTL', 24 * 60 * 60))
+
+# Duplicate Detection Configuration
+DEDUPE_DB_PATH = os.environ.get('DEDUPE_DB_PATH', os.path.join(DATA_DIR, 'digests.db'))
+DEDUPE_WORKERS = int(os.environ.get('DEDUPE_WORKERS', os.cpu_count() or 1))
+
+# Artwork Configuration
+ARTWORK_CACHE_DIR = os.environ.get(
+    'ARTWORK_CACHE_DIR', os.path.join(DATA_DIR, 'artwork'))
+ARTWORK_MAX_SIZE = int(os.environ.get('ARTWORK_MAX_SIZE', 1000))
+ARTWORK_QUALITY = int(os.environ.get('ARTWORK_QUALITY', 90))
+ARTWORK_WORKERS = int(os.environ.get('ARTWORK_WORKERS', 4))
+# Largest total size of the artwork cache in bytes, and seconds a cached file is kept
+ARTWORK_CACHE_MAX_BYTES = int(os.environ.get('ARTWORK_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+ARTWORK_CACHE_TTL = int(os.environ.get('ARTWORK_CACHE_TTL', 30 * 24 * 60 * 60))
+# Hosts the artwork proxy fetches from (subdomains included), separated by commas
+ARTWORK_HOSTS = [h.strip().lower() for h in os.environ.get('ARTWORK_HOSTS', 'mzstatic.com').split(',')
+                 if h.strip()]
+
+# Batch Tagging Configuration
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_FETCH_CONCURRENCY = int(os.environ.get('BATCH_FETCH_CONCURRENCY', 4))
+BATCH_WINDOW = int(os.environ.get('BATCH_WINDOW', 256))
+BATCH_REPORT_DIR = os.environ.get(
+    'BATCH_REPORT_DIR', os.path.join(DATA_DIR, 'reports'))
+SAVE_WORKERS = int(os.environ.get('SAVE_WORKERS', 4))
+
+# Background Job Configuration
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 8))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 10 * 60))
+JOB_MAX_RETAINED = int(os.environ.get('JOB_MAX_RETAINED', 1000))
+# How long a page waits for its search before rendering without results
+JOB_INLINE_WAIT = float(os.environ.get('JOB_INLINE_WAIT', 0.5))
+# Seconds between keep-alive comments on an idle event stream
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+
+# Instrumentation Configuration
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 1.0))
+
+# Response Configuration
+# Unset follows debug mode: templates reload in the dev server and are compiled once otherwise
+TEMPLATES_AUTO_RELOAD = (os.environ['TEMPLATES_AUTO_RELOAD'].lower() in ('1', 'true', 'yes')
+                         if os.environ.get('TEMPLATES_AUTO_RELOAD') else None)
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
 # Flask Configuration
 SECRET_KEY = os.environ.get('SECRET_KEY', 'a_very_secret_key')
 
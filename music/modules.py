@@ -1,12 +1,48 @@
 from typing import Any
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
+from mutagen.id3 import APIC, ID3, Frames, ID3NoHeaderError, MakeID3v1
 from music.utils.datetime import format_time
+from music.utils.logger import get_logger
+from music.utils.metrics import timed
+from music.utils.mpeg import id3v2_size, read_stream_info
+from music.utils.tagwriter import needed_size, padding_for, record_save, write_tag
 import datetime
+import io
+import os
+import shutil
+import tempfile
+
+log = get_logger()
+
+# ID3 frames behind each tag attribute, as mapped by mutagen's EasyID3
+TAG_FRAMES = {
+    'title': 'TIT2',
+    'artist': 'TPE1',
+    'album': 'TALB',
+    'genre': 'TCON',
+    'tracknumber': 'TRCK',
+    'discnumber': 'TPOS',
+    'albumartist': 'TPE2',
+    'composer': 'TCOM',
+    'date': 'TDRC',
+}
+
+
+def _year(value: datetime.datetime | str | Any) -> str:
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y')
+    elif value is not None:
+        return str(value)[:4]
+    return ''
 
 
 class AudioTags:
-    def __init__(self, filepath: str = None):
+    def __init__(self, filepath: str = None, lazy: bool = False):
+        """
+        Read the tags of an MP3 file with a single open.
+
+        :param filepath: file to read, or None for an empty record
+        :param lazy: defer parsing MPEG frame info until bitrate or duration is used
+        """
         self.filepath = filepath
         self.title = None
         self.artist = None
@@ -17,9 +53,13 @@ class AudioTags:
         self.albumartist = None
         self.composer = None
         self._date = None
-        self.bitrate = None
-        self.duration = None
-        self._extract_metadata()
+        self._bitrate = None
+        self._duration = None
+        self._duration_exact = None
+        self._id3 = None
+        self._audio_offset = None
+        self._stream_loaded = not filepath or not lazy
+        self._extract_metadata(lazy)
 
     @property
     def date(self):
@@ -27,12 +67,34 @@ class AudioTags:
 
     @date.setter
     def date(self, value: datetime.datetime | str | Any):
-        if isinstance(value, datetime.datetime):
-            self._date = value.strftime('%Y')
-        elif value is not None:
-            self._date = str(value)[:4]
-        else:
-            self._date = ''
+        self._date = _year(value)
+
+    @property
+    def bitrate(self):
+        if not self._stream_loaded:
+            self._load_stream_info()
+        return self._bitrate
+
+    @bitrate.setter
+    def bitrate(self, value):
+        self._bitrate = value
+
+    @property
+    def duration(self):
+        if not self._stream_loaded:
+            self._load_stream_info()
+        return self._duration
+
+    @duration.setter
+    def duration(self, value):
+        self._duration = value
+
+    @property
+    def duration_exact(self):
+        """Whether the duration comes from a frame count in the file rather than an estimate."""
+        if not self._stream_loaded:
+            self._load_stream_info()
+        return self._duration_exact
 
     @property
     def str_bitrate(self):
@@ -42,37 +104,144 @@ class AudioTags:
     def str_duration(self):
         return format_time(self.duration)
 
-    def _extract_metadata(self):
+    def _extract_metadata(self, lazy: bool = False):
         if not self.filepath:
             return
         try:
-            audio = EasyID3(self.filepath)
-            self.title = audio.get("title", [None])[0]
-            self.artist = audio.get("artist", [None])[0]
-            self.album = audio.get("album", [None])[0]
-            self.genre = audio.get("genre", [None])[0]
-            self.tracknumber = audio.get("tracknumber", [None])[0]
-            self.discnumber = audio.get("discnumber", [None])[0]
-            self.albumartist = audio.get("albumartist", [None])[0]
-            self.composer = audio.get("composer", [None])[0]
-            self.date = audio.get("date", [None])[0]  # Use 'date' tag for year
-
-            # Get bitrate and duration using MP3
-            audio_mp3 = MP3(self.filepath)
-            self.bitrate = int(
-                audio_mp3.info.bitrate / 1000) if audio_mp3.info.bitrate else 0
-            self.duration = audio_mp3.info.length or 0
+            with timed('tag_read'), open(self.filepath, 'rb') as fileobj:
+                try:
+                    self._id3 = ID3(fileobj)
+                    self._audio_offset = self._id3.size
+                except ID3NoHeaderError:
+                    self._id3 = None
+                self._read_frames()
+                if not lazy:
+                    # Continue from the end of the tag in the same open file
+                    self._read_stream_info(fileobj)
+
+        except Exception as e:
+            log.warning(f"Could not read metadata of {self.filepath} -> {e}")
 
+    def _read_frames(self):
+        for field in TAG_FRAMES:
+            setattr(self, field, self._frame_text(field))
+
+    def _frame_text(self, field: str):
+        frame = self._id3.get(TAG_FRAMES[field]) if self._id3 is not None else None
+        if frame is None or not frame.text:
+            return None
+        if field == 'genre':
+            return frame.genres[0] if frame.genres else None
+        return str(frame.text[0])
+
+    def _read_stream_info(self, fileobj):
+        # Header-first: a few small reads, whatever the size of the file
+        info = read_stream_info(fileobj, self._audio_offset)
+        if self._bitrate is None:
+            self._bitrate = int(info.bitrate / 1000) if info.bitrate else 0
+        if self._duration is None:
+            self._duration = info.duration or 0
+            self._duration_exact = info.exact
+
+    def _load_stream_info(self):
+        self._stream_loaded = True
+        try:
+            with timed('tag_read'), open(self.filepath, 'rb') as fileobj:
+                self._read_stream_info(fileobj)
         except Exception as e:
-            print(f"Error reading metadata: {e}")
+            log.warning(f"Could not read stream info of {self.filepath} -> {e}")
+
+    def save(self, artwork: bytes = None, artwork_mime: str = 'image/jpeg', atomic: bool = False):
+        """
+        Write the current tag values to the file.
+
+        Text frames and the optional front cover go out in one tag write, reusing
+        the tag parsed when this object was created.
+
+        :param artwork: image data to embed as the front cover, replacing any other
+        :param artwork_mime: MIME type of the artwork
+        :param atomic: never move the audio in place: a tag that fits the current
+            tag and padding is overwritten where it is, a larger one goes into a
+            complete new file that is renamed over the original, so a crash never
+            leaves a half-moved file behind
+        :return: report with bytes_written, in_place, tag_size and padding
+        """
+        id3 = self._id3 if self._id3 is not None else ID3()
+        for field, frame_id in TAG_FRAMES.items():
+            value = self.get(field)
+            id3.delall(frame_id)
+            if value not in (None, ''):
+                id3.add(Frames[frame_id](encoding=3, text=[str(value)]))
+        if artwork is not None:
+            id3.delall('APIC')
+            id3.add(APIC(
+                encoding=3,  # 3 = utf-8
+                mime=artwork_mime,
+                type=3,  # 3 = cover image
+                desc='Cover',
+                data=artwork
+            ))
+        with timed('id3_save'):
+            needed = needed_size(id3) if atomic else None
+            if atomic and needed > self._tag_space():
+                report = self._save_atomic(id3, needed)
+            else:
+                report = write_tag(id3, self.filepath)
+        self._id3 = id3
+        self._audio_offset = report["tag_size"]
+        return report
+
+    def _tag_space(self) -> int:
+        with open(self.filepath, 'rb') as f:
+            return id3v2_size(f.read(10))
+
+    def _save_atomic(self, id3: ID3, needed: int) -> dict:
+        # Render the tag alone, with room to grow, then stream tag + audio (+ refreshed
+        # ID3v1) into a temp file in the same directory: one sequential write of the file
+        buffer = io.BytesIO()
+        id3.save(buffer, v1=0, v2_version=3, padding=lambda info: padding_for(needed))
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with open(self.filepath, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                audio_start = id3v2_size(src.read(10))
+                end = src.seek(0, os.SEEK_END)
+                has_v1 = False
+                if end - audio_start >= 128:
+                    src.seek(end - 128)
+                    has_v1 = src.read(3) == b'TAG'
+                if has_v1:
+                    end -= 128
+                dst.write(buffer.getvalue())
+                src.seek(audio_start)
+                remaining = end - audio_start
+                while remaining > 0:
+                    chunk = src.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+                if has_v1:
+                    dst.write(MakeID3v1(id3))
+                dst.flush()
+                os.fsync(dst.fileno())
+            shutil.copymode(self.filepath, temp_path)
+            os.replace(temp_path, self.filepath)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        written = os.path.getsize(self.filepath)
+        record_save('rewrite', written)
+        return {"bytes_written": written, "in_place": False, "tag_size": len(buffer.getvalue()),
+                "padding": padding_for(needed)}
 
     def parse(self, data: dict):
         for key, value in data.items():
             if hasattr(self, key):
                 setattr(self, key, value)
             else:
-                print(
-                    f"Warning: {key} is not a valid attribute of AudioTags. Skipping.")
+                log.warning(f"{key} is not a valid attribute of AudioTags. Skipping.")
 
     def itunes_parse(self, data: dict):
         """
@@ -126,9 +295,6 @@ class AudioTags:
     def __getitem__(self, item):
         return getattr(self, item, None)
 
-    def __getstate__(self):
-        return self.to_dict()
-
     def __json__(self):
         return self.to_dict()
 
@@ -158,8 +324,190 @@ class ExtendedAudioTags(AudioTags):
         d["thumbnailUrl"] = self.thumbnailUrl
         return d
 
-    def __getstate__(self):
+    def __json__(self):
         return self.to_dict()
 
+
+class AudioRecord:
+    """
+    Compact, slotted counterpart of AudioTags for holding many records at once.
+
+    It has the same accessors as AudioTags but never touches the file system, and
+    caches the formatted duration. Build one from an AudioTags with ``from_tags``.
+    """
+    FIELDS = ('filepath', 'title', 'artist', 'album', 'genre', 'tracknumber', 'discnumber',
+              'albumartist', 'composer', 'date', 'bitrate', 'duration')
+    __slots__ = ('filepath', 'title', 'artist', 'album', 'genre', 'tracknumber', 'discnumber',
+                 'albumartist', 'composer', '_date', 'bitrate', 'duration', '_str_duration')
+
+    def __init__(self, filepath: str = None, title=None, artist=None, album=None, genre=None,
+                 tracknumber=None, discnumber=None, albumartist=None, composer=None,
+                 date=None, bitrate=None, duration=None):
+        self.filepath = filepath
+        self.title = title
+        self.artist = artist
+        self.album = album
+        self.genre = genre
+        self.tracknumber = tracknumber
+        self.discnumber = discnumber
+        self.albumartist = albumartist
+        self.composer = composer
+        self._date = None if date is None else _year(date)
+        self.bitrate = bitrate
+        self.duration = duration
+        self._str_duration = None
+
+    @classmethod
+    def from_tags(cls, tags: 'AudioTags | dict'):
+        """
+        Build a record from an AudioTags object or its dictionary form.
+        """
+        get = tags.get
+        return cls(**{field: get(field) for field in cls.FIELDS})
+
+    @property
+    def date(self):
+        return self._date
+
+    @date.setter
+    def date(self, value: datetime.datetime | str | Any):
+        self._date = _year(value)
+
+    @property
+    def str_bitrate(self):
+        return f"{self.bitrate} kbps"
+
+    @property
+    def str_duration(self):
+        cached = self._str_duration
+        if cached is None or cached[0] != self.duration:
+            cached = self._str_duration = (self.duration, format_time(self.duration))
+        return cached[1]
+
+    def parse(self, data: dict):
+        for key, value in data.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+            else:
+                log.warning(f"{key} is not a valid attribute of {type(self).__name__}. Skipping.")
+
+    def itunes_parse(self, data: dict):
+        """
+        Parse metadata from a dictionary, typically from an iTunes API response.
+        """
+        self.title = data.get("trackName", None)
+        self.artist = data.get("artistName", None)
+        self.albumartist = data.get("artistName", None)
+        self.album = data.get("collectionName", None)
+        self.genre = data.get("primaryGenreName", None)
+        self.tracknumber = data.get("trackNumber", None)
+        self.discnumber = data.get("discNumber", None)
+        self.date = data.get("releaseDate")
+
+    def to_tuple(self) -> tuple:
+        """
+        Get the stored fields in FIELDS order.
+        """
+        return (self.filepath, self.title, self.artist, self.album, self.genre,
+                self.tracknumber, self.discnumber, self.albumartist, self.composer,
+                self._date, self.bitrate, self.duration)
+
+    def to_dict(self):
+        """
+        Convert the metadata attributes to a dictionary.
+        """
+        return {
+            "filepath": self.filepath,
+            "title": self.title,
+            "artist": self.artist,
+            "album": self.album,
+            "genre": self.genre,
+            "tracknumber": self.tracknumber,
+            "discnumber": self.discnumber,
+            "albumartist": self.albumartist,
+            "composer": self.composer,
+            "date": self._date,
+            "bitrate": self.bitrate,
+            "str_bitrate": f"{self.bitrate} kbps",
+            "duration": self.duration,
+            "str_duration": self.str_duration,
+        }
+
+    def get(self, key, default=None):
+        """
+        Get the value of a metadata attribute by key.
+        If the key does not exist, return the default value.
+        """
+        return getattr(self, key, default)
+
+    def __getitem__(self, item):
+        return getattr(self, item, None)
+
     def __json__(self):
         return self.to_dict()
+
+    def __repr__(self):
+        return f"AudioRecord({self.filepath!r}, title={self.title!r}, artist={self.artist!r})"
+
+    def __str__(self):
+        return f"Audio: {self.title} - {self.artist}"
+
+
+class ExtendedAudioRecord(AudioRecord):
+    """
+    Slotted counterpart of ExtendedAudioTags.
+    """
+    FIELDS = AudioRecord.FIELDS + ('thumbnailUrl',)
+    __slots__ = ('thumbnailUrl',)
+
+    def __init__(self, *args, thumbnailUrl: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.thumbnailUrl = thumbnailUrl
+
+    def itunes_parse(self, data: dict):
+        """
+        Parse metadata from a dictionary, typically from an iTunes API response.
+        """
+        super().itunes_parse(data)
+        self.thumbnailUrl = data.get("artworkUrl1000",
+                                     data.get("artworkUrl100", '')
+                                     .replace("100x100", "1000x1000"))
+
+    def to_tuple(self) -> tuple:
+        return super().to_tuple() + (self.thumbnailUrl,)
+
+    def to_dict(self):
+        d = super().to_dict()
+        d["thumbnailUrl"] = self.thumbnailUrl
+        return d
+
+
+def records_to_rows(records: list, fields: tuple = None) -> list:
+    """
+    Export records as a list of tuples, one per record.
+
+    :param records: AudioRecord (or AudioTags) objects
+    :param fields: fields to export, defaults to the FIELDS of the first record
+    :return: list of tuples in field order
+    """
+    if not records:
+        return []
+    fields = fields or getattr(records[0], 'FIELDS', AudioRecord.FIELDS)
+    if fields == getattr(records[0], 'FIELDS', None):
+        return [r.to_tuple() for r in records]
+    return [tuple(r.get(f) for f in fields) for r in records]
+
+
+def records_to_columns(records: list, fields: tuple = None) -> dict:
+    """
+    Export records as a struct of arrays: one list of values per field.
+
+    :param records: AudioRecord (or AudioTags) objects
+    :param fields: fields to export, defaults to the FIELDS of the first record
+    :return: dict mapping each field to its column of values
+    """
+    if not records:
+        return {field: [] for field in (fields or AudioRecord.FIELDS)}
+    fields = fields or getattr(records[0], 'FIELDS', AudioRecord.FIELDS)
+    rows = records_to_rows(records, fields)
+    return {field: list(column) for field, column in zip(fields, zip(*rows))}
@@ -3,19 +3,39 @@ Flask routes for the Song Info Finder application.
 """
 
 import builtins
-import re
 import os
-from flask import Blueprint, render_template, request, jsonify, render_template_string, current_app, session, redirect, url_for
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3NoHeaderError
-from requests.exceptions import ConnectionError
+import time
+from flask import (Blueprint, Response, render_template, request, jsonify, current_app, session, redirect,
+                   send_file, url_for, g, stream_with_context)
+from requests.exceptions import ConnectionError, RequestException, Timeout
 
+from music.batch import get_batch_job, save_file, save_many, start_batch_job
 from music.modules import AudioTags, ExtendedAudioTags
-from music.services.itunes_api import get_song_info
-from music.config import RESULTS_LIMIT_DEFAULT
-from music.utils.thumbnail import embed_thumbnail, download_thumbnail
+from music.services import itunes_api
+from music.services.async_search import search_variants
+from music.services.fingerprint import identify_untagged
+from music.services.jobs import jobs
+from music.services.rate_limit import RateLimitTimeout
+from music.services.library import get_watcher, library_index
+from music.services.uploads import UploadError, UploadStore
+from music.config import LIBRARY_PAGE_SIZE, RESULTS_LIMIT_DEFAULT, STREAM_HEARTBEAT
+from music.utils import metrics
+from music.utils.compression import gzip_response, should_compress
+from music.utils.logger import get_logger, log_slow_request
+from music.utils.matching import rank_candidates
+from music.utils.metrics import timed
+from music.utils.sse import KEEP_ALIVE, sse_event
+from music.utils.thumbnail import VARIANTS, allowed_artwork_url, get_artwork, get_artwork_variant
 
 main_bp = Blueprint('main', __name__)
+log = get_logger()
+
+# Editable tag fields posted by the metadata form
+FORM_FIELDS = ['title', 'artist', 'album', 'genre', 'tracknumber', 'discnumber', 'albumartist', 'date']
+# Failures that mean iTunes could not be reached in time, by the error_type jobs record
+UNREACHABLE_ERRORS = (ConnectionError, Timeout, RateLimitTimeout)
+UNREACHABLE_ERROR_TYPES = {'ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout',
+                           'RateLimitTimeout'}
 
 
 def allowed_file(filename):
@@ -23,6 +43,144 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 
+@main_bp.before_app_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.metrics_token = metrics.start_request()
+
+
+@main_bp.after_app_request
+def finish_request_timing(response):
+    """Record request latency, add Server-Timing and log slow requests."""
+    if 'metrics_token' not in g:
+        return response
+    duration = time.perf_counter() - g.request_started
+    timings = metrics.end_request(g.pop('metrics_token'))
+    endpoint = request.endpoint or 'unknown'
+    metrics.request_seconds.observe(duration, endpoint)
+    metrics.requests_total.inc(endpoint, response.status_code)
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings, duration)
+    log_slow_request({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'duration': round(duration, 4),
+        'stages': {stage: round(seconds, 4) for stage, (seconds, _) in timings.items()},
+    }, current_app.config['SLOW_REQUEST_THRESHOLD'])
+    return response
+
+
+@main_bp.after_app_request
+def compress_response(response):
+    """Gzip text and JSON responses for clients that accept it."""
+    if request.accept_encodings['gzip'] and should_compress(
+            response, current_app.config['COMPRESS_MIN_SIZE']):
+        gzip_response(response)
+    return response
+
+
+@main_bp.app_template_global()
+def artwork_url(url, size='small'):
+    """Cover art URL for display, through the resizing artwork proxy."""
+    return url_for('main.artwork', url=url, size=size) if url else url
+
+
+def read_metadata(filepath):
+    """Read a file's tags, from the library index when the file is in the library."""
+    roots = current_app.config['LIBRARY_ROOTS']
+    if roots and library_index.covers(filepath, roots):
+        return library_index.load_tags(filepath)
+    return AudioTags(filepath)
+
+
+def build_results(metadata, song_info):
+    """Rank iTunes results against the file's tags and convert them for the template."""
+    results = []
+    for score, data in rank_candidates(metadata, song_info):
+        extend_audio = ExtendedAudioTags()
+        extend_audio.itunes_parse(data)
+        result = extend_audio.to_dict()
+        result['score'] = round(score, 3)
+        results.append(result)
+    return results
+
+
+def run_search(metadata, limit, search_terms, progress=None):
+    """
+    Search iTunes for a file's tags and rank what comes back; runs as a background job.
+
+    :param progress: called with ``{'results': [...]}`` each time a query variant
+                     brings new candidates, in arrival order
+    :return: the file's metadata, ranked results and the tags suggested by a
+             fingerprint match, which are never written into metadata
+    """
+    # The page may be rendering metadata while this runs: search with a copy of
+    # the tags and hand back what a fingerprint match filled in as suggestions
+    tags = metadata.to_dict()
+    suggested = {}
+    # Untagged files give the search nothing to go on; try to recognise them locally first
+    if identify_untagged(tags, search_terms):
+        suggested = {field: tags[field] for field in FORM_FIELDS
+                     if tags.get(field) and not metadata.get(field)}
+    streamed, seen = [], set()
+
+    def publish(variant_results):
+        fresh = []
+        for data in variant_results:
+            key = data.get('trackId', id(data))
+            if key not in seen:
+                seen.add(key)
+                fresh.append(data)
+        if fresh:
+            streamed.extend(build_results(tags, fresh))
+            progress({'results': list(streamed)})
+
+    with timed('search'):
+        song_info = search_variants(tags, limit=limit, search_terms=search_terms,
+                                    on_results=publish if progress else None)
+    return {'metadata': metadata, 'results': build_results(tags, song_info), 'suggested': suggested}
+
+
+def run_save(filepath, tags, thumbnail_url=None, mark_saved=False):
+    """
+    Save tag edits and cover art to one file; runs as a background job.
+
+    :param filepath: MP3 file to update
+    :param tags: new values keyed by tag name
+    :param thumbnail_url: artwork to embed; a failed download keeps the current cover
+    :param mark_saved: record the file as saved in the library index
+    :return: status record from save_file
+    """
+    artwork = None
+    if thumbnail_url:
+        try:
+            artwork = get_artwork(thumbnail_url)
+        except Exception as e:
+            log.warning(f"Could not embed thumbnail: {e}")
+    record = save_file(filepath, tags, artwork)
+    if record['status'] != 'saved':
+        raise RuntimeError(record['error'])
+    if mark_saved:
+        library_index.set_status([filepath], 'saved')
+    log.info(f"Metadata saved for {filepath}")
+    return record
+
+
+def submit_search(metadata):
+    """Queue a search for the given tags with the session's result limit."""
+    return jobs.submit('search', run_search, metadata,
+                       session.get('results_limit', RESULTS_LIMIT_DEFAULT),
+                       current_app.config['SEARCH_TERMS'], progress=True)
+
+
+def job_accepted(job_id):
+    """Answer a job submission with the URL to poll."""
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('main.job_status', job_id=job_id)}), 202
+
+
 @main_bp.route('/', methods=['GET', 'POST'])
 def index():
     """Main route for file upload and processing."""
@@ -40,31 +198,35 @@ def index():
             return render_template('index.html', error='Invalid file type. Only MP3 files are allowed.')
 
         try:
+            metadata = read_metadata(filepath)
             if is_refresh:
-                # Use posted values for metadata
-                metadata = AudioTags(filepath)
                 # Overwrite with posted values
-                for field in ['title', 'artist', 'album', 'genre', 'tracknumber', 'discnumber', 'albumartist', 'date']:
+                for field in FORM_FIELDS:
                     val = request.form.get(field)
                     if val is not None:
                         setattr(metadata, field, val)
+
+            # Search in the background; render right away if it is quick,
+            # otherwise let the page fetch the results when they are ready
+            job = jobs.wait(submit_search(metadata), current_app.config['JOB_INLINE_WAIT'])
+            if job['status'] == 'failed':
+                if job['error_type'] in UNREACHABLE_ERROR_TYPES:
+                    return render_template('index.html', error='No internet connection.')
+                return render_template('index.html', error=f"Error processing file: {job['error']}")
+            if job['status'] == 'finished':
+                results, search_job_url, search_events_url = job['result']['results'], None, None
+                suggested = job['result']['suggested']
             else:
-                metadata = AudioTags(filepath)
-
-            # Use the current metadata fields for searching
-            search_terms = [metadata.get(
-                t) for t in current_app.config['SEARCH_TERMS'] if metadata.get(t)]
-            # Determine results limit from session or default
-            results_limit = session.get('results_limit', RESULTS_LIMIT_DEFAULT)
-            song_info = get_song_info(search_terms, limit=results_limit)
-            results = []
-            for data in song_info:
-                extend_audio = ExtendedAudioTags()
-                extend_audio.itunes_parse(data)
-                results.append(extend_audio.to_dict())
-
-            return render_template('results.html', metadata=metadata, results=results, enumerate=builtins.enumerate)
-        except ConnectionError:
+                results, suggested = [], {}
+                search_job_url = url_for('main.job_status', job_id=job['id'])
+                search_events_url = url_for('main.job_event_stream', job_id=job['id'])
+
+            with timed('render'):
+                return render_template('results.html', metadata=metadata, results=results,
+                                       suggested=suggested, search_job_url=search_job_url,
+                                       search_events_url=search_events_url,
+                                       enumerate=builtins.enumerate)
+        except UNREACHABLE_ERRORS:
             return render_template('index.html', error='No internet connection.')
         except Exception as e:
             return render_template('index.html', error=f'Error processing file: {str(e)}')
@@ -101,50 +263,72 @@ def save_metadata():
     if not filepath or not os.path.exists(filepath):
         return ("Error: File not found.", 404) if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest' else render_template('results.html', metadata=None, results=[], error='File not found.')
 
-    try:
-        audio = EasyID3(filepath)
-    except ID3NoHeaderError:
-        audio = EasyID3()
-        audio.save(filepath, v2_version=3)
-        audio = EasyID3(filepath)
-    except Exception as e:
-        print(f"Error opening file for editing: {e}")
-        return ("Error: Could not open file for editing.", 500) if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest' else render_template('results.html', metadata=None, results=[], error='Could not open file for editing.')
+    # Text frames only are parsed here; MPEG frame info is read on demand
+    audio = AudioTags(filepath, lazy=True)
 
     # Update metadata fields
-    audio['title'] = request.form.get('title', '')
-    audio['artist'] = request.form.get('artist', '')
-    audio['album'] = request.form.get('album', '')
-    audio['genre'] = request.form.get('genre', '')
-    audio['tracknumber'] = request.form.get('tracknumber', '')
-    audio['discnumber'] = request.form.get('discnumber', '')
-    audio['albumartist'] = request.form.get('albumartist', '')
-    audio['date'] = request.form.get('date', '')
+    for field in ['title', 'artist', 'album', 'genre', 'tracknumber', 'discnumber', 'albumartist', 'date']:
+        setattr(audio, field, request.form.get(field, ''))
+
+    # Fetch cover art if thumbnailUrl is provided, so it is written together with the text
+    artwork = None
+    if thumbnail_url:
+        try:
+            artwork = get_artwork(thumbnail_url)
+        except Exception as e:
+            log.warning(f"Could not embed thumbnail: {e}")
 
     try:
-        audio.save(v2_version=3)
-        print(f"Metadata saved for {filepath}")
-
-        # Embed cover art if thumbnailUrl is provided
-        if thumbnail_url:
-            try:
-                thumb_path = download_thumbnail(thumbnail_url)
-                embed_thumbnail(filepath, thumb_path)
-                print(f"Thumbnail embedded for {filepath}")
-            except Exception as e:
-                print(f"Warning: Could not embed thumbnail: {e}")
+        report = audio.save(artwork=artwork)
+        if current_app.config['LIBRARY_ROOTS']:
+            library_index.set_status([filepath], 'saved')
+        log.info(f"Metadata saved for {filepath} ({report['bytes_written']} bytes written, "
+                 f"{'in place' if report['in_place'] else 'file rewritten'})")
+        if artwork is not None:
+            log.info(f"Thumbnail embedded for {filepath}")
 
         if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({'success': True, 'message': 'Metadata saved successfully.'})
-        return render_template('results.html', metadata=AudioTags(filepath), results=[], success='Metadata saved successfully.')
+            return jsonify({'success': True, 'message': 'Metadata saved successfully.',
+                            'bytes_written': report['bytes_written']})
+        return render_template('results.html', metadata=audio, results=[], success='Metadata saved successfully.')
     except Exception as e:
-        print(f"Error saving metadata: {e}")
+        log.error(f"Error saving metadata: {e}")
         return ("Error: Could not save metadata.", 500) if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest' else render_template('results.html', metadata=None, results=[], error='Could not save metadata.')
 
 
+@main_bp.route('/save_metadata/batch', methods=['POST'])
+def save_metadata_batch():
+    """
+    Save tag edits to many files at once.
+
+    Expects JSON ``{"edits": [{"filepath": ..., "tags": {...}, "thumbnailUrl": ...}]}``
+    and answers with one status record per edit.
+    """
+    data = request.get_json(silent=True) or {}
+    edits = data.get('edits')
+    if not isinstance(edits, list) or not edits or not all(isinstance(e, dict) for e in edits):
+        return jsonify({'success': False, 'message': 'Expected a non-empty list of edits.'}), 400
+
+    results = save_many([{
+        'filepath': edit.get('filepath'),
+        'tags': edit.get('tags') or {},
+        'artwork': edit.get('thumbnailUrl') or None,
+    } for edit in edits])
+    saved = sum(1 for r in results if r['status'] == 'saved')
+    if current_app.config['LIBRARY_ROOTS']:
+        library_index.set_status([r['filepath'] for r in results if r['status'] == 'saved'], 'saved')
+    log.info(f"Batch save: {saved} of {len(results)} files saved")
+    return jsonify({'success': saved == len(results), 'saved': saved, 'results': results})
+
+
 @main_bp.route('/refresh_metadata', methods=['POST'])
 def refresh_metadata():
-    """Refresh metadata search results."""
+    """
+    Search again with edited fields and return the new results section.
+
+    Answers with the rendered section under ``html``, or with the raw results
+    and metadata when called with ``?format=json``.
+    """
     filepath = request.form.get('filepath')
 
     # Get current form values for the search
@@ -154,35 +338,377 @@ def refresh_metadata():
 
     try:
         # Use the updated metadata fields for searching
-        search_terms = [form_data['title'],
-                        form_data['artist'], form_data['album']]
-        song_info = get_song_info([t for t in search_terms if t])
-        results = []
-        for data in song_info:
-            extend_audio = ExtendedAudioTags()
-            extend_audio.itunes_parse(data)
-            results.append(extend_audio.to_dict())
+        results_limit = session.get('results_limit', RESULTS_LIMIT_DEFAULT)
+        with timed('search'):
+            song_info = search_variants(
+                form_data, limit=results_limit, search_terms=current_app.config['SEARCH_TERMS'])
 
         # Create a temporary metadata object with the current form values
-        metadata = AudioTags(filepath)
+        metadata = read_metadata(filepath)
         for field, val in form_data.items():
             if val is not None:
                 setattr(metadata, field, val)
+        results = build_results(metadata, song_info)
 
-        # Render only the #results-section as HTML
-        results_html = render_template_string(
-            '{% include "results.html" %}',
-            metadata=metadata,
-            results=results,
-            enumerate=enumerate
-        )
+        if request.args.get('format') == 'json':
+            return jsonify({'success': True, 'metadata': metadata.to_dict(), 'results': results})
 
-        # Extract only the #results-section div
-        match = re.search(
-            r'<div id="results-section">([\s\S]*?)</div>', results_html)
-        section_html = '<div id="results-section">' + \
-            match.group(1) + '</div>' if match else ''
+        # Render only the results section, from its own cached template
+        with timed('render'):
+            section_html = render_template(
+                'components/results_section.html',
+                metadata=metadata,
+                results=results,
+                enumerate=builtins.enumerate
+            )
 
         return jsonify({'success': True, 'html': section_html})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
+
+
+@main_bp.route('/jobs/search', methods=['POST'])
+def search_job():
+    """Start searching iTunes for the posted fields; poll the returned status_url."""
+    filepath = request.form.get('filepath')
+    if not filepath or not os.path.exists(filepath):
+        return jsonify({'success': False, 'message': 'File not found.'}), 404
+
+    metadata = read_metadata(filepath)
+    for field in FORM_FIELDS:
+        val = request.form.get(field)
+        if val is not None:
+            setattr(metadata, field, val)
+    return job_accepted(submit_search(metadata))
+
+
+@main_bp.route('/jobs/save', methods=['POST'])
+def save_job():
+    """Start saving the posted fields and cover art; poll the returned status_url."""
+    filepath = request.form.get('filepath')
+    if not filepath or not os.path.exists(filepath):
+        return jsonify({'success': False, 'message': 'File not found.'}), 404
+
+    tags = {field: request.form.get(field, '') for field in FORM_FIELDS}
+    return job_accepted(jobs.submit('save', run_save, filepath, tags,
+                                    request.form.get('thumbnailUrl') or None,
+                                    bool(current_app.config['LIBRARY_ROOTS'])))
+
+
+def render_results_section(result):
+    with timed('render'):
+        return render_template('components/results_section.html', metadata=result['metadata'],
+                               results=result['results'], suggested=result.get('suggested'),
+                               enumerate=builtins.enumerate)
+
+
+def job_events(job_id):
+    """
+    Server-sent events for a job.
+
+    A search streams its candidates as they arrive: an ``artwork`` event with
+    the cover URLs of each new batch comes first, so the browser can start
+    fetching them, then one ``result`` event per candidate. Other jobs send
+    ``progress`` events. Every stream ends with ``done`` (a finished search
+    carries its rendered results section) or ``error``.
+    """
+    sent = 0
+    for job in jobs.follow(job_id, heartbeat=STREAM_HEARTBEAT):
+        if job is None:
+            yield KEEP_ALIVE
+            continue
+        if job['kind'] == 'search':
+            results = (job['progress'] or {}).get('results', [])
+            if len(results) > sent:
+                fresh = results[sent:]
+                yield sse_event('artwork', {'urls': [artwork_url(r['thumbnailUrl'])
+                                                     for r in fresh if r.get('thumbnailUrl')]})
+                for index, result in enumerate(fresh, sent):
+                    yield sse_event('result', {'index': index, **result,
+                                               'coverUrl': artwork_url(result.get('thumbnailUrl'))})
+                sent = len(results)
+        elif job['progress'] is not None:
+            yield sse_event('progress', job['progress'])
+
+        if job['status'] == 'failed':
+            yield sse_event('error', {'message': job['error']})
+        elif job['status'] == 'finished':
+            if job['kind'] == 'search':
+                yield sse_event('done', {'count': len(job['result']['results']),
+                                         'html': render_results_section(job['result'])})
+            else:
+                yield sse_event('done', {'result': job['result']})
+
+
+def event_stream(job_id):
+    return Response(stream_with_context(job_events(job_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@main_bp.route('/search/stream', methods=['GET'])
+def search_stream():
+    """
+    Search iTunes for a file's tags and stream the candidates as server-sent events.
+
+    Fields given in the query string (title, artist ...) replace the file's own.
+    """
+    filepath = request.args.get('filepath')
+    if not filepath or not os.path.exists(filepath):
+        return jsonify({'success': False, 'message': 'File not found.'}), 404
+
+    metadata = read_metadata(filepath)
+    for field in FORM_FIELDS:
+        val = request.args.get(field)
+        if val is not None:
+            setattr(metadata, field, val)
+    return event_stream(submit_search(metadata))
+
+
+@main_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_event_stream(job_id):
+    """Follow a background job as server-sent events."""
+    if jobs.get(job_id) is None:
+        return jsonify({'success': False, 'message': 'Unknown or expired job.'}), 404
+    return event_stream(job_id)
+
+
+@main_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Get the state of a background job.
+
+    A finished search answers with the rendered results section under
+    ``html``, or with the raw results and metadata under ``result`` when
+    called with ``?format=json``. Other jobs answer with their result as is.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown or expired job.'}), 404
+
+    data = {key: job[key] for key in ('id', 'kind', 'status', 'progress', 'error',
+                                      'created_at', 'started_at', 'finished_at')}
+    result = job['result']
+    if job['status'] == 'finished' and job['kind'] == 'search':
+        if request.args.get('format') == 'json':
+            data['result'] = {'metadata': result['metadata'].to_dict(), 'results': result['results'],
+                              'suggested': result['suggested']}
+        else:
+            data['html'] = render_results_section(result)
+    else:
+        data['result'] = result
+    return jsonify({'success': True, **data})
+
+
+@main_bp.route('/batch', methods=['POST'])
+def start_batch():
+    """Start tagging every MP3 under a directory in the background."""
+    data = request.get_json(silent=True) or request.form
+    root = data.get('root')
+
+    if not root or not os.path.isdir(root):
+        return jsonify({'success': False, 'message': 'Directory not found.'}), 404
+
+    try:
+        job_id = start_batch_job(root, report_name=data.get('report') or None)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'The report must be a plain file name.'}), 400
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('main.batch_status', job_id=job_id)}), 202
+
+
+@main_bp.route('/batch/<job_id>', methods=['GET'])
+def batch_status(job_id):
+    """Get progress and summary of a batch job."""
+    job = get_batch_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown job.'}), 404
+    return jsonify({'success': True, **job})
+
+
+@main_bp.route('/artwork', methods=['GET'])
+def artwork():
+    """
+    Serve cover art at a display size (``small``, ``medium`` or ``large``).
+
+    Variants are cached on disk and carry a strong ETag, and browsers may keep
+    them for a year: the same URL and size always give the same image.
+    """
+    url = request.args.get('url', '')
+    size = request.args.get('size', 'small')
+    if size not in VARIANTS:
+        return jsonify({'success': False, 'message': f"Size must be one of {', '.join(VARIANTS)}."}), 400
+    if not allowed_artwork_url(url, current_app.config['ARTWORK_HOSTS']):
+        return jsonify({'success': False, 'message': 'Artwork host not allowed.'}), 403
+    try:
+        etag, data = get_artwork_variant(url, VARIANTS[size])
+    except Exception as e:
+        log.warning(f"Could not get artwork from {url} -> {e}")
+        return jsonify({'success': False, 'message': 'Could not fetch artwork.'}), 502
+
+    response = Response(data, mimetype='image/jpeg')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@main_bp.route('/catalog/artist/<int:artist_id>', methods=['POST'])
+def ingest_artist(artist_id):
+    """Add an artist's whole discography to the local catalog."""
+    try:
+        music = itunes_api.get_music_by_artist_id(artist_id)
+    except RateLimitTimeout:
+        return jsonify({'success': False, 'message': 'iTunes is busy, try again later.'}), 503
+    except RequestException:
+        return jsonify({'success': False, 'message': 'Could not reach iTunes.'}), 502
+    return jsonify({'success': True, 'artist_id': artist_id, 'ingested': len(music)})
+
+
+@main_bp.route('/catalog/search', methods=['GET'])
+def catalog_search():
+    """Search the local catalog only, without going to iTunes."""
+    term = request.args.get('q', '')
+    limit = request.args.get('limit', RESULTS_LIMIT_DEFAULT, type=int)
+    if itunes_api.catalog is None:
+        return jsonify({'success': False, 'message': 'Catalog is disabled.'}), 404
+    return jsonify({'success': True, 'results': itunes_api.catalog.search(term, limit)})
+
+
+@main_bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Export latency histograms and counters in the Prometheus text format."""
+    return metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@main_bp.route('/library', methods=['GET'])
+def library():
+    """Paginated, searchable listing of the indexed music library."""
+    query = request.args.get('q', '').strip()
+    status = request.args.get('status', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(500, max(1, request.args.get('per_page', LIBRARY_PAGE_SIZE, type=int)))
+    files, total = library_index.list(query or None, status or None, page, per_page)
+    watcher = get_watcher()
+
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'files': files, 'total': total, 'page': page,
+                        'per_page': per_page,
+                        'watcher': watcher.status() if watcher else None})
+
+    pages = max(1, -(-total // per_page))
+    return render_template('library.html', files=files, total=total, page=page, pages=pages,
+                           per_page=per_page, query=query, status=status,
+                           stats=library_index.stats(), watcher=watcher.status() if watcher else None)
+
+
+@main_bp.route('/library/scan', methods=['POST'])
+def library_scan():
+    """Ask the library watcher for a full incremental rescan."""
+    watcher = get_watcher()
+    if watcher is None:
+        return jsonify({'success': False, 'message': 'No library roots are configured.'}), 404
+    watcher.request_scan()
+    return jsonify({'success': True, 'watcher': watcher.status()}), 202
+
+
+def upload_store():
+    """Upload store configured from the app."""
+    config = current_app.config
+    return UploadStore(config['UPLOAD_FOLDER'], max_size=config['UPLOAD_MAX_SIZE'],
+                       chunk_size=config['UPLOAD_CHUNK_SIZE'], ttl=config['UPLOAD_TTL'],
+                       extensions=config['ALLOWED_EXTENSIONS'])
+
+
+def upload_response(upload, status=200):
+    """Upload status as JSON, with the offset to resume from in Upload-Offset."""
+    body = dict(upload, upload_url=url_for('main.upload_status', upload_id=upload['id']))
+    response = jsonify({'success': True, 'upload': body})
+    response.headers['Upload-Offset'] = str(upload['offset'])
+    return response, status
+
+
+def upload_error(error):
+    body = {'success': False, 'message': str(error)}
+    response = jsonify(body if error.upload is None else dict(body, upload=error.upload))
+    if error.upload is not None:
+        response.headers['Upload-Offset'] = str(error.upload['offset'])
+    return response, error.status
+
+
+@main_bp.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start one or more uploads.
+
+    Expects JSON ``{"filename": ..., "size": ...}``, or ``{"files": [...]}`` of
+    those for several files. Send each file's bytes to its ``upload_url``.
+    """
+    data = request.get_json(silent=True) or {}
+    files = data.get('files') if 'files' in data else [data]
+    if not isinstance(files, list) or not files or not all(isinstance(f, dict) for f in files):
+        return jsonify({'success': False, 'message': 'Expected a filename and size.'}), 400
+
+    store, created = upload_store(), []
+    try:
+        for f in files:
+            created.append(store.create(f.get('filename'), f.get('size')))
+    except UploadError as e:
+        # All or nothing, so a client can fix its request and send it again
+        for upload in created:
+            store.delete(upload['id'])
+        return upload_error(e)
+    if 'files' not in data:
+        return upload_response(created[0], 201)
+    return jsonify({'success': True, 'uploads': [
+        dict(u, upload_url=url_for('main.upload_status', upload_id=u['id'])) for u in created]}), 201
+
+
+@main_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    """
+    Append the request body to an upload, starting at the Upload-Offset header.
+
+    The body is written to disk as it arrives. A request whose offset does not
+    match the server's gets 409 with the offset to resume from.
+    """
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({'success': False, 'message': 'Missing Upload-Offset header.'}), 400
+    try:
+        upload = upload_store().append(upload_id, request.stream, offset, request.content_length)
+    except UploadError as e:
+        return upload_error(e)
+    return upload_response(upload)
+
+
+@main_bp.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Get an upload's offset, and its path and tags once complete."""
+    try:
+        return upload_response(upload_store().get(upload_id))
+    except UploadError as e:
+        return upload_error(e)
+
+
+@main_bp.route('/uploads/<upload_id>/file', methods=['GET'])
+def download_upload(upload_id):
+    """Download a completed upload, with any tags saved to it since."""
+    try:
+        upload = upload_store().get(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    if not upload['complete']:
+        return jsonify({'success': False, 'message': 'The upload is not complete.'}), 409
+    return send_file(os.path.abspath(upload['filepath']), mimetype='audio/mpeg', as_attachment=True,
+                     download_name=upload['filename'])
+
+
+@main_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    """Remove an upload and its file."""
+    try:
+        upload_store().delete(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True})
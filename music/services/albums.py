@@ -0,0 +1,121 @@
+"""
+Album-level matching: one collection lookup for all the tracks of a folder.
+
+Files in one directory that share an album and album artist tag are matched
+together. One search for a single track resolves the album's ``collectionId``,
+one ``lookup`` fetches its full tracklist, and every file is then assigned to
+a track locally by track number, disc number, duration and title. A 12-track
+album costs 2 calls instead of 12, and all its files get the same album
+metadata.
+"""
+import os
+
+from music.config import AUTO_TAG_THRESHOLD, SEARCH_TERMS
+from music.services.itunes_api import get_album_tracks, get_song_info
+from music.utils.matching import LocalFeatures, is_confident, rank_candidates, score_candidate
+
+# Smaller groups are cheaper to match track by track
+MIN_TRACKS = 3
+
+
+def _normalized(value) -> str:
+    return ' '.join(str(value or '').lower().split())
+
+
+def album_key(tags: dict) -> tuple | None:
+    """
+    Get the key grouping a file with the other tracks of its album.
+
+    The track artist is left out so compilations stay in one group.
+
+    :param tags: local tags as returned by AudioTags.to_dict
+    :return: (directory, album, album artist), or None for a file without album
+    """
+    album = _normalized(tags.get('album'))
+    if not album:
+        return None
+    directory = os.path.dirname(tags.get('filepath') or '')
+    return directory, album, _normalized(tags.get('albumartist'))
+
+
+def group_albums(tags_list: list, min_tracks: int = MIN_TRACKS) -> list:
+    """
+    Split files into album groups and single files.
+
+    :param tags_list: local tags of the files
+    :param min_tracks: smallest group matched as an album
+    :return: list of groups in order of first file; single files are groups of one
+    """
+    groups = {}
+    for index, tags in enumerate(tags_list):
+        key = album_key(tags)
+        groups.setdefault(key if key else index, []).append(tags)
+    result = []
+    for key, group in groups.items():
+        if isinstance(key, tuple) and len(group) >= min_tracks:
+            result.append(group)
+        else:
+            result.extend([tags] for tags in group)
+    return result
+
+
+def resolve_collection(group: list, limit: int) -> int | None:
+    """
+    Find the iTunes album of a group with a single search.
+
+    The best tagged file is searched for; its best match must be confident.
+
+    :param group: local tags of the album's files
+    :param limit: candidates requested
+    :return: collectionId, or None when no confident match was found
+    """
+    tags = max(group, key=lambda t: sum(1 for field in SEARCH_TERMS if t.get(field)))
+    search_terms = [tags.get(t) for t in SEARCH_TERMS if tags.get(t)]
+    ranked = rank_candidates(tags, get_song_info(search_terms, limit=limit))
+    if not ranked or not is_confident(ranked[0][0]):
+        return None
+    return ranked[0][1].get('collectionId')
+
+
+def assign_tracks(group: list, tracklist: list, threshold: float = AUTO_TAG_THRESHOLD) -> list:
+    """
+    Pair local files with the tracks of an album, each track used at most once.
+
+    Pairs are taken greedily from the highest score down. A file without a
+    confident pair is left unassigned rather than given a leftover track.
+
+    :param group: local tags of the album's files
+    :param tracklist: iTunes tracks of the album
+    :param threshold: minimum confidence of a pair
+    :return: one (score, track) pair per file in group order, (0.0, None) if unassigned
+    """
+    features = [LocalFeatures(tags) for tags in group]
+    pairs = sorted(((score_candidate(f, track), i, j)
+                    for i, f in enumerate(features) for j, track in enumerate(tracklist)),
+                   key=lambda pair: -pair[0])
+    assigned = [(0.0, None)] * len(group)
+    used_files, used_tracks = set(), set()
+    for score, i, j in pairs:
+        if i in used_files or j in used_tracks or score < threshold:
+            continue
+        assigned[i] = (score, tracklist[j])
+        used_files.add(i)
+        used_tracks.add(j)
+    return assigned
+
+
+def match_album(group: list, limit: int) -> tuple[int | None, list, list]:
+    """
+    Match the files of one album with two iTunes calls.
+
+    :param group: local tags of the album's files
+    :param limit: candidates requested by the resolving search
+    :return: collectionId (None if unresolved), the tracklist and the
+        (score, track) pairs from assign_tracks; files without a confident
+        track are unassigned
+    """
+    collection_id = resolve_collection(group, limit)
+    if collection_id is None:
+        return None, [], [(0.0, None)] * len(group)
+    tracklist = get_album_tracks(collection_id)
+    return collection_id, tracklist, assign_tracks(group, tracklist)
@@ -0,0 +1,180 @@
+"""
+Concurrent multi-query search against the iTunes API.
+
+One noisy tag (usually the album) is enough to make a single combined query
+come back empty, so several query variants are issued at once and their
+results merged. Blocking HTTP calls run on a shared, bounded thread pool driven
+by asyncio; the pool size is the global limit on in-flight searches across all
+requests.
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from music.config import SEARCH_BUDGET, SEARCH_CONCURRENCY, SEARCH_TERMS, SEARCH_TOKEN_RESERVE
+from music.services import itunes_api, rate_limit
+from music.utils.logger import get_logger
+from music.utils.matching import confident_match
+
+log = get_logger()
+
+_executor = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix='search')
+
+
+def build_variants(tags, search_terms: list = None) -> list:
+    """
+    Build the query variants for a set of tags, most specific first.
+
+    :param tags: AudioTags or dict with title, artist and album
+    :param search_terms: fields combined into the primary query (default: SEARCH_TERMS)
+    :return: list of dicts with name, term and entity
+    """
+    title, artist, album = tags.get('title'), tags.get('artist'), tags.get('album')
+    primary = [tags.get(t) for t in (search_terms or SEARCH_TERMS)]
+    candidates = [
+        ("all", primary, "musicTrack"),
+        ("title_artist", [title, artist], "musicTrack"),
+        ("title", [title], "musicTrack"),
+        ("artist_album", [artist, album], "musicTrack"),
+        ("title_artist_song", [title, artist], "song"),
+    ]
+    variants, seen = [], set()
+    for name, terms, entity in candidates:
+        term = ' '.join(str(t) for t in terms if t)
+        key = (' '.join(term.lower().split()), entity)
+        if not key[0] or key in seen:
+            continue
+        seen.add(key)
+        variants.append({"name": name, "term": term, "entity": entity})
+    return variants
+
+
+def merge_results(result_lists: list, limit: int = None) -> list:
+    """
+    Merge result lists in order, dropping repeated trackIds.
+
+    :param result_lists: lists of iTunes results, highest priority first
+    :param limit: maximum number of merged results
+    :return: merged list
+    """
+    merged, seen = [], set()
+    for results in result_lists:
+        for result in results:
+            track_id = result.get('trackId')
+            if track_id is not None:
+                if track_id in seen:
+                    continue
+                seen.add(track_id)
+            merged.append(result)
+    return merged[:limit] if limit else merged
+
+
+def affordable_variants(variants: list) -> list:
+    """
+    Keep the variants, most specific first, that one search may spend tokens on.
+
+    The bucket is shared by every user: a search leaves SEARCH_TOKEN_RESERVE
+    tokens for other users' searches instead of spending the whole burst on
+    its variants. The first variant is always kept so a search is never
+    dropped outright.
+
+    :param variants: query variants from build_variants
+    :return: the variants worth issuing
+    """
+    limiter = itunes_api.service.rate_limiter
+    if limiter is None:
+        return variants
+    return variants[:max(1, int(limiter.status()["tokens"]) - SEARCH_TOKEN_RESERVE)]
+
+
+def _search_before(until: float, term: str, entity: str, limit: int) -> list:
+    # Runs on the executor: a variant still queued for a token when the
+    # search's budget runs out gives up instead of holding a thread
+    with rate_limit.deadline(until):
+        return itunes_api.search_tracks(term, entity, limit)
+
+
+async def search_async(tags, limit: int = 5, budget: float = SEARCH_BUDGET, enough: int = 1,
+                       confident=None, search_terms: list = None, on_results=None) -> list:
+    """
+    Run all query variants concurrently and merge what arrives within the budget.
+
+    Returns early once ``enough`` confident results are in. Variants still
+    running at that point are abandoned; their responses still fill the cache,
+    but none waits for a rate limit token past the budget. Only as many
+    variants are issued as the shared rate limiter can spare (see
+    affordable_variants), most specific first.
+
+    :param tags: AudioTags or dict with title, artist and album
+    :param limit: results requested per variant and returned overall
+    :param budget: latency budget in seconds
+    :param enough: number of confident results that ends the search early
+    :param confident: predicate on a result (default: confident_match)
+    :param search_terms: fields combined into the primary query
+    :param on_results: called with each variant's results as soon as that variant returns
+    :return: merged, deduplicated results
+    """
+    variants = build_variants(tags, search_terms)
+    if not variants:
+        return []
+    variants = affordable_variants(variants)
+    confident = confident or confident_match(tags)
+    loop = asyncio.get_running_loop()
+    until = time.monotonic() + budget
+    # run_in_executor does not carry context variables over: each variant runs
+    # in a copy of the caller's context, so it keeps the rate limit lane and
+    # reports its stage timings to the caller's request
+    tasks = {
+        asyncio.ensure_future(loop.run_in_executor(
+            _executor, contextvars.copy_context().run, _search_before, until, v["term"],
+            v["entity"], limit)): index
+        for index, v in enumerate(variants)
+    }
+    collected = [[] for _ in variants]
+    errors = []
+    pending = set(tasks)
+    deadline = loop.time() + budget
+    confident_ids = set()
+
+    while pending:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(
+            pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            index = tasks[task]
+            try:
+                collected[index] = task.result()
+            except Exception as e:
+                log.warning(f"Search variant {variants[index]['name']} failed -> {e}")
+                errors.append(e)
+                continue
+            if on_results is not None:
+                on_results(collected[index])
+            confident_ids.update(
+                r.get('trackId', id(r)) for r in collected[index] if confident(r))
+        if len(confident_ids) >= enough:
+            break
+
+    for task in pending:
+        task.cancel()
+    if pending:
+        log.debug(f"Search returned with {len(pending)} of {len(variants)} variants pending")
+
+    merged = merge_results(collected, limit)
+    if not merged and errors and len(errors) == len(variants):
+        raise errors[0]
+    return merged
+
+
+def search_variants(tags, limit: int = 5, **options) -> list:
+    """
+    Blocking entry point for search_async, for use from Flask views.
+
+    :param tags: AudioTags or dict with title, artist and album
+    :param limit: results requested per variant and returned overall
+    :return: merged, deduplicated results
+    """
+    return asyncio.run(search_async(tags, limit, **options))
@@ -0,0 +1,227 @@
+"""
+Result caches for iTunes lookups.
+
+A ``ResultCache`` is a stack of tiers checked in order. The default stack is an
+in-process LRU backed by an optional SQLite file so repeat searches survive a
+restart. Any object with ``get``, ``set`` and ``clear`` can be used as a tier.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from music.utils.logger import get_logger
+
+log = get_logger()
+
+
+def make_search_key(terms: list, limit: int, entity: str = 'musicTrack') -> str:
+    """
+    Build a cache key from search terms, a result limit and the searched entity.
+
+    Terms are lower-cased and whitespace-collapsed so that trivially different
+    spellings of the same query share an entry.
+
+    :param terms: list of search terms (title, artist, album ...)
+    :param limit: maximum number of results requested
+    :param entity: itunes entity searched for
+    :return: cache key
+    """
+    normalized = ' '.join(' '.join(str(t) for t in terms if t).lower().split())
+    return json.dumps([normalized, entity, int(limit)])
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at: float = None):
+        if self.max_entries <= 0:
+            return
+        if expires_at is None:
+            expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    """On-disk cache tier stored in a single SQLite file."""
+
+    def __init__(self, path: str, max_entries: int = 50000, ttl: float = 3600, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str):
+        return self.get_with_expiry(key)[0]
+
+    def get_with_expiry(self, key: str):
+        """Return ``(value, expires_at)`` so upper tiers can keep the same deadline."""
+        now = self.clock()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, None
+            if row[1] <= now:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                conn.commit()
+                return None, None
+            conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0], row[1]
+
+    def set(self, key: str, value: str, expires_at: float = None):
+        if self.max_entries <= 0:
+            return
+        now = self.clock()
+        if expires_at is None:
+            expires_at = now + self.ttl
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)", (key, value, expires_at, now))
+            conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+            count = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                overflow = count - self.max_entries
+                conn.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    "SELECT key FROM results ORDER BY accessed_at LIMIT ?)", (overflow,))
+                self.evictions += overflow
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM results")
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ResultCache:
+    """
+    Tiered cache of JSON-serializable results with hit/miss counters.
+
+    Values are stored serialized, so callers always get a fresh copy they are
+    free to mutate.
+    """
+
+    def __init__(self, *tiers):
+        self.tiers = [t for t in tiers if t is not None]
+        self.hits = 0
+        self.misses = 0
+        self.tier_hits = [0] * len(self.tiers)
+
+    def get(self, key: str):
+        for index, tier in enumerate(self.tiers):
+            expires_at = None
+            try:
+                if hasattr(tier, 'get_with_expiry'):
+                    value, expires_at = tier.get_with_expiry(key)
+                else:
+                    value = tier.get(key)
+            except (sqlite3.Error, OSError) as error:
+                log.error(f"Could not read from cache tier {tier!r} -> {error}")
+                continue
+            if value is None:
+                continue
+            # Promote to the faster tiers above this one
+            for upper in self.tiers[:index]:
+                upper.set(key, value, expires_at=expires_at)
+            self.hits += 1
+            self.tier_hits[index] += 1
+            return json.loads(value)
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value):
+        serialized = json.dumps(value)
+        for tier in self.tiers:
+            try:
+                tier.set(key, serialized)
+            except (sqlite3.Error, OSError) as error:
+                log.error(f"Could not write to cache tier {tier!r} -> {error}")
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self) -> dict:
+        """
+        Get cache counters.
+
+        :return: dict with hits, misses, per-tier hits and evictions
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "tiers": [
+                {
+                    "tier": type(tier).__name__,
+                    "hits": hits,
+                    "evictions": getattr(tier, 'evictions', 0),
+                }
+                for tier, hits in zip(self.tiers, self.tier_hits)
+            ],
+        }
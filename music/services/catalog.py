@@ -0,0 +1,194 @@
+"""
+Local catalog of iTunes tracks and collections.
+
+Every result that comes back from iTunes is ingested into a SQLite database,
+one row per track and per collection, keyed by their iTunes ids so repeated
+ingestion never duplicates anything. Track title, artist and album are indexed
+with FTS5, which gives prefix and full-text search over everything seen so far
+without touching the network.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from music.utils.logger import get_logger
+
+log = get_logger()
+
+_TOKEN = re.compile(r'\w+')
+
+
+def build_match_query(term: str) -> str | None:
+    """
+    Turn free text into an FTS5 query where every word must match as a prefix.
+
+    :param term: free-text search term
+    :return: FTS5 MATCH expression, or None if the term has no words
+    """
+    tokens = _TOKEN.findall(term.lower())
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+class Catalog:
+    """
+    SQLite store of iTunes results with full-text search.
+
+    Tracks and collections are stored as the raw iTunes JSON. Artists whose
+    discography has been ingested are remembered, so callers can tell a
+    complete local answer from a partial one.
+    """
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "track_id INTEGER PRIMARY KEY, collection_id INTEGER, artist_id INTEGER, "
+                "data TEXT NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist_id);"
+                "CREATE INDEX IF NOT EXISTS tracks_collection ON tracks (collection_id);"
+                "CREATE TABLE IF NOT EXISTS collections ("
+                "collection_id INTEGER PRIMARY KEY, artist_id INTEGER, "
+                "data TEXT NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS artists ("
+                "artist_id INTEGER PRIMARY KEY, ingested_at REAL NOT NULL);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5("
+                "title, artist, album, tokenize = 'unicode61 remove_diacritics 2');"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def ingest(self, results: list) -> int:
+        """
+        Store iTunes results, replacing earlier copies of the same tracks and collections.
+
+        Results that are neither tracks nor collections (artist wrappers ...)
+        are ignored.
+
+        :param results: raw iTunes results
+        :return: number of tracks and collections stored
+        """
+        now = self.clock()
+        stored = 0
+        with self._lock:
+            conn = self._connect()
+            for result in results:
+                wrapper = result.get('wrapperType')
+                if wrapper == 'track' and result.get('trackId') is not None:
+                    track_id = result['trackId']
+                    conn.execute(
+                        "INSERT OR REPLACE INTO tracks "
+                        "(track_id, collection_id, artist_id, data, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (track_id, result.get('collectionId'), result.get('artistId'),
+                         json.dumps(result), now))
+                    conn.execute("DELETE FROM tracks_fts WHERE rowid = ?", (track_id,))
+                    conn.execute(
+                        "INSERT INTO tracks_fts (rowid, title, artist, album) VALUES (?, ?, ?, ?)",
+                        (track_id, result.get('trackName') or '', result.get('artistName') or '',
+                         result.get('collectionName') or ''))
+                    stored += 1
+                elif wrapper == 'collection' and result.get('collectionId') is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO collections "
+                        "(collection_id, artist_id, data, updated_at) VALUES (?, ?, ?, ?)",
+                        (result['collectionId'], result.get('artistId'),
+                         json.dumps(result), now))
+                    stored += 1
+            conn.commit()
+        return stored
+
+    def mark_artist(self, artist_id: int):
+        """Record that an artist's whole discography has been ingested."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO artists (artist_id, ingested_at) VALUES (?, ?)",
+                         (int(artist_id), self.clock()))
+            conn.commit()
+
+    def ingested_artists(self, artist_ids) -> set:
+        """Get which of the given artists have their whole discography ingested."""
+        ids = [int(a) for a in set(artist_ids) if a is not None]
+        if not ids:
+            return set()
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT artist_id FROM artists WHERE artist_id IN ({','.join('?' * len(ids))})",
+                ids).fetchall()
+        return {row[0] for row in rows}
+
+    def search(self, term: str, limit: int = 5) -> list:
+        """
+        Find tracks whose title, artist or album contain every word of the term as a prefix.
+
+        :param term: free-text search term
+        :param limit: maximum number of results
+        :return: list of raw iTunes track results, best match first
+        """
+        query = build_match_query(term)
+        if query is None:
+            return []
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT t.data FROM tracks_fts JOIN tracks t ON t.track_id = tracks_fts.rowid "
+                "WHERE tracks_fts MATCH ? ORDER BY bm25(tracks_fts) LIMIT ?",
+                (query, int(limit))).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_track(self, track_id: int) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data FROM tracks WHERE track_id = ?", (int(track_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_collection(self, collection_id: int) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data FROM collections WHERE collection_id = ?",
+                (int(collection_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_artist_tracks(self, artist_id: int) -> list:
+        """Get every stored track of an artist, ordered by album, disc and track number."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT data FROM tracks WHERE artist_id = ?",
+                (int(artist_id),)).fetchall()
+        tracks = [json.loads(row[0]) for row in rows]
+        tracks.sort(key=lambda t: (t.get('collectionId') or 0, t.get('discNumber') or 0,
+                                   t.get('trackNumber') or 0))
+        return tracks
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('tracks', 'collections', 'artists')}
+        return counts
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            for table in ('tracks', 'collections', 'artists', 'tracks_fts'):
+                conn.execute(f"DELETE FROM {table}")
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,233 @@
+"""
+Duplicate detection by a hash of the audio alone.
+
+Libraries often hold several copies of one track that only differ in their
+tags. Each file's MPEG audio, without its ID3v2, ID3v1 and APEv2 tags, is
+hashed (see ``music.utils.mpeg.audio_digest``) and the digest stored in
+SQLite with the file's mtime and size, so later scans only rehash the files
+that changed. Files sharing a digest are copies: once one of them is matched
+on iTunes, the match applies to all of them without another call.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from music.config import ALLOWED_EXTENSIONS, DEDUPE_DB_PATH, DEDUPE_WORKERS
+from music.utils.logger import get_logger
+from music.utils.mpeg import audio_digest
+
+log = get_logger()
+
+# Files hashed between two commits
+WINDOW = 256
+
+
+def hash_file(path: str) -> tuple[str | None, str | None]:
+    """
+    Hash the audio of one file; runs inside the worker processes.
+
+    :return: (digest or None, error message or None); both are None for a
+        file without audio
+    """
+    try:
+        with open(path, 'rb') as f:
+            return audio_digest(f), None
+    except OSError as e:
+        return None, str(e)
+
+
+class DuplicateIndex:
+    """
+    Audio digests of library files in SQLite.
+
+    :param path: SQLite database file
+    :param workers: processes used to hash files (0 hashes in-process)
+    """
+
+    def __init__(self, path: str = DEDUPE_DB_PATH, workers: int = DEDUPE_WORKERS, clock=time.time):
+        self.path = path
+        self.workers = workers
+        self.clock = clock
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+                "digest TEXT NOT NULL, indexed_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS digests_digest ON digests (digest);"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _state(self, path: str) -> tuple | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT mtime_ns, size FROM digests WHERE path = ?", (path,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def add_files(self, paths: list, executor=None) -> dict:
+        """
+        Hash the files among some paths that are new or changed.
+
+        Files already hashed with the same mtime and size are skipped, and so
+        are files without audio, which would otherwise all be copies of each
+        other.
+
+        :param paths: audio files
+        :param executor: process pool to hash with (default: one of ``workers`` processes)
+        :return: summary with hashed, unchanged, empty and failed counts and files per second
+        """
+        started = time.perf_counter()
+        summary = {"hashed": 0, "unchanged": 0, "empty": 0, "failed": 0}
+        changed = []
+        for path in (os.path.abspath(p) for p in paths):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                log.warning(f"Could not hash {path} -> {e}")
+                summary["failed"] += 1
+                continue
+            if self._state(path) == (stat.st_mtime_ns, stat.st_size):
+                summary["unchanged"] += 1
+            else:
+                changed.append((path, stat))
+
+        pool = executor
+        if pool is None and self.workers > 0 and changed:
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            for start in range(0, len(changed), WINDOW):
+                window = changed[start:start + WINDOW]
+                paths = [path for path, _ in window]
+                if pool:
+                    results = list(pool.map(hash_file, paths, chunksize=8))
+                else:
+                    results = [hash_file(p) for p in paths]
+                with self._lock:
+                    conn = self._connect()
+                    for (path, stat), (digest, error) in zip(window, results):
+                        if error:
+                            log.warning(f"Could not hash {path} -> {error}")
+                            summary["failed"] += 1
+                            continue
+                        if digest is None:
+                            conn.execute("DELETE FROM digests WHERE path = ?", (path,))
+                            summary["empty"] += 1
+                            continue
+                        conn.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)",
+                                     (path, stat.st_mtime_ns, stat.st_size, digest, self.clock()))
+                        summary["hashed"] += 1
+                    conn.commit()
+        finally:
+            if pool is not None and pool is not executor:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+        summary["elapsed_seconds"] = round(elapsed, 3)
+        summary["files_per_second"] = round(len(changed) / elapsed, 2) if elapsed else 0.0
+        return summary
+
+    def scan(self, roots: list) -> dict:
+        """
+        Hash the audio files under some directories.
+
+        Rows of files under these directories that are gone from disk are
+        removed, so deleted files no longer count as copies.
+
+        :return: add_files summary, plus the number of rows removed
+        """
+        paths = []
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                paths.extend(os.path.join(dirpath, name) for name in filenames
+                             if name.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS)
+        summary = self.add_files(sorted(paths))
+        summary["removed"] = self.prune(roots)
+        return summary
+
+    def prune(self, roots: list) -> int:
+        """
+        Remove the rows of files under some directories that no longer exist.
+
+        :return: number of rows removed
+        """
+        prefixes = [os.path.join(os.path.abspath(root), '') for root in roots]
+        with self._lock:
+            rows = self._connect().execute("SELECT path FROM digests").fetchall()
+        gone = [path for path, in rows
+                if any(path.startswith(prefix) for prefix in prefixes) and not os.path.exists(path)]
+        return self.remove(gone) if gone else 0
+
+    def remove(self, paths: list) -> int:
+        with self._lock:
+            conn = self._connect()
+            removed = sum(conn.execute("DELETE FROM digests WHERE path = ?",
+                                       (os.path.abspath(p),)).rowcount for p in paths)
+            conn.commit()
+        return removed
+
+    def digests(self, paths: list) -> dict:
+        """
+        Get the stored digests of some files.
+
+        :return: dict mapping each given path that has a digest to it
+        """
+        absolute = {os.path.abspath(p): p for p in paths}
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            items = list(absolute)
+            # Stay under SQLite's limit on query parameters
+            for start in range(0, len(items), 500):
+                chunk = items[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT path, digest FROM digests WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                found.update((absolute[path], digest) for path, digest in rows)
+        return found
+
+    def shared_digests(self) -> set:
+        """Digests held by more than one file."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT digest FROM digests GROUP BY digest HAVING COUNT(*) > 1").fetchall()
+        return {row[0] for row in rows}
+
+    def groups(self) -> list:
+        """
+        Get the sets of copies in the index.
+
+        :return: list of sorted path lists, one per digest held by several files
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT digest, path FROM digests WHERE digest IN "
+                "(SELECT digest FROM digests GROUP BY digest HAVING COUNT(*) > 1) "
+                "ORDER BY digest, path").fetchall()
+        groups = {}
+        for digest, path in rows:
+            groups.setdefault(digest, []).append(path)
+        return list(groups.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            files, distinct = self._connect().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT digest) FROM digests").fetchone()
+        return {"files": files, "distinct": distinct, "duplicates": files - distinct}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+duplicate_index = DuplicateIndex()
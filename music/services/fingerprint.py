@@ -0,0 +1,355 @@
+"""
+Acoustic fingerprints for identifying files without tags.
+
+A file with no title, artist or album gives the iTunes search nothing to work
+with. Many such files are copies or re-encodes of tracks that are tagged
+elsewhere in the library, so the first seconds of every tagged file are
+decoded and reduced to a compact chroma fingerprint (the share of energy in
+each of the 12 pitch classes, over a fixed number of time segments). An
+untagged file is fingerprinted the same way and matched against the index by
+cosine similarity, locally and without a network call.
+
+Decoding uses ffmpeg, which is optional: without it fingerprinting is off and
+searches behave as before.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from music.config import (ALLOWED_EXTENSIONS, FFMPEG_PATH, FINGERPRINT_DB_PATH, FINGERPRINT_SECONDS,
+                          FINGERPRINT_THRESHOLD, FINGERPRINT_WORKERS)
+from music.modules import TAG_FRAMES, AudioTags
+from music.utils.logger import get_logger
+from music.utils.metrics import timed
+
+log = get_logger()
+
+# Analysis parameters: mono audio at RATE, FRAME-sample windows every HOP samples
+RATE = 11025
+FRAME = 4096
+HOP = 2048
+SEGMENTS = 16
+SIZE = SEGMENTS * 12
+# Pitched range the chroma is computed over, in Hz
+LOW, HIGH = 55.0, 4000.0
+# Files fingerprinted and stored per transaction
+WINDOW = 64
+
+
+class FingerprintUnavailable(RuntimeError):
+    """No decoder to read audio with."""
+
+
+def decoder_available() -> bool:
+    return shutil.which(FFMPEG_PATH) is not None
+
+
+def decode(path: str, seconds: float = FINGERPRINT_SECONDS) -> np.ndarray:
+    """
+    Decode the start of an audio file to mono samples at RATE.
+
+    :param path: audio file
+    :param seconds: length of the window decoded
+    :return: float32 samples in [-1, 1]
+    :raises FingerprintUnavailable: when ffmpeg is not installed
+    """
+    if not decoder_available():
+        raise FingerprintUnavailable(f"{FFMPEG_PATH} not found; install ffmpeg to fingerprint audio")
+    command = [FFMPEG_PATH, '-nostdin', '-v', 'error', '-t', str(seconds), '-i', path,
+               '-ac', '1', '-ar', str(RATE), '-f', 's16le', '-']
+    output = subprocess.run(command, capture_output=True, check=True, timeout=60).stdout
+    return np.frombuffer(output, dtype='<i2').astype(np.float32) / 32768
+
+
+def _chroma_map(rate: int) -> tuple[np.ndarray, np.ndarray]:
+    # Spectrum bins in the pitched range, and the bins x 12 matrix summing them per pitch class
+    freqs = np.fft.rfftfreq(FRAME, 1.0 / rate)
+    band = (freqs >= LOW) & (freqs <= HIGH)
+    pitch = np.round(12 * np.log2(freqs[band] / 440.0)).astype(int) % 12
+    return band, np.eye(12, dtype=np.float32)[pitch]
+
+
+def chroma(samples: np.ndarray, rate: int = RATE) -> np.ndarray:
+    """Energy per pitch class for each analysis frame, as a frames x 12 array."""
+    if len(samples) < FRAME:
+        return np.zeros((0, 12), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME).astype(np.float32), axis=1)) ** 2
+    band, mapping = _chroma_map(rate)
+    return spectrum[:, band].astype(np.float32) @ mapping
+
+
+def fingerprint(samples: np.ndarray, rate: int = RATE) -> np.ndarray:
+    """
+    Reduce samples to a unit-length fingerprint of SIZE values.
+
+    Each time segment contributes its pitch-class profile, centred so that only
+    the balance between pitch classes counts, not loudness.
+
+    :raises ValueError: when the audio is too short or silent
+    """
+    frames = chroma(samples, rate)
+    if len(frames) < SEGMENTS:
+        raise ValueError("Audio is too short to fingerprint")
+    segments = np.stack([part.sum(axis=0) for part in np.array_split(frames, SEGMENTS)])
+    totals = segments.sum(axis=1, keepdims=True)
+    if not totals.all():
+        raise ValueError("Audio is silent")
+    profile = segments / totals
+    vector = (profile - profile.mean(axis=1, keepdims=True)).ravel()
+    norm = np.linalg.norm(vector)
+    if not norm:
+        raise ValueError("Audio has no pitched content")
+    return (vector / norm).astype(np.float32)
+
+
+def fingerprint_file(path: str, seconds: float = FINGERPRINT_SECONDS) -> np.ndarray:
+    """Decode and fingerprint the start of a file."""
+    return fingerprint(decode(path, seconds))
+
+
+def read_tagged_fingerprint(path: str) -> tuple:
+    """
+    Read a file's tags and, if it has a title and an artist, its fingerprint.
+
+    Runs inside the worker processes.
+
+    :return: (tags, fingerprint bytes or None, error message or None)
+    """
+    audio = AudioTags(path, lazy=True)
+    tags = {field: audio.get(field) for field in TAG_FRAMES}
+    if not (tags['title'] and tags['artist']):
+        return tags, None, None
+    try:
+        return tags, fingerprint_file(path).tobytes(), None
+    except (ValueError, OSError, subprocess.SubprocessError) as e:
+        return tags, None, str(e)
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of tagged files in SQLite, searched in memory.
+
+    All fingerprints are held in one matrix, so a lookup is a single
+    matrix-vector product: a few milliseconds for a hundred thousand tracks.
+
+    :param path: SQLite database file
+    :param threshold: minimum cosine similarity for a match
+    :param workers: processes used to fingerprint files (0 fingerprints in-process)
+    """
+
+    def __init__(self, path: str = FINGERPRINT_DB_PATH, threshold: float = FINGERPRINT_THRESHOLD,
+                 workers: int = FINGERPRINT_WORKERS, clock=time.time):
+        self.path = path
+        self.threshold = threshold
+        self.workers = workers
+        self.clock = clock
+        self._conn = None
+        self._matrix = None
+        self._paths = []
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+                "fingerprint BLOB NOT NULL, tags TEXT NOT NULL, indexed_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def add(self, path: str, vector: np.ndarray, tags: dict, stat=None):
+        """Store the fingerprint and tags of one file."""
+        path = os.path.abspath(path)
+        stat = stat or os.stat(path)
+        with self._lock:
+            conn = self._connect()
+            self._store(conn, path, stat, np.asarray(vector, dtype=np.float32).tobytes(), tags)
+            conn.commit()
+            self._matrix = None
+
+    def _store(self, conn, path: str, stat, blob: bytes, tags: dict):
+        conn.execute(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, blob, json.dumps(tags), self.clock()))
+
+    def _state(self, path: str) -> tuple | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT mtime_ns, size FROM fingerprints WHERE path = ?", (path,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def add_files(self, paths: list) -> dict:
+        """
+        Fingerprint the tagged files among some paths.
+
+        Files already fingerprinted with the same mtime and size are skipped,
+        as are files without a title or an artist.
+
+        :return: summary with added, unchanged, untagged and failed counts and files per second
+        """
+        if not decoder_available():
+            raise FingerprintUnavailable(f"{FFMPEG_PATH} not found; install ffmpeg to fingerprint audio")
+        started = time.perf_counter()
+        summary = {"added": 0, "unchanged": 0, "untagged": 0, "failed": 0}
+        changed = []
+        for path in (os.path.abspath(p) for p in paths):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                log.warning(f"Could not fingerprint {path} -> {e}")
+                summary["failed"] += 1
+                continue
+            if self._state(path) == (stat.st_mtime_ns, stat.st_size):
+                summary["unchanged"] += 1
+            else:
+                changed.append((path, stat))
+
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 and changed else None
+        try:
+            # Store in windows so lookups are not held up for the whole run
+            for start in range(0, len(changed), WINDOW):
+                window = changed[start:start + WINDOW]
+                paths = [path for path, _ in window]
+                if pool:
+                    results = list(pool.map(read_tagged_fingerprint, paths, chunksize=4))
+                else:
+                    results = [read_tagged_fingerprint(p) for p in paths]
+                with self._lock:
+                    conn = self._connect()
+                    for (path, stat), (tags, blob, error) in zip(window, results):
+                        if error:
+                            log.warning(f"Could not fingerprint {path} -> {error}")
+                            summary["failed"] += 1
+                        elif blob is None:
+                            summary["untagged"] += 1
+                        else:
+                            self._store(conn, path, stat, blob, tags)
+                            summary["added"] += 1
+                    conn.commit()
+                    self._matrix = None
+        finally:
+            if pool:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+        summary["elapsed_seconds"] = round(elapsed, 3)
+        summary["files_per_second"] = round(len(changed) / elapsed, 2) if elapsed else 0.0
+        return summary
+
+    def scan(self, roots: list) -> dict:
+        """Fingerprint the tagged audio files under some directories."""
+        paths = []
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                paths.extend(os.path.join(dirpath, name) for name in filenames
+                             if name.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS)
+        return self.add_files(sorted(paths))
+
+    def remove(self, paths: list) -> int:
+        with self._lock:
+            conn = self._connect()
+            removed = sum(conn.execute("DELETE FROM fingerprints WHERE path = ?",
+                                       (os.path.abspath(p),)).rowcount for p in paths)
+            conn.commit()
+            self._matrix = None
+        return removed
+
+    def _load(self) -> tuple[np.ndarray, list]:
+        # Called with the lock held
+        if self._matrix is None:
+            rows = self._connect().execute("SELECT path, fingerprint FROM fingerprints").fetchall()
+            self._paths = [row[0] for row in rows]
+            self._matrix = np.frombuffer(b''.join(row[1] for row in rows),
+                                         dtype=np.float32).reshape(len(rows), SIZE)
+        return self._matrix, self._paths
+
+    def lookup(self, vector: np.ndarray, exclude: str = None) -> dict | None:
+        """
+        Find the indexed file closest to a fingerprint.
+
+        :param exclude: path never returned (the file being identified)
+        :return: its path, tags and similarity, or None below the threshold
+        """
+        with self._lock:
+            matrix, paths = self._load()
+            if not len(paths):
+                return None
+            scores = matrix @ vector
+            if exclude is not None and os.path.abspath(exclude) in paths:
+                scores[paths.index(os.path.abspath(exclude))] = -1.0
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+            row = self._connect().execute(
+                "SELECT tags FROM fingerprints WHERE path = ?", (paths[best],)).fetchone()
+        return {"path": paths[best], "tags": json.loads(row[0]), "similarity": round(similarity, 4)}
+
+    def identify(self, path: str) -> dict | None:
+        """
+        Identify a file from its audio alone.
+
+        :return: the best match as returned by lookup, or None
+        :raises FingerprintUnavailable: when ffmpeg is not installed
+        """
+        with timed('fingerprint'):
+            vector = fingerprint_file(path)
+        return self.lookup(vector, exclude=path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._connect().execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        return {"fingerprints": count, "decoder": decoder_available()}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._matrix = None
+
+
+def identify_untagged(audio, search_terms: list) -> dict | None:
+    """
+    Fill in the tags of a file with none of the search terms from a fingerprint match.
+
+    Only empty fields are filled. Does nothing when the file has some of them
+    or no decoder is installed.
+
+    :param audio: AudioTags, or a dict of tags with the filepath as batch runs read them
+    :param search_terms: fields a search is built from
+    :return: the match used, or None
+    """
+    filepath = audio.get('filepath')
+    if not filepath or any(audio.get(term) for term in search_terms) or not decoder_available():
+        return None
+    try:
+        match = fingerprint_index.identify(filepath)
+    except Exception as e:
+        log.warning(f"Fingerprint lookup failed for {filepath} -> {e}")
+        return None
+    if match is None:
+        return None
+    for field, value in match["tags"].items():
+        if value and not audio.get(field):
+            if isinstance(audio, dict):
+                audio[field] = value
+            else:
+                setattr(audio, field, value)
+    log.info(f"Identified {filepath} as {match['path']} ({match['similarity']})")
+    return match
+
+
+fingerprint_index = FingerprintIndex()
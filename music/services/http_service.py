@@ -1,20 +1,149 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from music.config import (HTTP_BACKOFF_FACTOR, HTTP_BACKOFF_MAX, HTTP_CONNECT_TIMEOUT,
+                          HTTP_MAX_RETRIES, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE,
+                          HTTP_READ_TIMEOUT)
 from music.utils.logger import get_logger
 
 log = get_logger()
 
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# How rate-limited APIs (iTunes answers 403) say a client is over its quota
+THROTTLE_STATUSES = {403, 429}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Get the process-wide pooled session.
+
+    Connections are kept alive and reused per host, so repeated calls to the
+    same API skip the TCP and TLS handshakes.
+
+    :return: shared requests session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                                  pool_maxsize=HTTP_POOL_MAXSIZE,
+                                  max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def reset_session():
+    """Close the shared session; the next call to get_session opens a new one."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date.
+
+    :param value: header value
+    :return: delay in seconds, or None if missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
 
 class HttpService:
-    def __init__(self, base_url: str):
+    """
+    GET requests with retries, backoff and an optional rate limiter.
+
+    With a rate limiter every attempt waits for a token first, and a throttled
+    answer (403 or 429) pauses the limiter for everyone and is retried.
+    """
+
+    def __init__(self, base_url: str = '', timeout: tuple = None, max_retries: int = None,
+                 backoff_factor: float = None, backoff_max: float = None,
+                 session: requests.Session = None, rate_limiter=None):
         self.base_url = base_url
+        self.timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.max_retries = HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = HTTP_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.backoff_max = HTTP_BACKOFF_MAX if backoff_max is None else backoff_max
+        self._session = session
+        self.rate_limiter = rate_limiter
+        self.sleep = time.sleep
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session or get_session()
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps concurrent clients from retrying in lock step
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def get(self, path: str, params: dict = None):
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url=url, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                if last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+                log.warning(f"Retrying {url} in {delay:.2f}s -> {error}")
+                self.sleep(delay)
+                continue
+
+            if self.rate_limiter is not None and response.status_code in THROTTLE_STATUSES:
+                delay = parse_retry_after(response.headers.get('Retry-After'))
+                if delay is None:
+                    delay = self._backoff(attempt) + 1 / self.rate_limiter.rate
+                # Hold back every caller, not just this one
+                self.rate_limiter.pause(delay)
+                if not last_attempt and delay <= self.backoff_max:
+                    log.warning(f"Throttled by {url}, retrying after {delay:.2f}s")
+                    response.close()
+                    # The next attempt queues behind the pause instead of sleeping here
+                    continue
+
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                delay = parse_retry_after(response.headers.get('Retry-After'))
+                if delay is None:
+                    delay = self._backoff(attempt)
+                if delay <= self.backoff_max:
+                    log.warning(
+                        f"Retrying {url} in {delay:.2f}s -> HTTP {response.status_code}")
+                    response.close()
+                    self.sleep(delay)
+                    continue
 
-    def get(self, path: str):
-        try:
-            response = requests.get(url=f"{self.base_url}{path}", timeout=20)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.HTTPError as error:
-            log.error(
-                f"Encountered an error calling {self.base_url}{path} -> {error}"
-            )
-            return None
+            try:
+                response.raise_for_status()
+                return response
+            except requests.exceptions.HTTPError as error:
+                log.error(
+                    f"Encountered an error calling {url} -> {error}"
+                )
+                return None
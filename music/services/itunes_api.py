@@ -1,48 +1,203 @@
-import requests
+import sqlite3
 
+from requests.exceptions import RequestException
+
+from music.config import (CATALOG_PATH, ITUNES_BASE_URL, ITUNES_RATE_BURST, ITUNES_RATE_LIMIT,
+                          SEARCH_CACHE_DISK_SIZE, SEARCH_CACHE_PATH, SEARCH_CACHE_SIZE,
+                          SEARCH_CACHE_TTL)
+from music.services.cache import MemoryCache, ResultCache, SqliteCache, make_search_key
+from music.services.catalog import Catalog
 from music.services.http_service import HttpService
+from music.services.rate_limit import RateLimiter
+from music.services.singleflight import SingleFlight
 from music.utils.logger import get_logger
+from music.utils.metrics import timed
 
 log = get_logger()
-service = HttpService(base_url="https://itunes.apple.com")
+# One token bucket for every call to iTunes, whatever part of the app makes it
+rate_limiter = RateLimiter(ITUNES_RATE_LIMIT, ITUNES_RATE_BURST) if ITUNES_RATE_LIMIT > 0 else None
+service = HttpService(base_url=ITUNES_BASE_URL, rate_limiter=rate_limiter)
+search_cache = ResultCache(
+    MemoryCache(max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL),
+    SqliteCache(SEARCH_CACHE_PATH, max_entries=SEARCH_CACHE_DISK_SIZE,
+                ttl=SEARCH_CACHE_TTL) if SEARCH_CACHE_PATH else None,
+)
+catalog = Catalog(CATALOG_PATH) if CATALOG_PATH else None
+# Identical searches running at the same time share one request
+in_flight_searches = SingleFlight('search')
+
+
+def _add_artwork_urls(results: list) -> list:
+    for r in results:
+        if r.get("artworkUrl100"):
+            r["artworkUrl1000"] = r["artworkUrl100"].replace("100x100", "1000x1000")
+    return results
+
+
+def _ingest(results: list):
+    if catalog is None or not results:
+        return
+    try:
+        catalog.ingest(results)
+    except sqlite3.Error as error:
+        log.error(f"Could not add results to the catalog -> {error}")
+
+
+def _search_catalog(term: str, limit: int) -> tuple[list, bool]:
+    # The local answer is complete only when every result comes from an artist
+    # whose whole discography has been ingested; a full page of results may
+    # still miss better matches that were never ingested
+    if catalog is None:
+        return [], False
+    try:
+        results = catalog.search(term, limit)
+        artist_ids = {r.get("artistId") for r in results}
+        complete = bool(results) and catalog.ingested_artists(artist_ids) == artist_ids
+        return results, complete
+    except sqlite3.Error as error:
+        log.error(f"Could not search the catalog -> {error}")
+        return [], False
+
 
+def _lookup_count(results: list) -> int:
+    # Lookups also return the looked up artist itself
+    return sum(1 for r in results or [] if r.get("wrapperType") != "artist")
 
-def get_music_by_artist_id(artist_id: str) -> list:
+
+def get_music_by_artist_id(artist_id: str, limit: int = 200) -> list:
     """
     Query itunes api to get all music by given artist.
 
+    Everything returned is added to the local catalog. Once both lookups
+    succeed without reaching the limit the artist is marked as ingested; a
+    lookup that returned ``limit`` items may have been cut short.
+
     :param artist_id: itunes artist id
+    :param limit: maximum number of songs and of albums to request
     :return: list of music by artist
     """
     music = []
+    truncated = False
 
     # get all songs by artist
-    song_response = service.get(path=f"/lookup?id={artist_id}&entity=song")
+    song_response = service.get(
+        path="/lookup", params={"id": artist_id, "entity": "song", "limit": limit})
 
     if song_response:
-        music.extend(song_response.json().get("results"))
+        songs = song_response.json().get("results")
+        truncated |= _lookup_count(songs) >= limit
+        music.extend(songs)
 
     # get all albums by artist
-    album_response = service.get(path=f"/lookup?id={artist_id}&entity=album")
+    album_response = service.get(
+        path="/lookup", params={"id": artist_id, "entity": "album", "limit": limit})
 
     if album_response:
-        music.extend(album_response.json().get("results"))
+        albums = album_response.json().get("results")
+        truncated |= _lookup_count(albums) >= limit
+        music.extend(albums)
+
+    _add_artwork_urls(music)
+    _ingest(music)
+    if song_response and album_response and not truncated and catalog is not None:
+        try:
+            catalog.mark_artist(artist_id)
+        except sqlite3.Error as error:
+            log.error(f"Could not mark artist {artist_id} as ingested -> {error}")
 
     return music
 
 
-def get_song_info(info: list, limit: int = 5) -> list:
-    terms = [t.replace(' ', '+') for t in info if t]
-    term = '+'.join(terms)
-    url = f"https://itunes.apple.com/search?term={term}&entity=musicTrack&limit={limit}"
-    response = requests.get(url)
+def get_album_tracks(collection_id: int, limit: int = 200) -> list:
+    """
+    Query itunes api to get the full tracklist of an album.
+
+    Tracklists are kept in the result cache and added to the local catalog.
+
+    :param collection_id: itunes collection id
+    :param limit: maximum number of songs to request
+    :return: list of the album's tracks, without the collection itself
+    """
+    key = make_search_key([f"collection:{collection_id}"], limit, "song")
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with timed('http_lookup'):
+        response = service.get(
+            path="/lookup", params={"id": collection_id, "entity": "song", "limit": limit})
+    if response is None:
+        return []
+    tracks = [r for r in response.json().get("results") or []
+              if r.get("wrapperType") == "track"]
+
+    _add_artwork_urls(tracks)
+    _ingest(tracks)
+    search_cache.set(key, tracks)
+    return tracks
+
+
+def _search_remote(term: str, entity: str, limit: int, key: str) -> list | None:
+    # A call that finished just before this one started may have filled the cache
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with timed('http_search'):
+        response = service.get(
+            path="/search", params={"term": term, "entity": entity, "limit": limit})
+    if response is None:
+        return None
     results = response.json().get("results")
 
     if not results:
+        search_cache.set(key, [])
         return []
 
-    for r in results:
-        r.update({"artworkUrl1000": r.get(
-            "artworkUrl100").replace("100x100", "1000x1000")})
-
+    _add_artwork_urls(results)
+    _ingest(results)
+    search_cache.set(key, results)
     return results
+
+
+def search_tracks(term: str, entity: str = "musicTrack", limit: int = 5) -> list:
+    """
+    Search for tracks, trying the result cache, then the local catalog, then iTunes.
+
+    Results fetched from iTunes are added to the local catalog. Concurrent
+    identical searches share one request. Partial local results are still
+    returned when iTunes cannot be reached.
+
+    :param term: free-text search term
+    :param entity: itunes entity to search for (musicTrack, song ...)
+    :param limit: maximum number of results
+    :return: list of results, each with an artworkUrl1000
+    """
+    key = make_search_key([term], limit, entity)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    local, complete = _search_catalog(term, limit)
+    if complete:
+        return local
+
+    try:
+        results = in_flight_searches.do(key, _search_remote, term, entity, limit, key)
+    except RequestException:
+        if local:
+            log.warning(f"iTunes unreachable, answering '{term}' from the catalog")
+            return local
+        raise
+    return local if results is None else results
+
+
+def get_song_info(info: list, limit: int = 5) -> list:
+    """
+    Search for tracks matching all of the given terms.
+
+    :param info: search terms (title, artist, album ...), empty ones are skipped
+    :param limit: maximum number of results
+    :return: list of results, served locally when the catalog knows the track
+    """
+    return search_tracks(' '.join(t for t in info if t), "musicTrack", limit)
@@ -0,0 +1,187 @@
+"""
+Background jobs for work that should not hold up a request.
+
+iTunes searches, tag saves and batch runs are submitted to a ``JobQueue`` and
+get an id straight away; clients poll the job until it is finished. Jobs run
+on in-process thread pools by default, with separate pools for kinds that
+would otherwise starve the rest (a library-wide batch must not delay an
+interactive search). Finished jobs are kept for a while so their result can
+be fetched, then expire.
+"""
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+
+from music.config import JOB_MAX_RETAINED, JOB_RESULT_TTL, JOB_WORKERS
+from music.utils import metrics
+from music.utils.logger import get_logger
+
+log = get_logger()
+
+FINISHED = ('finished', 'failed')
+
+jobs_total = metrics.registry.counter(
+    'music_finder_jobs_total', 'Background jobs by kind and outcome.', ('kind', 'status'))
+job_wait_seconds = metrics.registry.histogram(
+    'music_finder_job_wait_seconds', 'Time jobs spend queued before they start.', ('kind',))
+
+
+def thread_pool(workers: int, name: str):
+    """Default executor factory: a thread pool named after the job kind."""
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'job-{name}')
+
+
+class JobQueue:
+    """
+    In-process job queue with status tracking and result retention.
+
+    :param workers: size of the shared pool
+    :param ttl: seconds a finished job is kept
+    :param max_retained: maximum number of finished jobs kept
+    :param dedicated: job kinds that get a pool of their own, mapped to its size
+    :param executor_factory: callable (workers, name) returning a concurrent.futures Executor
+    :param clock: time source for created/finished timestamps
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, ttl: float = JOB_RESULT_TTL,
+                 max_retained: int = JOB_MAX_RETAINED, dedicated: dict = None,
+                 executor_factory=thread_pool, clock=time.time):
+        self.workers = workers
+        self.ttl = ttl
+        self.max_retained = max_retained
+        self.dedicated = dict(dedicated or {})
+        self.executor_factory = executor_factory
+        self.clock = clock
+        self._executors = {}
+        self._jobs = {}
+        self._futures = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _executor(self, kind: str):
+        name = kind if kind in self.dedicated else 'shared'
+        executor = self._executors.get(name)
+        if executor is None:
+            executor = self._executors[name] = self.executor_factory(
+                self.dedicated.get(kind, self.workers), name)
+        return executor
+
+    def submit(self, kind: str, func, *args, progress: bool = False, **kwargs) -> str:
+        """
+        Queue a call and return its job id.
+
+        The call runs in a copy of the caller's context, so stage timings still
+        reach the request that submitted it while that request is running.
+
+        :param kind: job kind (search, save, batch ...)
+        :param func: callable to run
+        :param progress: pass a ``progress`` callable to ``func`` that publishes partial state
+        :return: job id to poll with get
+        """
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "kind": kind, "status": "queued", "progress": None,
+               "result": None, "error": None, "error_type": None, "created_at": self.clock(),
+               "started_at": None, "finished_at": None}
+        if progress:
+            kwargs['progress'] = lambda value: self._update(job, progress=value)
+        queued = time.perf_counter()
+
+        def run():
+            job_wait_seconds.observe(time.perf_counter() - queued, kind)
+            self._update(job, status="running", started_at=self.clock())
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                log.error(f"{kind} job {job_id} failed -> {e}")
+                self._update(job, status="failed", error=str(e), error_type=type(e).__name__,
+                             finished_at=self.clock())
+            else:
+                self._update(job, status="finished", result=result, finished_at=self.clock())
+            jobs_total.inc(kind, job["status"])
+
+        context = contextvars.copy_context()
+        with self._lock:
+            self._purge()
+            self._jobs[job_id] = job
+            self._versions[job_id] = 0
+            self._futures[job_id] = self._executor(kind).submit(context.run, run)
+        return job_id
+
+    def _update(self, job: dict, **changes):
+        with self._changed:
+            job.update(changes)
+            if job["id"] in self._versions:
+                self._versions[job["id"]] += 1
+            self._changed.notify_all()
+
+    def get(self, job_id: str) -> dict | None:
+        """Get a copy of a job's state, or None if unknown or expired."""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: str, timeout: float = None) -> dict | None:
+        """
+        Wait for a job to finish, for at most ``timeout`` seconds.
+
+        :return: copy of the job's state, finished or not; None if unknown
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            wait_futures([future], timeout=timeout)
+        return self.get(job_id)
+
+    def follow(self, job_id: str, heartbeat: float = None):
+        """
+        Yield a copy of a job's state each time it changes, until it has finished.
+
+        Changes that happen while the caller is busy are coalesced into one
+        snapshot. Stops early if the job is unknown or expires.
+
+        :param heartbeat: yield None after this many seconds without a change
+        """
+        seen = None
+        while True:
+            with self._changed:
+                changed = self._changed.wait_for(
+                    lambda: self._versions.get(job_id, -1) != seen, timeout=heartbeat)
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                seen = self._versions[job_id]
+                snapshot = dict(job) if changed else None
+            yield snapshot
+            if snapshot is not None and snapshot["status"] in FINISHED:
+                return
+
+    def list(self, kind: str = None) -> list:
+        """Get copies of all retained jobs, oldest first."""
+        with self._lock:
+            self._purge()
+            return [dict(job) for job in self._jobs.values() if kind in (None, job["kind"])]
+
+    def _purge(self):
+        # Called with the lock held
+        expired = self.clock() - self.ttl
+        finished = [job for job in self._jobs.values() if job["status"] in FINISHED]
+        excess = len(finished) - self.max_retained
+        for index, job in enumerate(finished):
+            if index < excess or job["finished_at"] <= expired:
+                del self._jobs[job["id"]]
+                self._futures.pop(job["id"], None)
+                self._versions.pop(job["id"], None)
+
+    def shutdown(self, wait: bool = True):
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+        self._executors = {}
+
+
+# Batch runs are long; give them their own pool so searches never queue behind them
+jobs = JobQueue(dedicated={'batch': 2})
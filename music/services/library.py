@@ -0,0 +1,529 @@
+"""
+Local index of the music library.
+
+Configured roots are crawled once into a SQLite database holding every file's
+path, mtime, size, parsed tags and match status. Later scans only stat files
+and re-read the tags of those whose mtime or size changed. A watcher keeps the
+index current: on Linux it listens to inotify events and re-checks only the
+paths they name, elsewhere it falls back to periodic incremental scans.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from music.config import (ALLOWED_EXTENSIONS, LIBRARY_DB_PATH, LIBRARY_POLL_INTERVAL,
+                          LIBRARY_WORKERS)
+from music.modules import AudioTags
+from music.services.catalog import build_match_query
+from music.utils.logger import get_logger
+
+log = get_logger()
+
+# Tag values kept for each file, as returned by AudioTags.to_dict
+TAG_COLUMNS = ('title', 'artist', 'album', 'genre', 'tracknumber', 'discnumber',
+               'albumartist', 'composer', 'date', 'bitrate', 'duration')
+
+# Files whose tags are read and stored per transaction
+WINDOW = 256
+
+
+def read_file_tags(path: str) -> dict:
+    """Read the tags of one file; runs inside the worker processes."""
+    return AudioTags(path).to_dict()
+
+
+def _is_audio(name: str, extensions: set) -> bool:
+    return '.' in name and name.rsplit('.', 1)[1].lower() in extensions
+
+
+def _walk(root: str, extensions: set):
+    """Yield (path, stat) for every audio file under a directory."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and _is_audio(entry.name, extensions):
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError as error:
+            log.warning(f"Could not scan {directory} -> {error}")
+
+
+class LibraryIndex:
+    """SQLite index of audio files, their tags and match status."""
+
+    def __init__(self, path: str = LIBRARY_DB_PATH, extensions: set = None,
+                 workers: int = LIBRARY_WORKERS, clock=time.time):
+        self.path = path
+        self.extensions = extensions or ALLOWED_EXTENSIONS
+        self.workers = workers
+        self.clock = clock
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            types = {'duration': 'REAL', 'bitrate': 'INTEGER'}
+            columns = ', '.join(f"{c} {types.get(c, 'TEXT')}" for c in TAG_COLUMNS)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, "
+                "mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+                f"{columns}, match_status TEXT NOT NULL DEFAULT 'unmatched', "
+                "match_score REAL, indexed_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS files_status ON files (match_status);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5("
+                "path, title, artist, album, tokenize = 'unicode61 remove_diacritics 2');"
+            )
+            self._conn.commit()
+        return self._conn
+
+    # Writing
+
+    def _store(self, conn, path: str, stat, tags: dict):
+        values = [tags.get(c) for c in TAG_COLUMNS]
+        conn.execute(
+            f"INSERT INTO files (path, mtime_ns, size, {', '.join(TAG_COLUMNS)}, indexed_at) "
+            f"VALUES (?, ?, ?, {', '.join('?' * len(TAG_COLUMNS))}, ?) "
+            "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, "
+            f"{', '.join(f'{c} = excluded.{c}' for c in TAG_COLUMNS)}, "
+            "indexed_at = excluded.indexed_at",
+            [path, stat.st_mtime_ns, stat.st_size, *values, self.clock()])
+        file_id = conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()[0]
+        conn.execute("DELETE FROM files_fts WHERE rowid = ?", (file_id,))
+        conn.execute(
+            "INSERT INTO files_fts (rowid, path, title, artist, album) VALUES (?, ?, ?, ?, ?)",
+            (file_id, path, tags.get('title') or '', tags.get('artist') or '',
+             tags.get('album') or ''))
+
+    def _remove(self, conn, paths: list):
+        for path in paths:
+            row = conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM files_fts WHERE rowid = ?", (row[0],))
+                conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+
+    def _read_changed(self, changed: list) -> int:
+        # Read tags in windows so a long first crawl is committed as it goes
+        # A handful of edited files is quicker to read than to start a pool for
+        use_pool = self.workers > 0 and len(changed) >= 32
+        pool = ProcessPoolExecutor(max_workers=self.workers) if use_pool else None
+        try:
+            for start in range(0, len(changed), WINDOW):
+                window = changed[start:start + WINDOW]
+                paths = [path for path, _ in window]
+                if pool:
+                    tags_list = list(pool.map(read_file_tags, paths, chunksize=16))
+                else:
+                    tags_list = [read_file_tags(p) for p in paths]
+                with self._lock:
+                    conn = self._connect()
+                    for (path, stat), tags in zip(window, tags_list):
+                        self._store(conn, path, stat, tags)
+                    conn.commit()
+        finally:
+            if pool:
+                pool.shutdown()
+        return len(changed)
+
+    def _known(self, directory: str) -> dict:
+        # Indexed files below a directory, with their (mtime_ns, size)
+        prefix = os.path.join(directory, '')
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT path, mtime_ns, size FROM files WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix))
+            return {row[0]: (row[1], row[2]) for row in rows}
+
+    def _state(self, path: str) -> tuple | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT mtime_ns, size FROM files WHERE path = ?", (path,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def scan(self, roots: list) -> dict:
+        """
+        Bring the index up to date with the files under some directories.
+
+        Only files that are new or whose mtime or size changed are read.
+        Indexed files under these directories that no longer exist are dropped.
+
+        :param roots: directories to scan
+        :return: summary with added, updated, removed and unchanged counts
+        """
+        started = time.perf_counter()
+        summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        for root in roots:
+            root = os.path.abspath(root)
+            if not os.path.isdir(root):
+                # An unmounted drive must not empty the index
+                log.warning(f"Library root {root} is not a directory, skipping")
+                continue
+            known = self._known(root)
+            changed = []
+            for path, stat in _walk(root, self.extensions):
+                previous = known.pop(path, None)
+                if previous == (stat.st_mtime_ns, stat.st_size):
+                    summary["unchanged"] += 1
+                    continue
+                summary["updated" if previous else "added"] += 1
+                changed.append((path, stat))
+            self._read_changed(changed)
+            # Whatever is left was not found on disk any more
+            if known:
+                with self._lock:
+                    conn = self._connect()
+                    self._remove(conn, list(known))
+                    conn.commit()
+                summary["removed"] += len(known)
+        summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+    def update_paths(self, paths: list) -> dict:
+        """
+        Re-check specific files and directories, as reported by a watcher.
+
+        :param paths: changed, created or deleted paths
+        :return: summary with added, updated, removed and unchanged counts
+        """
+        summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        directories, changed, removed = [], [], []
+        for path in set(os.path.abspath(p) for p in paths):
+            if os.path.isdir(path):
+                directories.append(path)
+            elif os.path.isfile(path):
+                if not _is_audio(os.path.basename(path), self.extensions):
+                    continue
+                stat = os.stat(path)
+                previous = self._state(path)
+                if previous == (stat.st_mtime_ns, stat.st_size):
+                    summary["unchanged"] += 1
+                else:
+                    summary["updated" if previous else "added"] += 1
+                    changed.append((path, stat))
+            else:
+                # Gone: a file, or a whole directory of them
+                if self._state(path):
+                    removed.append(path)
+                removed.extend(self._known(path))
+        self._read_changed(changed)
+        if removed:
+            with self._lock:
+                conn = self._connect()
+                self._remove(conn, removed)
+                conn.commit()
+            summary["removed"] += len(removed)
+        for directory in directories:
+            for key, count in self.scan([directory]).items():
+                if key in summary:
+                    summary[key] += count
+        return summary
+
+    def set_status(self, paths: list, status: str, score: float = None) -> int:
+        """
+        Record the match status of indexed files; unknown paths are ignored.
+
+        :return: number of files updated
+        """
+        with self._lock:
+            conn = self._connect()
+            updated = sum(conn.execute(
+                "UPDATE files SET match_status = ?, match_score = ? WHERE path = ?",
+                (status, score, os.path.abspath(p))).rowcount for p in paths)
+            conn.commit()
+        return updated
+
+    # Reading
+
+    def covers(self, path: str, roots: list) -> bool:
+        """Whether a path lies under one of the given roots."""
+        path = os.path.abspath(path)
+        return any(path.startswith(os.path.join(os.path.abspath(r), '')) for r in roots)
+
+    def load_tags(self, path: str) -> AudioTags:
+        """
+        Get the tags of a file, from the index when the file is unchanged.
+
+        A changed or unknown file is read from disk and (re)indexed.
+
+        :param path: MP3 file
+        :return: AudioTags, without the parsed ID3 tag when served from the index
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and (row['mtime_ns'], row['size']) == (stat.st_mtime_ns, stat.st_size):
+            audio = AudioTags()
+            audio.filepath = path
+            for column in TAG_COLUMNS:
+                setattr(audio, column, row[column])
+            return audio
+        audio = AudioTags(path)
+        with self._lock:
+            conn = self._connect()
+            self._store(conn, path, stat, audio.to_dict())
+            conn.commit()
+        return audio
+
+    def get(self, path: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT * FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, query: str = None, status: str = None, page: int = 1,
+             per_page: int = 50) -> tuple[list, int]:
+        """
+        List indexed files ordered by path, optionally filtered.
+
+        :param query: words matched as prefixes against path, title, artist and album
+        :param status: match status to filter on
+        :param page: 1-based page number
+        :param per_page: files per page
+        :return: files on the page and total number of matching files
+        """
+        where, params = [], []
+        match = build_match_query(query) if query else None
+        if match:
+            where.append("id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)")
+            params.append(match)
+        if status:
+            where.append("match_status = ?")
+            params.append(status)
+        clause = f" WHERE {' AND '.join(where)}" if where else ''
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(f"SELECT COUNT(*) FROM files{clause}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT * FROM files{clause} ORDER BY path LIMIT ? OFFSET ?",
+                [*params, per_page, (max(1, page) - 1) * per_page]).fetchall()
+        return [dict(row) for row in rows], total
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT match_status, COUNT(*) FROM files GROUP BY match_status").fetchall()
+        by_status = {row[0]: row[1] for row in rows}
+        return {"files": sum(by_status.values()), "by_status": by_status}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class Inotify:
+    """
+    Minimal recursive inotify watch through libc, for Linux.
+
+    Raises OSError when inotify is not available, so callers can fall back to
+    polling.
+    """
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            | IN_DELETE_SELF)
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(name, use_errno=True) if name else None
+        if libc is None or not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+
+    def add_tree(self, root: str):
+        """Watch a directory and everything below it."""
+        for dirpath, dirnames, _ in os.walk(root):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Could not watch {dirpath}")
+            self.directories[wd] = dirpath
+
+    def read(self, timeout: float) -> tuple[set, bool]:
+        """
+        Wait for events and collect the paths they name.
+
+        :param timeout: seconds to wait for the first event
+        :return: changed paths, and whether events were lost (a rescan is needed)
+        """
+        paths, overflow = set(), False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return paths, overflow
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return paths, overflow
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self.directories.get(wd)
+            if mask & self.IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                try:
+                    self.add_tree(path)
+                except OSError as error:
+                    log.warning(f"Could not watch {path} -> {error}")
+            paths.add(path)
+        return paths, overflow
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class LibraryWatcher:
+    """
+    Background thread keeping a LibraryIndex in sync with its roots.
+
+    Does one incremental scan on start, then follows inotify events, or
+    rescans every ``interval`` seconds where inotify is unavailable.
+    """
+
+    def __init__(self, index: LibraryIndex, roots: list, interval: float = LIBRARY_POLL_INTERVAL,
+                 use_inotify: bool = True, settle: float = 0.5):
+        self.index = index
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.settle = settle
+        self.mode = None
+        self.scanning = False
+        self.last_summary = None
+        self._stop = threading.Event()
+        self._rescan = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+    def start(self):
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+                for root in self.roots:
+                    self._inotify.add_tree(root)
+                self.mode = 'inotify'
+            except OSError as error:
+                log.warning(f"inotify unavailable, polling the library instead -> {error}")
+                if self._inotify:
+                    self._inotify.close()
+                self._inotify = None
+        if self._inotify is None:
+            self.mode = 'polling'
+        self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._rescan.set()
+        if self._thread:
+            self._thread.join()
+        if self._inotify:
+            self._inotify.close()
+
+    def request_scan(self):
+        """Ask for a full incremental scan at the next opportunity."""
+        self._rescan.set()
+
+    def _update(self, work, *args):
+        self.scanning = True
+        try:
+            self.last_summary = work(*args)
+            log.info(f"Library index updated: {self.last_summary}")
+        except Exception as e:
+            log.error(f"Library index update failed -> {e}")
+        finally:
+            self.scanning = False
+
+    def _run(self):
+        self._update(self.index.scan, self.roots)
+        while not self._stop.is_set():
+            if self._rescan.is_set():
+                self._rescan.clear()
+                self._update(self.index.scan, self.roots)
+            if self._inotify is None:
+                if self._rescan.wait(self.interval) or self._stop.is_set():
+                    continue
+                self._update(self.index.scan, self.roots)
+                continue
+            paths, overflow = self._inotify.read(timeout=0.5)
+            if not paths and not overflow:
+                continue
+            # Let a burst of events (a copy, a tag save) settle into one update
+            deadline = time.monotonic() + self.settle
+            while time.monotonic() < deadline:
+                more, lost = self._inotify.read(timeout=max(0.0, deadline - time.monotonic()))
+                paths |= more
+                overflow |= lost
+            if overflow:
+                self._update(self.index.scan, self.roots)
+            else:
+                self._update(self.index.update_paths, sorted(paths))
+
+    def status(self) -> dict:
+        return {"roots": self.roots, "mode": self.mode, "scanning": self.scanning,
+                "last_summary": self.last_summary}
+
+
+library_index = LibraryIndex()
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def start_watcher(roots: list, **options) -> LibraryWatcher:
+    """Start the shared library watcher once; later calls return it."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = LibraryWatcher(library_index, roots, **options).start()
+        return _watcher
+
+
+def get_watcher() -> LibraryWatcher | None:
+    return _watcher
@@ -0,0 +1,168 @@
+"""
+Client-side rate limiting for the iTunes Search API.
+
+iTunes throttles a client at roughly 20 calls per minute and answers 403 or
+429 beyond that. Every outbound iTunes call takes a token from one shared
+bucket first, so calls queue up instead of failing. Waiting calls are served
+by lane: interactive searches always go before batch lookups, so an overnight
+library scan cannot lock daytime users out.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from music.utils import metrics
+
+# Lanes in priority order
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANES = (INTERACTIVE, BATCH)
+
+queue_depth = metrics.registry.gauge(
+    'music_finder_rate_limit_queue_depth', 'Calls waiting for an iTunes token.', ('lane',))
+wait_seconds = metrics.registry.histogram(
+    'music_finder_rate_limit_wait_seconds', 'Time calls waited for an iTunes token.', ('lane',),
+    buckets=(0.01, 0.1, 0.5, 1.0, 3.0, 10.0, 30.0, 60.0, 300.0))
+
+_current_lane = ContextVar('rate_limit_lane', default=INTERACTIVE)
+_current_deadline = ContextVar('rate_limit_deadline', default=None)
+
+
+@contextmanager
+def lane(name: str):
+    """Send the calls made in the enclosed block through the given lane."""
+    if name not in LANES:
+        raise ValueError(f"Unknown rate limit lane: {name}")
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+@contextmanager
+def deadline(at: float):
+    """
+    Give up waiting for a token in the enclosed block once ``at`` has passed.
+
+    :param at: time on the limiter's clock (``time.monotonic`` by default)
+    """
+    token = _current_deadline.set(at)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+class RateLimitTimeout(Exception):
+    """No token became available in time."""
+
+
+class RateLimiter:
+    """
+    Token bucket with priority lanes.
+
+    Tokens refill continuously at ``per_minute / 60`` per second up to
+    ``burst``. A waiting call gets a token only when it is first in the
+    highest-priority lane that has waiters.
+
+    :param per_minute: sustained calls per minute
+    :param burst: calls that may go out back to back after a quiet period
+    :param clock: monotonic time source
+    """
+
+    def __init__(self, per_minute: float, burst: int = 1, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._queues = {name: deque() for name in LANES}
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        # Nothing accrues while paused
+        since = max(self._updated, min(self._paused_until, now))
+        self._tokens = min(self.burst, self._tokens + (now - since) * self.rate)
+        self._updated = now
+
+    def _is_next(self, name: str, ticket) -> bool:
+        for queued in LANES:
+            if self._queues[queued]:
+                return queued == name and self._queues[queued][0] is ticket
+        return False
+
+    def _delay(self, now: float) -> float:
+        # Time until a token is available and any pause is over
+        refill = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+        return max(refill, self._paused_until - now)
+
+    def acquire(self, name: str = None, timeout: float = None) -> float:
+        """
+        Wait for a token.
+
+        :param name: lane to wait in (default: the lane set with ``lane``)
+        :param timeout: give up after this many seconds (default: until the
+            time set with ``deadline``, if any)
+        :return: seconds spent waiting
+        :raises RateLimitTimeout: when the timeout expires first
+        """
+        name = name or current_lane()
+        ticket = object()
+        started = self.clock()
+        if timeout is None and _current_deadline.get() is not None:
+            timeout = _current_deadline.get() - started
+        with self._cond:
+            queue = self._queues[name]
+            queue.append(ticket)
+            queue_depth.set(len(queue), name)
+            try:
+                while True:
+                    now = self.clock()
+                    self._refill(now)
+                    delay = self._delay(now)
+                    is_next = self._is_next(name, ticket)
+                    if is_next and delay <= 0:
+                        self._tokens -= 1
+                        break
+                    # The call in front sleeps until its token is due; the ones
+                    # behind it sleep until they move up
+                    wait = delay if is_next else None
+                    if timeout is not None:
+                        remaining = started + timeout - now
+                        if remaining <= 0:
+                            raise RateLimitTimeout(f"No iTunes token within {timeout:.2f}s")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                queue.remove(ticket)
+                queue_depth.set(len(queue), name)
+                self._cond.notify_all()
+        waited = self.clock() - started
+        wait_seconds.observe(waited, name)
+        return waited
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a while, after the server said we are over the limit."""
+        with self._cond:
+            now = self.clock()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        """Tokens available and calls waiting per lane."""
+        with self._cond:
+            now = self.clock()
+            self._refill(now)
+            return {"tokens": round(self._tokens, 3),
+                    "paused_for": round(max(0.0, self._paused_until - now), 3),
+                    "waiting": {name: len(queue) for name, queue in self._queues.items()}}
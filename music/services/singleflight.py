@@ -0,0 +1,85 @@
+"""
+Request coalescing for identical concurrent calls.
+
+When several users or batch workers ask for the same album at the same time,
+each of them would otherwise send the same iTunes search or download the same
+cover. A ``SingleFlight`` group lets the first caller for a key run the call
+while later callers with the same key wait for it and share its result (or its
+exception). Nothing is cached once the call returns; that is the job of the
+result and artwork caches.
+"""
+import copy
+import threading
+
+from music.utils import metrics
+
+calls_total = metrics.registry.counter(
+    'music_finder_singleflight_calls_total',
+    'Coalesced calls by group; "collapsed" calls waited for an identical one in flight.',
+    ('group', 'outcome'))
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time and share its outcome.
+
+    When a result was shared, every caller gets its own deep copy of it, so
+    callers may modify what they get, as with the result cache.
+
+    :param name: group name used in metrics
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)``, unless a call for ``key`` is already running.
+
+        :param key: hashable identity of the call
+        :return: the result of the call that ran
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            calls_total.inc(self.name, 'collapsed')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        calls_total.inc(self.name, 'executed')
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                shared = call.waiters > 0
+            call.done.set()
+        # The stored result stays untouched for the waiters to copy
+        return copy.deepcopy(call.result) if shared else call.result
+
+    def in_flight(self) -> int:
+        """Number of distinct calls currently running."""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,272 @@
+"""
+Resumable uploads streamed to disk, so remote users can tag their own files.
+
+A client creates an upload with the file's name and size, then sends the
+bytes in one or more ``PATCH`` requests, each starting at the offset the
+server already has. Request bodies are copied to ``UPLOAD_FOLDER`` in
+``UPLOAD_CHUNK_SIZE`` pieces and never held in memory, so a worker's memory
+does not depend on file sizes or on how many uploads are running. An
+interrupted upload resumes from the offset reported by the server.
+
+All state lives on disk, one directory per upload holding a small JSON
+manifest and the spooled file, so every worker process sees the same uploads.
+Appends to one upload take a file lock in its directory, so two workers
+cannot write the same upload at once (on Windows, without ``fcntl``, only one
+worker process is supported).
+Uploads untouched for ``UPLOAD_TTL`` seconds are removed.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+from music.config import (ALLOWED_EXTENSIONS, UPLOAD_CHUNK_SIZE, UPLOAD_FOLDER, UPLOAD_MAX_SIZE,
+                          UPLOAD_TTL)
+from music.modules import AudioTags
+from music.utils import metrics
+from music.utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = get_logger()
+
+MANIFEST = 'upload.json'
+LOCK = 'upload.lock'
+_ID = re.compile(r'^[0-9a-f]{32}$')
+
+upload_bytes_total = metrics.registry.counter(
+    'music_finder_upload_bytes_total', 'Bytes received by uploads.')
+uploads_total = metrics.registry.counter(
+    'music_finder_uploads_total', 'Uploads by outcome ("completed" or "expired").', ('outcome',))
+
+# Appends to one upload are serialised by a thread lock within a process and
+# by a file lock across processes
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UploadError(Exception):
+    """An upload request that cannot be honoured, with the HTTP status to answer."""
+
+    def __init__(self, message: str, status: int = 400, upload: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.upload = upload
+
+
+def _lock(upload_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+@contextmanager
+def _exclusive(directory: str, upload_id: str):
+    # The manifest is replaced on every write, so the file lock is held on a
+    # file of its own that stays put. Without fcntl only one process is safe.
+    with _lock(upload_id):
+        if fcntl is None:
+            yield
+            return
+        try:
+            f = open(os.path.join(directory, LOCK), 'a')
+        except OSError:
+            raise UploadError('Unknown upload.', 404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+
+class UploadStore:
+    """
+    Uploads spooled under one folder.
+
+    The store keeps no state of its own and is cheap to create per request.
+
+    :param folder: directory holding one subdirectory per upload
+    :param max_size: largest accepted file, in bytes
+    :param chunk_size: bytes copied from a request body at a time
+    :param ttl: seconds after the last write before an upload is removed
+    :param extensions: accepted file extensions without the dot
+    :param clock: time source
+    """
+
+    def __init__(self, folder: str = UPLOAD_FOLDER, max_size: int = UPLOAD_MAX_SIZE,
+                 chunk_size: int = UPLOAD_CHUNK_SIZE, ttl: float = UPLOAD_TTL,
+                 extensions: set = None, clock=time.time):
+        self.folder = folder
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.extensions = extensions or ALLOWED_EXTENSIONS
+        self.clock = clock
+
+    def _directory(self, upload_id: str) -> str:
+        if not _ID.match(upload_id or ''):
+            raise UploadError('Unknown upload.', 404)
+        return os.path.join(self.folder, upload_id)
+
+    def _write_manifest(self, manifest: dict):
+        path = os.path.join(self._directory(manifest['id']), MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _manifest(self, upload_id: str) -> dict:
+        try:
+            with open(os.path.join(self._directory(upload_id), MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('Unknown upload.', 404)
+
+    def _spool_path(self, manifest: dict) -> str:
+        name = manifest['filename'] if manifest['complete'] else manifest['filename'] + '.part'
+        return os.path.join(self._directory(manifest['id']), name)
+
+    def _status(self, manifest: dict) -> dict:
+        path = self._spool_path(manifest)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        return dict(manifest, offset=offset, filepath=path if manifest['complete'] else None)
+
+    def create(self, filename: str, size: int) -> dict:
+        """
+        Start an upload.
+
+        :param filename: name of the file on the client
+        :param size: total size in bytes
+        :return: upload status with id and offset 0
+        """
+        name = secure_filename(filename or '')
+        if '.' not in name or name.rsplit('.', 1)[1].lower() not in self.extensions:
+            raise UploadError('Invalid file type. Only MP3 files are allowed.')
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise UploadError('The file size must be a positive number of bytes.')
+        if size > self.max_size:
+            raise UploadError(f'Files may be at most {self.max_size} bytes.', 413)
+        self.expire()
+
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._directory(upload_id))
+        now = self.clock()
+        manifest = {"id": upload_id, "filename": name, "size": size, "complete": False,
+                    "created": now, "updated": now, "tags": None}
+        open(self._spool_path(manifest), 'wb').close()
+        self._write_manifest(manifest)
+        return self._status(manifest)
+
+    def get(self, upload_id: str) -> dict:
+        """Status of an upload, including the offset to resume from."""
+        return self._status(self._manifest(upload_id))
+
+    def append(self, upload_id: str, stream, offset: int, length: int = None) -> dict:
+        """
+        Copy a request body to the end of an upload.
+
+        Once the last byte has arrived the file gets its final name and its
+        tags are read.
+
+        :param upload_id: upload id
+        :param stream: file-like request body
+        :param offset: position of the first byte of the body in the file
+        :param length: body length when known, checked before anything is written
+        :return: upload status
+        :raises UploadError: 409 with the current status when offset is not where the upload stands
+        """
+        with _exclusive(self._directory(upload_id), upload_id):
+            manifest = self._manifest(upload_id)
+            status = self._status(manifest)
+            if manifest['complete']:
+                raise UploadError('The upload is already complete.', 409, status)
+            if offset != status['offset']:
+                raise UploadError(f"Expected offset {status['offset']}.", 409, status)
+            remaining = manifest['size'] - offset
+            if length is not None and length > remaining:
+                raise UploadError(f'The body goes past the declared size of {manifest["size"]} bytes.',
+                                  413, status)
+
+            path = self._spool_path(manifest)
+            received = 0
+            try:
+                with open(path, 'ab') as f:
+                    while True:
+                        chunk = stream.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                        if received > remaining:
+                            raise UploadError(
+                                f'The body goes past the declared size of {manifest["size"]} bytes.',
+                                413, status)
+                        f.write(chunk)
+            except UploadError:
+                # Drop this request's bytes so the client can retry from the same offset
+                with open(path, 'ab') as f:
+                    f.truncate(offset)
+                raise
+            finally:
+                upload_bytes_total.inc(amount=received)
+
+            manifest['updated'] = self.clock()
+            if offset + received == manifest['size']:
+                os.replace(path, os.path.join(self._directory(upload_id), manifest['filename']))
+                manifest['complete'] = True
+                manifest['tags'] = self._read_tags(manifest)
+                uploads_total.inc('completed')
+                log.info(f"Upload {upload_id} complete ({manifest['size']} bytes)")
+            self._write_manifest(manifest)
+            return self._status(manifest)
+
+    def _read_tags(self, manifest: dict) -> dict | None:
+        # Only the tag at the start is parsed; the audio is never read into memory
+        path = self._spool_path(manifest)
+        try:
+            return AudioTags(path, lazy=True).to_dict()
+        except Exception as e:
+            log.warning(f"Could not read tags of upload {manifest['id']} -> {e}")
+            return None
+
+    def delete(self, upload_id: str):
+        """Remove an upload and its file."""
+        directory = self._directory(upload_id)
+        if not os.path.isdir(directory):
+            raise UploadError('Unknown upload.', 404)
+        with _exclusive(directory, upload_id):
+            shutil.rmtree(directory, ignore_errors=True)
+        with _locks_guard:
+            _locks.pop(upload_id, None)
+
+    def expire(self) -> int:
+        """
+        Remove uploads, finished or not, whose last write is older than the TTL.
+
+        :return: number of uploads removed
+        """
+        if not os.path.isdir(self.folder):
+            return 0
+        cutoff = self.clock() - self.ttl
+        removed = 0
+        for upload_id in os.listdir(self.folder):
+            if not _ID.match(upload_id):
+                continue
+            try:
+                updated = self._manifest(upload_id)['updated']
+            except UploadError:
+                # A directory without a manifest was abandoned while being created
+                updated = os.path.getmtime(os.path.join(self.folder, upload_id))
+            if updated < cutoff:
+                shutil.rmtree(os.path.join(self.folder, upload_id), ignore_errors=True)
+                with _locks_guard:
+                    _locks.pop(upload_id, None)
+                removed += 1
+        if removed:
+            uploads_total.inc('expired', amount=removed)
+            log.info(f"Removed {removed} expired uploads")
+        return removed
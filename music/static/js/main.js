@@ -306,6 +306,172 @@ function initializeUI() {
   });
 }
 
+/**
+ * Submit a background job
+ * @param {string} url - Job endpoint (e.g. /jobs/search)
+ * @param {FormData} formData - Form fields to post
+ * @returns {Promise<Object>} Submission response with job_id and status_url
+ */
+async function submitJob(url, formData) {
+  const response = await fetch(url, {
+    method: "POST",
+    body: formData,
+    headers: {
+      "X-Requested-With": "XMLHttpRequest",
+    },
+  });
+  const data = await response.json();
+  if (!data.success) {
+    throw new Error(data.message || "Could not start the job.");
+  }
+  return data;
+}
+
+/**
+ * Poll a background job until it has finished
+ * @param {string} statusUrl - status_url returned when the job was submitted
+ * @param {Object} options - interval and timeout in milliseconds, onProgress callback
+ * @returns {Promise<Object>} The finished job; rejects if the job failed
+ */
+async function pollJob(
+  statusUrl,
+  { interval = 300, maxInterval = 2000, timeout = 120000, onProgress } = {}
+) {
+  const deadline = Date.now() + timeout;
+  let delay = interval;
+
+  while (Date.now() < deadline) {
+    const response = await fetch(statusUrl, {
+      headers: { "X-Requested-With": "XMLHttpRequest" },
+    });
+    const job = await response.json();
+    if (!job.success) {
+      throw new Error(job.message || "Unknown job.");
+    }
+    if (job.status === "finished") return job;
+    if (job.status === "failed") {
+      throw new Error(job.error || "The job failed.");
+    }
+    if (onProgress && job.progress) onProgress(job.progress);
+
+    // Back off gently so long jobs do not flood the server
+    await new Promise((resolve) => setTimeout(resolve, delay));
+    delay = Math.min(delay * 1.5, maxInterval);
+  }
+  throw new Error("Timed out waiting for the job.");
+}
+
+/**
+ * Follow a server-sent event stream
+ * @param {string} url - Event stream URL
+ * @param {Object} handlers - Callbacks keyed by event name (artwork, result, progress, done, error)
+ * @returns {EventSource} The stream; closed once done or error arrives
+ */
+function streamEvents(url, handlers = {}) {
+  const source = new EventSource(url);
+
+  ["artwork", "result", "progress"].forEach((name) => {
+    source.addEventListener(name, (e) => {
+      if (handlers[name]) handlers[name](JSON.parse(e.data));
+    });
+  });
+  source.addEventListener("done", (e) => {
+    source.close();
+    if (handlers.done) handlers.done(JSON.parse(e.data));
+  });
+  source.addEventListener("error", (e) => {
+    source.close();
+    // Errors sent by the server carry a message, dropped connections do not
+    const data = e.data ? JSON.parse(e.data) : {};
+    if (handlers.error) {
+      handlers.error(new Error(data.message || "Lost connection to the server."));
+    }
+  });
+  return source;
+}
+
+/**
+ * Start downloading images before they are shown
+ * @param {string[]} urls - Image URLs
+ */
+function preloadImages(urls) {
+  (urls || []).forEach((url) => {
+    const img = new Image();
+    img.src = url;
+  });
+}
+
+/**
+ * Build a match card like the ones rendered in the results section
+ * @param {Object} track - Match data (title, artist, album, date, thumbnailUrl, coverUrl, score)
+ * @param {number} index - Match index, used by the "Use These Tags" button
+ * @returns {HTMLElement} The card element
+ */
+function renderMatchCard(track, index) {
+  const card = document.createElement("div");
+  card.className = "card match-card mb-2 fade-in";
+  card.id = `match-card-${index}`;
+  card.dataset.matchIndex = index;
+  card.dataset.score = track.score || 0;
+
+  const body = document.createElement("div");
+  body.className = "card-body d-flex align-items-center";
+
+  const cover = document.createElement("div");
+  cover.className = "cover-image-container me-3";
+  if (track.thumbnailUrl) {
+    const img = document.createElement("img");
+    // coverUrl is a small copy from the artwork proxy; thumbnailUrl is the full size to embed
+    img.src = track.coverUrl || track.thumbnailUrl;
+    img.alt = "Album Cover";
+    img.className = "img-fluid rounded";
+    cover.appendChild(img);
+  } else {
+    const placeholder = document.createElement("div");
+    placeholder.className = "placeholder-cover";
+    placeholder.textContent = "No Cover";
+    cover.appendChild(placeholder);
+  }
+
+  const info = document.createElement("div");
+  info.className = "match-info flex-grow-1";
+  const lines = [
+    ["fw-bold text-truncate-2", track.title || "N/A"],
+    ["text-muted", track.artist || "N/A"],
+    [
+      "text-muted small",
+      (track.album || "N/A") +
+        (track.date ? ` (${track.date.substring(0, 4)})` : ""),
+    ],
+  ];
+  lines.forEach(([className, text]) => {
+    const line = document.createElement("div");
+    line.className = className;
+    line.textContent = text;
+    info.appendChild(line);
+  });
+  if (typeof track.score === "number") {
+    const score = document.createElement("div");
+    score.className = "text-muted small";
+    score.innerHTML = '<i class="bi bi-bullseye me-1"></i>';
+    score.append(`${Math.round(track.score * 100)}% match`);
+    info.appendChild(score);
+  }
+
+  const actions = document.createElement("div");
+  actions.className = "match-actions";
+  const button = document.createElement("button");
+  button.className = "btn btn-outline-primary btn-sm use-tags-btn";
+  button.dataset.matchIndex = index;
+  button.innerHTML =
+    '<i class="bi bi-arrow-down-circle me-1"></i>Use These Tags';
+  actions.appendChild(button);
+
+  body.append(cover, info, actions);
+  card.appendChild(body);
+  return card;
+}
+
 /**
  * Handle form submission with loading state
  * @param {HTMLFormElement} form - Form element
@@ -362,4 +528,9 @@ window.UI = {
   addFadeInAnimation,
   removeFadeInAnimation,
   handleFormSubmission,
+  submitJob,
+  pollJob,
+  streamEvents,
+  preloadImages,
+  renderMatchCard,
 };
@@ -0,0 +1,43 @@
+"""
+Response compression.
+"""
+import gzip
+
+from music.config import COMPRESS_LEVEL, COMPRESS_MIN_SIZE
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+def should_compress(response, min_size: int = COMPRESS_MIN_SIZE) -> bool:
+    """
+    Whether a response is worth gzipping.
+
+    Streamed and file responses, responses that are already encoded and bodies
+    smaller than min_size are left alone.
+
+    :param response: Flask response
+    :param min_size: smallest body in bytes to compress, negative to disable
+    """
+    if min_size < 0 or response.direct_passthrough or response.is_streamed:
+        return False
+    if not 200 <= response.status_code < 300 or response.status_code == 204:
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    if not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES):
+        return False
+    return response.calculate_content_length() >= min_size
+
+
+def gzip_response(response, level: int = COMPRESS_LEVEL):
+    """
+    Gzip a response body in place.
+
+    :param response: Flask response
+    :param level: gzip compression level, 1 (fastest) to 9 (smallest)
+    :return: the same response
+    """
+    response.set_data(gzip.compress(response.get_data(), compresslevel=level, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
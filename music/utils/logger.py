@@ -1,10 +1,13 @@
 """
 Logging utility functions.
 """
+import json
 import logging
 import sys
 from logging import Logger
 
+from music.config import SLOW_REQUEST_THRESHOLD
+
 
 def __create_logger() -> Logger:
     formatter = logging.Formatter(
@@ -29,3 +32,21 @@ def get_logger() -> Logger:
     :return: Logger
     """
     return logger
+
+
+def log_slow_request(record: dict, threshold: float = SLOW_REQUEST_THRESHOLD) -> bool:
+    """
+    Log a request as one JSON record if it took longer than a threshold.
+
+    The record is also attached to the log entry as ``slow_request`` for
+    handlers that ship structured data.
+
+    :param record: request details, with the duration in seconds under ``duration``
+    :param threshold: minimum duration in seconds, negative to disable
+    :return: True if the request was logged
+    """
+    if threshold < 0 or record.get('duration', 0) < threshold:
+        return False
+    logger.warning(f"Slow request {json.dumps(record, sort_keys=True, default=str)}",
+                   extra={'slow_request': record})
+    return True
@@ -0,0 +1,160 @@
+"""
+Scoring of iTunes candidates against the tags of a local file.
+
+Each candidate gets a confidence between 0 and 1 from a weighted mix of fuzzy
+title, artist and album similarity, the duration difference and matching track
+and disc numbers. Components the local file has no value for are left out and
+the remaining weights renormalized.
+
+Strings are compared as sets of character trigrams. Trigram sets are memoized,
+and the local side is prepared once per file, so scoring a batch of candidates
+costs a few set intersections each.
+"""
+import re
+from functools import lru_cache
+
+from music.config import AUTO_TAG_THRESHOLD
+
+WEIGHTS = {
+    'title': 0.40,
+    'artist': 0.20,
+    'album': 0.10,
+    'duration': 0.20,
+    'tracknumber': 0.05,
+    'discnumber': 0.05,
+}
+
+# Fields compared as text, with the iTunes field holding the remote value
+TEXT_FIELDS = (('title', 'trackName'), ('artist', 'artistName'), ('album', 'collectionName'))
+
+# Duration differences up to DURATION_EXACT seconds score 1, falling to 0 at DURATION_LIMIT
+DURATION_EXACT = 2.0
+DURATION_LIMIT = 15.0
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+
+
+@lru_cache(maxsize=65536)
+def trigrams(text: str) -> frozenset:
+    """
+    Get the character trigrams of a normalized string.
+
+    :param text: any string
+    :return: frozenset of trigrams, empty for blank input
+    """
+    normalized = ' '.join(_PUNCTUATION.sub(' ', text.lower()).split())
+    if not normalized:
+        return frozenset()
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    """Dice coefficient of two trigram sets."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def _number(value) -> int | None:
+    # Track numbers come as 3, "3" or "3/12"
+    if value is None or value == '':
+        return None
+    try:
+        return int(str(value).split('/')[0])
+    except ValueError:
+        return None
+
+
+def _seconds(value) -> float | None:
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LocalFeatures:
+    """Features of one local file, prepared once and compared to many candidates."""
+    __slots__ = ('text', 'duration', 'tracknumber', 'discnumber')
+
+    def __init__(self, tags):
+        self.text = [(field, remote, trigrams(str(tags.get(field))))
+                     for field, remote in TEXT_FIELDS if tags.get(field)]
+        duration = _seconds(tags.get('duration'))
+        self.duration = duration if duration else None
+        self.tracknumber = _number(tags.get('tracknumber'))
+        self.discnumber = _number(tags.get('discnumber'))
+
+
+def score_candidate(features: LocalFeatures, candidate: dict) -> float:
+    """
+    Score one iTunes result against prepared local features.
+
+    :param features: LocalFeatures of the local file
+    :param candidate: raw iTunes result
+    :return: confidence between 0 and 1
+    """
+    total = weight_sum = 0.0
+    for field, remote_field, local in features.text:
+        remote = candidate.get(remote_field)
+        score = similarity(local, trigrams(str(remote))) if remote else 0.0
+        total += WEIGHTS[field] * score
+        weight_sum += WEIGHTS[field]
+
+    millis = candidate.get('trackTimeMillis')
+    if features.duration is not None and millis:
+        delta = abs(features.duration - millis / 1000)
+        score = 1.0 if delta <= DURATION_EXACT else max(
+            0.0, 1 - (delta - DURATION_EXACT) / (DURATION_LIMIT - DURATION_EXACT))
+        total += WEIGHTS['duration'] * score
+        weight_sum += WEIGHTS['duration']
+
+    for field, remote_field in (('tracknumber', 'trackNumber'), ('discnumber', 'discNumber')):
+        local = getattr(features, field)
+        remote = candidate.get(remote_field)
+        if local is not None and remote is not None:
+            total += WEIGHTS[field] * (local == remote)
+            weight_sum += WEIGHTS[field]
+
+    return total / weight_sum if weight_sum else 0.0
+
+
+def score_candidates(tags, candidates: list) -> list:
+    """
+    Score a batch of iTunes results against the tags of one local file.
+
+    :param tags: AudioTags or dict with the local values
+    :param candidates: raw iTunes results
+    :return: list of confidences, in candidate order
+    """
+    features = LocalFeatures(tags)
+    return [score_candidate(features, c) for c in candidates]
+
+
+def rank_candidates(tags, candidates: list) -> list:
+    """
+    Sort iTunes results by confidence, best first. Ties keep the iTunes order.
+
+    :param tags: AudioTags or dict with the local values
+    :param candidates: raw iTunes results
+    :return: list of (confidence, candidate) pairs
+    """
+    scored = zip(score_candidates(tags, candidates), candidates)
+    return sorted(scored, key=lambda pair: pair[0], reverse=True)
+
+
+def is_confident(score: float, threshold: float = AUTO_TAG_THRESHOLD) -> bool:
+    """Whether a match is good enough to apply without review."""
+    return score >= threshold
+
+
+def confident_match(tags, threshold: float = AUTO_TAG_THRESHOLD):
+    """
+    Build a predicate telling whether a single iTunes result is a confident match.
+
+    :param tags: AudioTags or dict with the local values
+    :param threshold: minimum confidence
+    :return: callable taking an iTunes result
+    """
+    features = LocalFeatures(tags)
+    return lambda candidate: score_candidate(features, candidate) >= threshold
@@ -0,0 +1,219 @@
+"""
+In-process latency metrics in the Prometheus text format.
+
+Hot stages (tag read, iTunes search, artwork download and transcode, embed,
+ID3 save, template render) are wrapped in ``timed``, which feeds a histogram
+per stage and, while a request is being handled, the per-request breakdown
+used for the ``Server-Timing`` header and slow-request logs.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds, from a warm cache hit to a slow iTunes round trip
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def get(self, *values) -> float:
+        return self._values.get(values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value that can go up and down, with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *values):
+        with self._lock:
+            self._values[values] = value
+
+    def get(self, *values) -> float:
+        return self._values.get(values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                # One slot per bucket plus +Inf, then the sum
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, *values) -> int:
+        series = self._series.get(values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    cumulative += count
+                    labels = _format_labels(self.labels, values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, values)
+                lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        metric = Gauge(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+stage_seconds = registry.histogram(
+    'music_finder_stage_seconds', 'Time spent in each processing stage.', ('stage',))
+stage_errors = registry.counter(
+    'music_finder_stage_errors_total', 'Failures in each processing stage.', ('stage',))
+request_seconds = registry.histogram(
+    'music_finder_request_seconds', 'Request latency by endpoint.', ('endpoint',))
+requests_total = registry.counter(
+    'music_finder_requests_total', 'Requests by endpoint and status code.', ('endpoint', 'status'))
+
+_request_timings = ContextVar('request_timings', default=None)
+
+
+def start_request():
+    """
+    Start collecting per-stage timings for the current request.
+
+    :return: token to pass to end_request
+    """
+    return _request_timings.set({})
+
+
+def end_request(token) -> dict:
+    """
+    Stop collecting timings for the current request.
+
+    :return: dict mapping stage to [total seconds, count]
+    """
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def record(stage: str, seconds: float, failed: bool = False):
+    """Record one run of a stage."""
+    stage_seconds.observe(seconds, stage)
+    if failed:
+        stage_errors.inc(stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the enclosed block as one run of a stage; exceptions count as failures."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, failed)
+
+
+def server_timing_header(timings: dict, total: float = None) -> str:
+    """
+    Format request timings as a Server-Timing header value.
+
+    :param timings: dict mapping stage to [total seconds, count]
+    :param total: whole request duration in seconds, added as ``total``
+    """
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, (seconds, _) in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
@@ -0,0 +1,293 @@
+"""
+Header-first MPEG audio duration and bitrate.
+
+Reading the duration of an MP3 should not cost a read of the whole file: on a
+network share a frame-by-frame scan of a long mix takes seconds. This module
+looks at a few KB at the start of the audio and a few KB at its end:
+
+- a Xing/Info or VBRI header in the first frame gives the exact frame count;
+- otherwise, if the first frames and the last frames share one bitrate, the
+  stream is taken as constant bitrate and the length follows from its size;
+- otherwise (VBR without a header) a fixed number of small windows spread over
+  the file are sampled and their average bitrate is used.
+
+Files are memory-mapped where possible, so only the pages looked at are read.
+
+``audio_digest`` hashes the audio alone, tags excluded, to find copies of one
+recording.
+"""
+import hashlib
+import io
+import mmap
+import os
+import struct
+from typing import NamedTuple
+
+# Bitrates in kbps by (MPEG-1?, layer) and bitrate index
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+VERSIONS = {3: 1, 2: 2, 0: 2.5}
+
+# Bytes read where the first frame is looked for, and at the end of the audio
+HEAD_SIZE = 16 * 1024
+TAIL_SIZE = 8 * 1024
+# Frames checked at each end before a stream is taken as constant bitrate
+CHECK_FRAMES = 8
+# Windows read, and their size, when a VBR stream has no header
+SAMPLE_WINDOWS = 16
+SAMPLE_SIZE = 4096
+# Bytes hashed at a time by audio_digest
+DIGEST_CHUNK = 1024 * 1024
+
+
+class FrameHeader(NamedTuple):
+    version: float
+    layer: int
+    bitrate: int
+    sample_rate: int
+    mono: bool
+    size: int
+    samples: int
+
+
+class StreamInfo(NamedTuple):
+    """
+    Length and bitrate of an MPEG audio stream.
+
+    ``exact`` is True when the length comes from a frame count stored in the
+    file (Xing/Info or VBRI), False when it was derived from the stream size.
+    ``method`` says which: ``xing``, ``vbri``, ``cbr`` or ``sampled``.
+    """
+    bitrate: int
+    duration: float
+    exact: bool
+    method: str
+
+
+class MPEGError(ValueError):
+    """No MPEG audio frames where they were expected."""
+
+
+def id3v2_size(header: bytes) -> int:
+    """Total size of the ID3v2 tag starting a file, from its first 10 bytes."""
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7f)
+    # Header, body and optional footer
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+
+def parse_header(data: bytes) -> FrameHeader | None:
+    """Parse a 4-byte frame header, or return None if it is not a valid one."""
+    if len(data) < 4 or data[0] != 0xff or data[1] & 0xe0 != 0xe0:
+        return None
+    version = VERSIONS.get((data[1] >> 3) & 3)
+    layer = 4 - ((data[1] >> 1) & 3)
+    bitrate_index = data[2] >> 4
+    rate_index = (data[2] >> 2) & 3
+    if version is None or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = BITRATES[(version == 1, layer)][bitrate_index]
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (data[2] >> 1) & 1
+    if layer == 1:
+        samples = 384
+        size = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if version == 1 or layer == 2 else 576
+        size = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return FrameHeader(version, layer, bitrate, sample_rate, (data[3] >> 6) == 3, size, samples)
+
+
+def _same_stream(a: FrameHeader, b: FrameHeader | None) -> bool:
+    return b is not None and (a.version, a.layer, a.sample_rate) == (b.version, b.layer, b.sample_rate)
+
+
+def _sync(data: bytes, start: int = 0) -> int:
+    """Offset of the first frame in data followed by another frame (or by the end of data)."""
+    pos = data.find(b'\xff', start)
+    while pos != -1:
+        header = parse_header(data[pos:pos + 4])
+        if header is not None:
+            following = pos + header.size
+            if following == len(data) or _same_stream(header, parse_header(data[following:following + 4])):
+                return pos
+        pos = data.find(b'\xff', pos + 1)
+    return -1
+
+
+def _walk(data: bytes, pos: int, limit: int) -> list:
+    """Headers of up to limit consecutive frames starting at pos."""
+    headers = []
+    while len(headers) < limit:
+        header = parse_header(data[pos:pos + 4])
+        if header is None or (headers and not _same_stream(headers[0], header)):
+            break
+        headers.append(header)
+        pos += header.size
+    return headers
+
+
+def _vbr_header(frame: bytes, header: FrameHeader) -> tuple | None:
+    """(method, frames, bytes) from a Xing/Info or VBRI header in the first frame."""
+    if header.version == 1:
+        offset = 4 + (17 if header.mono else 32)
+    else:
+        offset = 4 + (9 if header.mono else 17)
+    if frame[offset:offset + 4] in (b'Xing', b'Info'):
+        flags, = struct.unpack('>I', frame[offset + 4:offset + 8])
+        position = offset + 8
+        frames = size = None
+        if flags & 1:
+            frames, = struct.unpack('>I', frame[position:position + 4])
+            position += 4
+        if flags & 2:
+            size, = struct.unpack('>I', frame[position:position + 4])
+        if frames:
+            return 'xing', frames, size
+    if frame[36:40] == b'VBRI':
+        size, frames = struct.unpack('>II', frame[46:54])
+        if frames:
+            return 'vbri', frames, size
+    return None
+
+
+class _Reader:
+    """Random access to a file through a memory map, or seek and read where it cannot be mapped."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.map = None
+        try:
+            self.map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            self.size = len(self.map)
+        except (OSError, ValueError, io.UnsupportedOperation):
+            self.size = fileobj.seek(0, os.SEEK_END)
+
+    def read(self, offset: int, size: int) -> bytes:
+        offset = max(0, offset)
+        if self.map is not None:
+            return self.map[offset:offset + size]
+        self.fileobj.seek(offset)
+        return self.fileobj.read(size)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+
+def _audio_end(reader: _Reader) -> int:
+    # Exclude an ID3v1 tag and an APEv2 tag, whichever order they come in
+    end = reader.size
+    while end > 0:
+        if end >= 128 and reader.read(end - 128, 3) == b'TAG':
+            end -= 128
+            continue
+        footer = reader.read(end - 32, 32)
+        if len(footer) == 32 and footer[:8] == b'APETAGEX':
+            # The size covers items and footer; a header is counted separately
+            size = max(32, struct.unpack('<I', footer[12:16])[0])
+            end = max(0, end - size - (32 if footer[23] & 0x80 else 0))
+            continue
+        break
+    return end
+
+
+def _sampled_bitrate(reader: _Reader, start: int, end: int, first: FrameHeader) -> float:
+    """Average bitrate of the frames found in SAMPLE_WINDOWS windows spread over the stream."""
+    total_bits = total_seconds = 0.0
+    step = max(SAMPLE_SIZE, (end - start) // SAMPLE_WINDOWS)
+    for offset in range(start, end, step):
+        window = reader.read(offset, min(SAMPLE_SIZE, end - offset))
+        pos = _sync(window)
+        if pos == -1:
+            continue
+        for header in _walk(window, pos, CHECK_FRAMES):
+            if _same_stream(first, header):
+                total_bits += header.bitrate * 1000 * header.samples / header.sample_rate
+                total_seconds += header.samples / header.sample_rate
+    return total_bits / total_seconds if total_seconds else first.bitrate * 1000
+
+
+def read_stream_info(fileobj, audio_offset: int = None) -> StreamInfo:
+    """
+    Get the length and bitrate of an MP3 with a handful of small reads.
+
+    :param fileobj: file opened in binary mode
+    :param audio_offset: where the audio starts (default: after the ID3v2 tag, if any)
+    :return: StreamInfo
+    :raises MPEGError: when no frames are found at the start of the audio
+    """
+    reader = _Reader(fileobj)
+    try:
+        if audio_offset is None:
+            audio_offset = id3v2_size(reader.read(0, 10))
+        head = reader.read(audio_offset, HEAD_SIZE)
+        pos = _sync(head)
+        if pos == -1:
+            raise MPEGError("No MPEG frame found at the start of the audio")
+        first = parse_header(head[pos:pos + 4])
+        start = audio_offset + pos
+        end = _audio_end(reader)
+
+        found = _vbr_header(head[pos:pos + first.size], first)
+        if found is not None:
+            method, frames, size = found
+            duration = frames * first.samples / first.sample_rate
+            size = size or (end - start - first.size)
+            return StreamInfo(int(size * 8 / duration), duration, True, method)
+
+        bitrates = {header.bitrate for header in _walk(head, pos, CHECK_FRAMES)}
+        tail = reader.read(end - TAIL_SIZE, min(TAIL_SIZE, end - start))
+        tail_pos = _sync(tail)
+        if tail_pos != -1:
+            bitrates.update(header.bitrate for header in _walk(tail, tail_pos, CHECK_FRAMES))
+        if bitrates == {first.bitrate}:
+            bitrate, method = first.bitrate * 1000, 'cbr'
+        else:
+            bitrate, method = int(_sampled_bitrate(reader, start, end, first)), 'sampled'
+        return StreamInfo(bitrate, (end - start) * 8 / bitrate, False, method)
+    finally:
+        reader.close()
+
+
+def audio_digest(fileobj, chunk_size: int = DIGEST_CHUNK) -> str | None:
+    """
+    Hash the audio of an MP3 and nothing else.
+
+    The ID3v2 tag at the start and the ID3v1 and APEv2 tags at the end are
+    left out, so copies of one recording that only differ in tags get the
+    same digest. The audio is hashed from the memory map in chunk_size slices,
+    without copying it.
+
+    :param fileobj: file opened in binary mode
+    :param chunk_size: bytes hashed at a time
+    :return: SHA-256 hex digest, or None when there is no audio between the tags
+    """
+    reader = _Reader(fileobj)
+    try:
+        start = id3v2_size(reader.read(0, 10))
+        end = _audio_end(reader)
+        if end <= start:
+            # Every tag-only or empty file would otherwise share one digest
+            return None
+        digest = hashlib.sha256()
+        if reader.map is not None:
+            with memoryview(reader.map) as view:
+                for offset in range(start, end, chunk_size):
+                    digest.update(view[offset:min(offset + chunk_size, end)])
+        else:
+            for offset in range(start, end, chunk_size):
+                digest.update(reader.read(offset, min(chunk_size, end - offset)))
+        return digest.hexdigest()
+    finally:
+        reader.close()
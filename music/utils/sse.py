@@ -0,0 +1,19 @@
+"""
+Server-sent events formatting.
+"""
+import json
+
+# Sent while nothing happens, so proxies do not close an idle stream
+KEEP_ALIVE = ': keep-alive\n\n'
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Format one server-sent event.
+
+    :param event: event name, dispatched to ``addEventListener(event)`` in the browser
+    :param data: JSON-serialisable payload
+    :return: the event, terminated by a blank line
+    """
+    payload = json.dumps(data, separators=(',', ':'))
+    return f"event: {event}\ndata: {payload}\n\n"
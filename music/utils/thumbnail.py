@@ -1,57 +1,392 @@
+import hashlib
+import io
 import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
-import requests
 from PIL import Image
-from mutagen.id3 import ID3, APIC, error
-from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, APIC, ID3NoHeaderError
 
+from music.config import (ARTWORK_CACHE_DIR, ARTWORK_CACHE_MAX_BYTES, ARTWORK_CACHE_TTL,
+                          ARTWORK_HOSTS, ARTWORK_MAX_SIZE, ARTWORK_QUALITY, ARTWORK_WORKERS)
+from music.services.http_service import HttpService
+from music.services.singleflight import SingleFlight
 from music.utils.files import create_temp_file
 from music.utils.logger import get_logger
+from music.utils.metrics import timed
+from music.utils.tagwriter import write_tag
+
+service = HttpService()
+# Display sizes served by the artwork proxy; the full ARTWORK_MAX_SIZE is only fetched to embed
+VARIANTS = {'small': 160, 'medium': 300, 'large': 600}
+# iTunes artwork URLs name their size, e.g. .../100x100bb.jpg, and serve any size asked for
+_ITUNES_SIZE = re.compile(r'/\d+x\d+(\w*)\.(jpg|jpeg|png|webp)$')
+# Tracks of one album share a cover; concurrent downloads of it share one request
+in_flight_downloads = SingleFlight('artwork')
+# Seconds between two sweeps of the artwork cache
+SWEEP_INTERVAL = 60
+
+
+class ArtworkCache:
+    """
+    Content-addressed on-disk store for cover art.
+
+    Downloaded images are stored once under the SHA-256 of their content, and
+    each URL points at the content it returned, so covers shared by many tracks
+    or served under several URLs are kept a single time. Re-encoded variants are
+    stored next to their source, keyed by the encoding parameters.
+
+    Writes sweep the cache at most every SWEEP_INTERVAL seconds: files older
+    than the TTL are removed, then the oldest files until the total size is
+    under max_bytes. Hits and new URLs pointing at a stored image refresh its
+    mtime, so images in use are the last to go. A URL whose image was removed
+    is simply fetched again.
+
+    :param directory: cache directory
+    :param max_bytes: largest total size of the cached files
+    :param ttl: seconds a file is kept after it was written
+    :param clock: time source
+    """
+
+    def __init__(self, directory: str = ARTWORK_CACHE_DIR, max_bytes: int = ARTWORK_CACHE_MAX_BYTES,
+                 ttl: float = ARTWORK_CACHE_TTL, clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _path(self, kind: str, name: str) -> str:
+        return os.path.join(self.directory, kind, name[:2], name)
+
+    def _read(self, path: str) -> bytes | None:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _touch(path: str):
+        # Files in use look recent to prune, which goes by mtime
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write(self, path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename, so concurrent readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        if self.clock() >= self._next_sweep:
+            self.prune()
+
+    def prune(self) -> int:
+        """
+        Remove expired files, then the oldest ones while the cache is over its size.
+
+        :return: number of files removed
+        """
+        # One sweep at a time; writers that find one running move on
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = self.clock()
+            self._next_sweep = now + SWEEP_INTERVAL
+            files = []
+            for dirpath, _, filenames in os.walk(self.directory):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for mtime, size, path in files:
+                if mtime > now - self.ttl and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            if removed:
+                get_logger().info(f"Removed {removed} files from the artwork cache")
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def get_url(self, url: str) -> tuple[str, bytes] | tuple[None, None]:
+        """
+        Get the content hash and data previously fetched from a URL.
+        """
+        url_path = self._path('urls', self.url_key(url))
+        content_hash = self._read(url_path)
+        if not content_hash:
+            return None, None
+        content_hash = content_hash.decode('ascii')
+        object_path = self._path('objects', content_hash)
+        data = self._read(object_path)
+        if data is None:
+            return None, None
+        self._touch(url_path)
+        self._touch(object_path)
+        return content_hash, data
+
+    def put_url(self, url: str, data: bytes) -> str:
+        """
+        Store data fetched from a URL.
+
+        :return: content hash of the data
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        object_path = self._path('objects', content_hash)
+        if os.path.exists(object_path):
+            # Shared by another URL: the new pointer must not outlive its blob
+            self._touch(object_path)
+        else:
+            self._write(object_path, data)
+        self._write(self._path('urls', self.url_key(url)), content_hash.encode('ascii'))
+        return content_hash
+
+    def get_variant(self, content_hash: str, variant: str) -> bytes | None:
+        path = self._path('variants', f"{content_hash}-{variant}")
+        data = self._read(path)
+        if data is not None:
+            self._touch(path)
+        return data
+
+    def put_variant(self, content_hash: str, variant: str, data: bytes):
+        self._write(self._path('variants', f"{content_hash}-{variant}"), data)
+
+
+artwork_cache = ArtworkCache()
+
+
+def _download(url: str) -> bytes:
+    with timed('artwork_download'):
+        response = service.get(url)
+    if response is None:
+        raise OSError(f"Could not download artwork from {url}")
+    return response.content
 
 
 def download_thumbnail(url: str) -> str:
     log = get_logger()
     log.info(f"Downloading thumbnail from {url}")
 
-    thumbnail_data = requests.get(url).content
+    thumbnail_data = in_flight_downloads.do(url, _download, url)
     thumbnail_path = create_temp_file(thumbnail_data, suffix='.png')
 
     log.info(f"Thumbnail downloaded")
     return thumbnail_path
 
 
-def embed_thumbnail(audio_filename: str, thumbnail_path: str):
-    print("Embedding thumbnail into audio file...")
+def fetch_artwork(url: str, cache: ArtworkCache = None) -> tuple[str, bytes]:
+    """
+    Get cover art from the artwork cache, downloading it on a miss.
+
+    Concurrent misses for the same URL share one download.
 
-    # Ensure thumbnail is JPEG
-    jpeg_thumb_path = thumbnail_path
+    :param url: image URL
+    :param cache: artwork cache (default: the shared one)
+    :return: content hash and image data
+    """
+    cache = cache or artwork_cache
+    content_hash, data = cache.get_url(url)
+    if data is not None:
+        return content_hash, data
+
+    log = get_logger()
+    log.info(f"Downloading artwork from {url}")
+    data = in_flight_downloads.do(url, _download, url)
     try:
-        with Image.open(thumbnail_path) as img:
-            if img.format != 'JPEG':
-                jpeg_thumb_path = thumbnail_path.rsplit('.', 1)[0] + '.jpg'
-                img.convert('RGB').save(jpeg_thumb_path, 'JPEG')
+        content_hash = cache.put_url(url, data)
+    except OSError as e:
+        log.warning(f"Could not cache artwork from {url} -> {e}")
+        content_hash = hashlib.sha256(data).hexdigest()
+    return content_hash, data
+
+
+def prepare_artwork(data: bytes, max_size: int = ARTWORK_MAX_SIZE,
+                    quality: int = ARTWORK_QUALITY) -> bytes:
+    """
+    Re-encode an image as a JPEG no larger than max_size on either side.
+
+    Everything happens in memory. JPEGs that already fit are returned untouched.
+    Data Pillow cannot decode is returned as is.
+
+    :param data: image data
+    :param max_size: maximum width and height in pixels
+    :param quality: JPEG quality used when re-encoding
+    :return: JPEG data
+    """
+    try:
+        with timed('artwork_transcode'), Image.open(io.BytesIO(data)) as img:
+            if img.format == 'JPEG' and max(img.size) <= max_size:
+                return data
+            img.thumbnail((max_size, max_size))
+            buffer = io.BytesIO()
+            img.convert('RGB').save(buffer, 'JPEG', quality=quality)
+            return buffer.getvalue()
     except Exception:
-        jpeg_thumb_path = thumbnail_path  # fallback
+        return data  # fallback
 
-    # Embed the thumbnail image into the audio file (replace old cover art if present)
-    audio = MP3(audio_filename, ID3=ID3)
-    if audio.tags is None:
-        audio.add_tags()
-    else:
+
+def _prepared(content_hash: str, data: bytes, max_size: int, quality: int,
+              cache: ArtworkCache) -> bytes:
+    variant = f"{max_size}-{quality}.jpg"
+    prepared = cache.get_variant(content_hash, variant)
+    if prepared is None:
+        prepared = prepare_artwork(data, max_size, quality)
+        try:
+            cache.put_variant(content_hash, variant, prepared)
+        except OSError as e:
+            get_logger().warning(f"Could not cache artwork variant -> {e}")
+    return prepared
+
+
+def get_artwork(url: str, max_size: int = ARTWORK_MAX_SIZE, quality: int = ARTWORK_QUALITY,
+                cache: ArtworkCache = None) -> bytes:
+    """
+    Get cover art ready to embed: fetched and re-encoded at most once per image.
+
+    :param url: image URL
+    :param max_size: maximum width and height in pixels
+    :param quality: JPEG quality used when re-encoding
+    :param cache: artwork cache (default: the shared one)
+    :return: JPEG data
+    """
+    cache = cache or artwork_cache
+    content_hash, data = fetch_artwork(url, cache)
+    return _prepared(content_hash, data, max_size, quality, cache)
+
+
+def sized_url(url: str, size: int) -> str:
+    """Ask an iTunes artwork URL for a given size; other URLs are returned unchanged."""
+    return _ITUNES_SIZE.sub(f'/{size}x{size}\\1.\\2', url)
+
+
+def allowed_artwork_url(url: str, hosts=ARTWORK_HOSTS) -> bool:
+    """
+    Whether the artwork proxy may fetch a URL: http(s) on one of the hosts or their subdomains.
+
+    :param url: image URL
+    :param hosts: allowed host names
+    """
+    parsed = urlparse(url or '')
+    host = (parsed.hostname or '').lower()
+    return parsed.scheme in ('http', 'https') and any(
+        host == h or host.endswith('.' + h) for h in hosts)
+
+
+def get_artwork_variant(url: str, size: int, quality: int = ARTWORK_QUALITY,
+                        cache: ArtworkCache = None) -> tuple[str, bytes]:
+    """
+    Get a display-sized copy of cover art, downloading only that size when iTunes serves it.
+
+    :param url: image URL, usually the artworkUrl1000 of a result
+    :param size: maximum width and height in pixels
+    :param quality: JPEG quality used when re-encoding
+    :param cache: artwork cache (default: the shared one)
+    :return: strong entity tag and JPEG data
+    """
+    cache = cache or artwork_cache
+    content_hash, data = fetch_artwork(sized_url(url, size), cache)
+    return f"{content_hash[:32]}-{size}-{quality}", _prepared(content_hash, data, size, quality, cache)
+
+
+def embed_artwork(audio_filename: str, artwork: bytes, mime: str = 'image/jpeg'):
+    """
+    Embed cover art into an MP3, replacing any existing embedded images.
+
+    :param audio_filename: MP3 file
+    :param artwork: image data
+    :param mime: MIME type of the image
+    :return: write report, see write_tag
+    """
+    with timed('embed'):
+        try:
+            tags = ID3(audio_filename)
+        except ID3NoHeaderError:
+            tags = ID3()
         # Remove any existing embedded images
-        audio.tags.delall('APIC')
-
-    audio.tags.add(APIC(
-        encoding=3,  # 3 = utf-8
-        mime='image/jpeg',  # MIME type of the image
-        type=3,  # 3 = cover image
-        desc='Cover',
-        data=open(jpeg_thumb_path, 'rb').read()
-    ))
-    audio.save(v2_version=3)
-
-    # Clean up the downloaded/converted thumbnail image(s)
-    if jpeg_thumb_path != thumbnail_path and os.path.exists(jpeg_thumb_path):
-        os.remove(jpeg_thumb_path)
+        tags.delall('APIC')
+        tags.add(APIC(
+            encoding=3,  # 3 = utf-8
+            mime=mime,  # MIME type of the image
+            type=3,  # 3 = cover image
+            desc='Cover',
+            data=artwork
+        ))
+        return write_tag(tags, audio_filename)
+
+
+def embed_many(jobs: list, workers: int = ARTWORK_WORKERS, max_size: int = ARTWORK_MAX_SIZE,
+               quality: int = ARTWORK_QUALITY, cache: ArtworkCache = None) -> dict:
+    """
+    Embed cover art into many files concurrently.
+
+    Each distinct URL is fetched and re-encoded once, however many files use it.
+
+    :param jobs: list of (audio_filename, artwork_url) pairs
+    :param workers: number of worker threads
+    :param max_size: maximum width and height in pixels
+    :param quality: JPEG quality used when re-encoding
+    :param cache: artwork cache (default: the shared one)
+    :return: dict mapping each audio file to None on success or an error message
+    """
+    urls = sorted({url for _, url in jobs})
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        artwork = {}
+        futures = {url: pool.submit(get_artwork, url, max_size, quality, cache) for url in urls}
+        for url, future in futures.items():
+            try:
+                artwork[url] = future.result()
+            except Exception as e:
+                artwork[url] = e
+
+        def embed(job):
+            audio_filename, url = job
+            data = artwork[url]
+            if isinstance(data, Exception):
+                return audio_filename, str(data)
+            try:
+                embed_artwork(audio_filename, data)
+                return audio_filename, None
+            except Exception as e:
+                return audio_filename, str(e)
+
+        return dict(pool.map(embed, jobs))
+
+
+def embed_thumbnail(audio_filename: str, thumbnail_path: str):
+    print("Embedding thumbnail into audio file...")
+
+    # Ensure thumbnail is JPEG, converting in memory
+    with open(thumbnail_path, 'rb') as f:
+        artwork = prepare_artwork(f.read())
+
+    # Embed the thumbnail image into the audio file (replace old cover art if present)
+    embed_artwork(audio_filename, artwork)
+
+    # Clean up the downloaded thumbnail image
     if os.path.exists(thumbnail_path):
         os.remove(thumbnail_path)
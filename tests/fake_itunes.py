@@ -0,0 +1,129 @@
+"""
+Local stand-in for the iTunes Search API used by the tests.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_track(track_id: int, title: str = 'Song', artist: str = 'Artist',
+               album: str = 'Album', **extra) -> dict:
+    """Build a minimal iTunes track result."""
+    track = {
+        "wrapperType": "track",
+        "kind": "song",
+        "trackId": track_id,
+        "artistId": 1,
+        "collectionId": 100,
+        "trackName": title,
+        "artistName": artist,
+        "collectionName": album,
+        "primaryGenreName": "Pop",
+        "trackNumber": 1,
+        "discNumber": 1,
+        "trackTimeMillis": 200000,
+        "releaseDate": "2020-01-01T00:00:00Z",
+        "artworkUrl100": f"http://example.com/{track_id}/100x100bb.jpg",
+    }
+    track.update(extra)
+    return track
+
+
+class FakeItunesServer:
+    """
+    Threaded HTTP server answering ``/search`` and ``/lookup``.
+
+    ``search_results`` and ``lookup_results`` may be lists or callables taking
+    the parsed query string. Every request is recorded in ``requests``.
+    Entries queued in ``failures`` as ``(status, headers)`` are answered, in
+    order, before any regular response. ``delay`` is a latency in seconds, or a
+    callable taking the path and query and returning one. A share ``error_rate``
+    of the other requests is answered with ``error_status``, drawn from a
+    generator seeded with ``seed``. ``artwork`` is served as a JPEG under
+    ``/image/``.
+    """
+
+    def __init__(self, search_results=None, lookup_results=None, delay=0,
+                 error_rate: float = 0.0, error_status: int = 503, seed=None,
+                 artwork: bytes = None):
+        self.search_results = search_results if search_results is not None else []
+        self.lookup_results = lookup_results if lookup_results is not None else []
+        self.requests = []
+        self.failures = []
+        self.delay = delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.artwork = artwork
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                with server._lock:
+                    server.requests.append(self.path)
+                    failure = server.failures.pop(0) if server.failures else None
+                    if failure is None and server.error_rate and \
+                            server._random.random() < server.error_rate:
+                        failure = (server.error_status, {})
+                delay = server.delay(parsed.path, query) if callable(server.delay) else server.delay
+                if delay:
+                    time.sleep(delay)
+                if failure:
+                    status, headers = failure
+                    body = {"errorMessage": "Injected failure"}
+                else:
+                    headers = {}
+                    status, body = server.respond(parsed.path, query)
+                if isinstance(body, bytes):
+                    payload, content_type = body, 'image/jpeg'
+                else:
+                    payload, content_type = json.dumps(body).encode(), 'application/json'
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, path: str, query: dict):
+        if path == '/search':
+            results = self.search_results
+        elif path == '/lookup':
+            results = self.lookup_results
+        elif path.startswith('/image/') and self.artwork is not None:
+            return 200, self.artwork
+        else:
+            return 404, {"errorMessage": "Not found"}
+        if callable(results):
+            results = results(query)
+        return 200, {"resultCount": len(results), "results": results}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
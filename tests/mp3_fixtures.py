@@ -0,0 +1,41 @@
+"""
+Helpers that generate small, valid MP3 files for the tests.
+"""
+import os
+
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import APIC, ID3
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417 bytes, 1152 samples
+FRAME_HEADER = b'\xff\xfb\x90\x00'
+FRAME_SIZE = 417
+FRAME_SECONDS = 1152 / 44100
+
+
+def write_mp3(path: str, seconds: float = 5.0, tags: dict = None, artwork: bytes = None) -> str:
+    """
+    Write a silent constant-bitrate MP3, optionally with ID3 tags and cover art.
+
+    :param path: destination file
+    :param seconds: approximate audio length
+    :param tags: EasyID3 keys and values to write
+    :param artwork: JPEG bytes to embed as the front cover
+    :return: the path written
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    frames = max(1, int(seconds / FRAME_SECONDS))
+    frame = FRAME_HEADER + bytes(FRAME_SIZE - len(FRAME_HEADER))
+    with open(path, 'wb') as f:
+        f.write(frame * frames)
+    if tags:
+        audio = EasyID3()
+        for key, value in tags.items():
+            audio[key] = str(value)
+        audio.save(path, v2_version=3)
+    if artwork:
+        id3 = ID3(path) if tags else ID3()
+        id3.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=artwork))
+        id3.save(path, v2_version=3)
+    return path
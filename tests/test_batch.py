@@ -0,0 +1,183 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from mutagen.id3 import ID3
+
+from fake_itunes import FakeItunesServer, make_track
+from mp3_fixtures import write_mp3
+from music import batch, create_app
+from music.modules import AudioTags
+from music.services import itunes_api
+from music.services.cache import MemoryCache, ResultCache
+from music.services import fingerprint
+from music.services.dedupe import DuplicateIndex
+from music.services.http_service import HttpService
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'library')
+        write_mp3(os.path.join(self.root, 'a', '01.mp3'),
+                  tags={'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        write_mp3(os.path.join(self.root, 'b', '02.MP3'), seconds=4,
+                  tags={'title': 'Other Song', 'artist': 'Someone'})
+        write_mp3(os.path.join(self.root, 'b', 'untagged.mp3'), seconds=3)
+        with open(os.path.join(self.root, 'cover.jpg'), 'wb') as f:
+            f.write(b'not audio')
+        self.report = os.path.join(self.tmpdir.name, 'report.jsonl')
+        self.server = FakeItunesServer(search_results=[
+            make_track(1, 'Unrelated', 'Nobody'),
+            make_track(2, 'Close Your Eyes', 'KSHMR', trackTimeMillis=4977),
+        ]).__enter__()
+        self.patches = [
+            patch.object(itunes_api, 'service', HttpService(self.server.base_url)),
+            patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())),
+            patch.object(itunes_api, 'catalog', None),
+            patch.object(batch, 'duplicate_index',
+                         DuplicateIndex(os.path.join(self.tmpdir.name, 'digests.db'), workers=0)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.server.__exit__(None, None, None)
+        self.tmpdir.cleanup()
+
+    def read_report(self):
+        with open(self.report) as f:
+            return [json.loads(line) for line in f]
+
+    def test_iter_audio_files(self):
+        files = list(batch.iter_audio_files(self.root))
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ['01.mp3', '02.MP3', 'untagged.mp3'])
+
+    def test_run_batch_writes_report_and_summary(self):
+        summary = batch.run_batch(self.root, self.report, workers=0)
+        records = {os.path.basename(r['filepath']): r for r in self.read_report()}
+        self.assertEqual(summary['processed'], 3)
+        self.assertEqual(records['01.mp3']['match']['trackId'], 2)
+        self.assertEqual(records['01.mp3']['score'], 1.0)
+        self.assertTrue(records['01.mp3']['auto'])
+        self.assertFalse(records['02.MP3']['auto'])
+        self.assertEqual(records['untagged.mp3']['status'], 'no_tags')
+        self.assertIn('files_per_second', summary)
+        self.assertIn('peak_memory_mb', summary)
+
+    def test_untagged_file_is_identified_by_fingerprint(self):
+        match = {'path': '/music/tagged.mp3', 'similarity': 0.97,
+                 'tags': {'title': 'Close Your Eyes', 'artist': 'KSHMR', 'album': None}}
+        with patch.object(fingerprint, 'decoder_available', return_value=True), \
+                patch.object(fingerprint.fingerprint_index, 'identify', return_value=match):
+            record = batch.match_file({'filepath': os.path.join(self.root, 'b', 'untagged.mp3'),
+                                       'title': None, 'artist': None, 'album': None})
+        self.assertEqual((record['status'], record['identified_as']), ('matched', match['path']))
+        self.assertEqual(record['tags']['title'], 'Close Your Eyes')
+        self.assertEqual(record['match']['trackId'], 2)
+
+    def test_resume_skips_finished_files(self):
+        first = os.path.join(self.root, 'a', '01.mp3')
+        with open(self.report, 'w') as f:
+            f.write(json.dumps({'filepath': first}) + '\n{"filepath": "trunc')
+        summary = batch.run_batch(self.root, self.report, workers=0)
+        self.assertEqual((summary['processed'], summary['skipped']), (2, 1))
+        self.assertEqual(len(batch.load_checkpoint(self.report)), 3)
+
+    def test_copies_are_searched_once(self):
+        write_mp3(os.path.join(self.root, 'c', 'copy.mp3'))
+        write_mp3(os.path.join(self.root, 'c', 'copy2.mp3'), tags={'title': 'Eyes', 'album': 'Live'})
+        summary = batch.run_batch(self.root, self.report, workers=0)
+        records = {os.path.relpath(r['filepath'], self.root): r for r in self.read_report()}
+        self.assertEqual(summary['duplicates'], 2)
+        self.assertEqual(len(self.server.requests), 2)
+        for name in ('c/copy.mp3', 'c/copy2.mp3'):
+            self.assertEqual(records[name]['match']['trackId'], 2)
+            self.assertEqual(records[name]['duplicate_of'], os.path.join(self.root, 'a', '01.mp3'))
+        self.assertEqual(records['c/copy.mp3']['tags']['title'], None)
+
+    def test_process_pool(self):
+        summary = batch.run_batch(self.root, self.report, workers=2, window=2)
+        self.assertEqual(summary['processed'], 3)
+
+    def test_job_endpoint(self):
+        app = create_app({'TESTING': True, 'UPLOAD_FOLDER': self.tmpdir.name})
+        client = app.test_client()
+        for report in ('../report.jsonl', self.report):
+            response = client.post('/batch', json={'root': self.root, 'report': report})
+            self.assertEqual(response.status_code, 400)
+        with patch.object(batch, 'BATCH_REPORT_DIR', self.tmpdir.name):
+            response = client.post('/batch', json={'root': self.root, 'report': 'report.jsonl'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        for _ in range(100):
+            job = client.get(f'/batch/{job_id}').get_json()
+            if job['status'] not in ('queued', 'running'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(job['status'], 'finished')
+        self.assertEqual(job['summary']['processed'], 3)
+        self.assertEqual(job['summary']['report'], os.path.join(self.tmpdir.name, 'report.jsonl'))
+        self.assertEqual(client.get('/batch/unknown').status_code, 404)
+
+
+class TestSaveMany(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.paths = [write_mp3(os.path.join(self.tmpdir.name, f'{i:02}.mp3'),
+                                tags={'title': f'Old {i}', 'artist': 'Artist'})
+                      for i in range(1, 4)]
+        self.artwork_urls = []
+
+        def get_artwork(url):
+            self.artwork_urls.append(url)
+            if 'broken' in url:
+                raise OSError('404')
+            return b'\xff\xd8' + url.encode()
+
+        self.patch = patch.object(batch, 'get_artwork', side_effect=get_artwork)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_saves_files_and_reports_each(self):
+        edits = [{'filepath': p, 'tags': {'title': f'New {i}', 'album': 'Album'},
+                  'artwork': 'http://example.com/cover.jpg'} for i, p in enumerate(self.paths[:2])]
+        edits.append({'filepath': self.paths[2], 'tags': {'title': 'X'},
+                      'artwork': 'http://example.com/broken.jpg'})
+        edits.append({'filepath': os.path.join(self.tmpdir.name, 'missing.mp3'), 'tags': {}})
+        edits.append({'filepath': self.paths[0], 'tags': {'mood': 'happy'}})
+
+        results = batch.save_many(edits, workers=3)
+
+        self.assertEqual([r['status'] for r in results],
+                         ['saved', 'saved', 'error', 'not_found', 'error'])
+        self.assertEqual(self.artwork_urls.count('http://example.com/cover.jpg'), 1)
+        saved = AudioTags(self.paths[1])
+        self.assertEqual((saved.title, saved.artist, saved.album), ('New 1', 'Artist', 'Album'))
+        self.assertEqual(ID3(self.paths[1]).getall('APIC')[0].data,
+                         b'\xff\xd8http://example.com/cover.jpg')
+        # A file whose artwork failed is not written at all
+        self.assertEqual(AudioTags(self.paths[2]).title, 'Old 3')
+
+    def test_batch_save_endpoint(self):
+        client = create_app({'TESTING': True, 'UPLOAD_FOLDER': self.tmpdir.name}).test_client()
+        response = client.post('/save_metadata/batch', json={'edits': [
+            {'filepath': p, 'tags': {'genre': 'Dance'}} for p in self.paths]})
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['saved'], 3)
+        self.assertEqual({AudioTags(p).genre for p in self.paths}, {'Dance'})
+        self.assertEqual(client.post('/save_metadata/batch', json={}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3
+
+from mp3_fixtures import write_mp3
+from music import create_app, modules
+from music.modules import (AudioRecord, AudioTags, ExtendedAudioRecord, ExtendedAudioTags,
+                           records_to_columns, records_to_rows)
+
+
+class TestAudioTags(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_mp3(os.path.join(self.tmpdir.name, 'song.mp3'), seconds=3, tags={
+            'title': 'Close Your Eyes', 'artist': 'KSHMR', 'genre': 'Dance',
+            'tracknumber': '3/12', 'date': '2021-05-01'})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_reads_tags_and_stream_info(self):
+        audio = AudioTags(self.path)
+        self.assertEqual(audio.title, 'Close Your Eyes')
+        self.assertEqual(audio.genre, 'Dance')
+        self.assertEqual(audio.tracknumber, '3/12')
+        self.assertEqual(audio.date, '2021')
+        self.assertEqual(audio.bitrate, 128)
+        self.assertAlmostEqual(audio.duration, 3, delta=0.1)
+
+    def test_file_is_opened_once(self):
+        with patch('music.modules.open', side_effect=open) as mock_open:
+            AudioTags(self.path).to_dict()
+        self.assertEqual(mock_open.call_count, 1)
+
+    def test_lazy_stream_info(self):
+        with patch.object(modules, 'read_stream_info', wraps=modules.read_stream_info) as mock_info:
+            audio = AudioTags(self.path, lazy=True)
+            self.assertEqual(audio.artist, 'KSHMR')
+            mock_info.assert_not_called()
+            self.assertEqual(audio.bitrate, 128)
+            audio.to_dict()
+            self.assertEqual(mock_info.call_count, 1)
+
+    def test_pickle_round_trip_keeps_lazy_stream_info(self):
+        audio = pickle.loads(pickle.dumps(AudioTags(self.path, lazy=True)))
+        self.assertEqual(audio.title, 'Close Your Eyes')
+        self.assertEqual(audio.bitrate, 128)
+        self.assertAlmostEqual(audio.duration, 3, delta=0.1)
+        audio.title = 'Renamed'
+        audio.save()
+        self.assertEqual((AudioTags(self.path).title, AudioTags(self.path).genre), ('Renamed', 'Dance'))
+
+    def test_untagged_file(self):
+        path = write_mp3(os.path.join(self.tmpdir.name, 'untagged.mp3'))
+        audio = AudioTags(path)
+        self.assertIsNone(audio.title)
+        self.assertEqual(audio.bitrate, 128)
+
+    def test_save_writes_text_and_artwork_together(self):
+        audio = AudioTags(self.path, lazy=True)
+        audio.title = 'New Title'
+        audio.genre = ''
+        with patch.object(ID3, 'save', autospec=True, side_effect=ID3.save) as mock_save:
+            audio.save(artwork=b'\xff\xd8cover')
+        self.assertEqual(mock_save.call_count, 1)
+        saved = EasyID3(self.path)
+        self.assertEqual(saved['title'], ['New Title'])
+        self.assertNotIn('genre', saved)
+        self.assertEqual(ID3(self.path).getall('APIC')[0].data, b'\xff\xd8cover')
+
+    def test_atomic_save_keeps_audio_and_id3v1(self):
+        with open(self.path, 'ab') as f:
+            f.write(b'TAG' + b'Old Title'.ljust(30, b'\0') + bytes(95))
+        audio_before = AudioTags(self.path)
+        with open(self.path, 'rb') as f:
+            body = f.read()[audio_before._audio_offset:-128]
+
+        audio = AudioTags(self.path, lazy=True)
+        audio.title = 'New Title'
+        audio.save(artwork=b'\xff\xd8cover', atomic=True)
+
+        self.assertEqual(os.listdir(self.tmpdir.name), ['song.mp3'])
+        saved = AudioTags(self.path)
+        self.assertEqual((saved.title, saved.artist), ('New Title', 'KSHMR'))
+        self.assertAlmostEqual(saved.duration, 3, delta=0.1)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(data[saved._audio_offset:-128], body)
+        self.assertTrue(data[-128:].startswith(b'TAGNew Title'))
+
+    def test_atomic_save_failure_leaves_file_untouched(self):
+        with open(self.path, 'rb') as f:
+            original = f.read()
+        audio = AudioTags(self.path, lazy=True)
+        audio.title = 'New Title'
+        # A cover that does not fit the current tag: the file has to be rewritten
+        with patch.object(modules.os, 'replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                audio.save(artwork=b'\xff\xd8' + bytes(100000), atomic=True)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['song.mp3'])
+
+    def test_save_reserves_padding_and_then_writes_in_place(self):
+        path = write_mp3(os.path.join(self.tmpdir.name, 'untagged.mp3'), seconds=30)
+        size = os.path.getsize(path)
+        audio = AudioTags(path)
+        audio.title = 'First'
+        first = audio.save()
+        self.assertFalse(first['in_place'])
+        self.assertGreaterEqual(first['padding'], 16 * 1024)
+
+        audio = AudioTags(path, lazy=True)
+        audio.title = 'A much longer title than before'
+        second = audio.save(artwork=b'\xff\xd8' + bytes(8000), atomic=True)
+        self.assertTrue(second['in_place'])
+        self.assertEqual(second['tag_size'], first['tag_size'])
+        self.assertEqual(second['bytes_written'], first['tag_size'])
+        self.assertLess(second['bytes_written'], size)
+        self.assertEqual(AudioTags(path).title, 'A much longer title than before')
+        self.assertAlmostEqual(AudioTags(path).duration, 30, delta=0.1)
+
+    def test_save_untagged_file(self):
+        path = write_mp3(os.path.join(self.tmpdir.name, 'untagged.mp3'))
+        audio = AudioTags(path)
+        audio.title = 'Fresh'
+        audio.save()
+        self.assertEqual(AudioTags(path).title, 'Fresh')
+
+
+ITUNES_RESULT = {
+    "trackName": "Song", "artistName": "Artist", "collectionName": "Album",
+    "primaryGenreName": "Pop", "trackNumber": 2, "discNumber": 1,
+    "releaseDate": "2020-06-01T07:00:00Z",
+    "artworkUrl100": "http://example.com/100x100bb.jpg",
+}
+
+
+class TestAudioRecord(unittest.TestCase):
+    def test_matches_extended_audio_tags(self):
+        tags = ExtendedAudioTags()
+        tags.itunes_parse(ITUNES_RESULT)
+        record = ExtendedAudioRecord()
+        record.itunes_parse(ITUNES_RESULT)
+        self.assertEqual(record.to_dict(), tags.to_dict())
+        self.assertEqual(record['title'], 'Song')
+        self.assertEqual(record.get('missing', 'x'), 'x')
+
+    def test_is_slotted(self):
+        record = AudioRecord()
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.unknown = 1
+
+    def test_from_tags_and_parse(self):
+        record = AudioRecord.from_tags({'title': 'T', 'date': '2019-01-01', 'duration': 61})
+        self.assertEqual((record.title, record.date, record.str_duration), ('T', '2019', '01:01'))
+        record.parse({'duration': 62})
+        self.assertEqual(record.str_duration, '01:02')
+
+    def test_columnar_export(self):
+        records = [AudioRecord(f'/{i}.mp3', title=str(i), bitrate=128) for i in range(3)]
+        rows = records_to_rows(records)
+        self.assertEqual(rows[1][:2], ('/1.mp3', '1'))
+        columns = records_to_columns(records)
+        self.assertEqual(columns['title'], ['0', '1', '2'])
+        self.assertEqual(records_to_columns(records, ('bitrate',)), {'bitrate': [128] * 3})
+
+
+class TestSaveMetadataRoute(unittest.TestCase):
+    def test_save_metadata(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = write_mp3(os.path.join(tmpdir, 'song.mp3'), tags={'title': 'Old'})
+            client = create_app({'TESTING': True, 'UPLOAD_FOLDER': tmpdir}).test_client()
+            response = client.post('/save_metadata', data={
+                'filepath': path, 'title': 'New', 'artist': 'Someone', 'date': '2020'},
+                headers={'X-Requested-With': 'XMLHttpRequest'})
+            self.assertTrue(response.get_json()['success'])
+            audio = AudioTags(path)
+            self.assertEqual((audio.title, audio.artist, audio.date), ('New', 'Someone', '2020'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from requests.exceptions import ReadTimeout
+
+from fake_itunes import FakeItunesServer, make_track
+from mp3_fixtures import write_mp3
+from music import create_app, routes
+from music.modules import AudioTags
+from music.services import async_search, itunes_api
+from music.services.cache import MemoryCache, ResultCache
+from music.services.http_service import HttpService
+from music.services.jobs import JobQueue
+from music.services.rate_limit import RateLimitTimeout
+
+
+class RouteTestCase(unittest.TestCase):
+    search_results = []
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_mp3(os.path.join(self.tmpdir.name, 'song.mp3'), seconds=5, tags={
+            'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        self.server = FakeItunesServer(search_results=self.search_results).__enter__()
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        self.jobs = JobQueue(workers=4)
+        self.patches = [
+            patch.object(async_search, '_executor', self.executor),
+            patch.object(routes, 'jobs', self.jobs),
+            patch.object(itunes_api, 'service', HttpService(self.server.base_url)),
+            patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())),
+            patch.object(itunes_api, 'catalog', None),
+        ]
+        for p in self.patches:
+            p.start()
+        self.app = create_app({'TESTING': True, 'UPLOAD_FOLDER': self.tmpdir.name,
+                               'JOB_INLINE_WAIT': 5})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        # Jobs and abandoned search variants must finish before the patches are undone
+        self.jobs.shutdown(wait=True)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for p in self.patches:
+            p.stop()
+        self.server.__exit__(None, None, None)
+        self.tmpdir.cleanup()
+
+
+class TestSearchRoutes(RouteTestCase):
+    search_results = [
+        make_track(1, 'Unrelated Song', 'Nobody'),
+        make_track(2, 'Close Your Eyes', 'KSHMR', trackTimeMillis=5000),
+    ]
+
+    def test_index_ranks_best_match_first(self):
+        response = self.client.post('/', data={'filepath': self.path})
+        html = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('id="match-card-0"', html)
+        self.assertLess(html.index('Close Your Eyes'), html.index('Unrelated Song'))
+        self.assertIn('100% match', html)
+
+    def test_refresh_metadata_returns_whole_section(self):
+        response = self.client.post('/refresh_metadata', data={
+            'filepath': self.path, 'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        html = data['html'].strip()
+        self.assertTrue(html.startswith('<!-- Results Section'))
+        self.assertIn('id="metadata-form"', html)
+        self.assertIn('id="match-1-data"', html)
+        self.assertTrue(html.endswith('</div>'))
+        self.assertNotIn('<html', html)
+
+    def test_refresh_metadata_json(self):
+        response = self.client.post('/refresh_metadata?format=json', data={
+            'filepath': self.path, 'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        data = response.get_json()
+        self.assertEqual([r['title'] for r in data['results']],
+                         ['Close Your Eyes', 'Unrelated Song'])
+        self.assertEqual(data['metadata']['title'], 'Close Your Eyes')
+
+    def test_unreachable_itunes(self):
+        with patch.object(routes, 'search_variants', side_effect=ReadTimeout('timed out')), \
+                patch.object(routes, 'render_template', wraps=routes.render_template) as render:
+            self.client.post('/', data={'filepath': self.path})
+        self.assertEqual(render.call_args.kwargs['error'], 'No internet connection.')
+        for error, status in ((ReadTimeout('timed out'), 502), (RateLimitTimeout('busy'), 503)):
+            with patch.object(itunes_api, 'get_music_by_artist_id', side_effect=error):
+                response = self.client.post('/catalog/artist/7')
+            self.assertEqual(response.status_code, status)
+            self.assertFalse(response.get_json()['success'])
+
+    def test_responses_are_gzipped(self):
+        response = self.client.post('/', data={'filepath': self.path},
+                                    headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertIn(b'match-card-0', gzip.decompress(response.get_data()))
+        plain = self.client.post('/', data={'filepath': self.path})
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+
+class TestJobRoutes(RouteTestCase):
+    search_results = [make_track(1, 'Close Your Eyes', 'KSHMR', trackTimeMillis=5000)]
+
+    def wait_for_job(self, status_url, query=''):
+        for _ in range(100):
+            job = self.client.get(status_url + query).get_json()
+            if job['status'] not in ('queued', 'running'):
+                return job
+            time.sleep(0.05)
+        self.fail('job did not finish')
+
+    def test_index_renders_before_slow_search(self):
+        self.app.config['JOB_INLINE_WAIT'] = 0
+        self.server.delay = 0.5
+        html = self.client.post('/', data={'filepath': self.path}).get_data(as_text=True)
+        self.assertIn('Searching iTunes...', html)
+        self.assertIn('value="Close Your Eyes"', html)
+        status_url = re.search(r'data-search-job="([^"]+)"', html).group(1)
+
+        job = self.wait_for_job(status_url)
+        self.assertEqual((job['kind'], job['status']), ('search', 'finished'))
+        self.assertIn('id="match-card-0"', job['html'])
+        self.assertNotIn('data-search-job', job['html'])
+
+    def test_search_job(self):
+        response = self.client.post('/jobs/search', data={'filepath': self.path, 'title': 'Edited'})
+        self.assertEqual(response.status_code, 202)
+        job = self.wait_for_job(response.get_json()['status_url'], '?format=json')
+        self.assertEqual(job['result']['metadata']['title'], 'Edited')
+        self.assertEqual(job['result']['results'][0]['title'], 'Close Your Eyes')
+        self.assertEqual(self.client.post('/jobs/search', data={}).status_code, 404)
+
+    def test_fingerprint_match_is_suggested_not_applied(self):
+        untagged = write_mp3(os.path.join(self.tmpdir.name, 'untagged.mp3'), seconds=5)
+
+        def identify(tags, search_terms):
+            tags.update(title='Close Your Eyes', artist='KSHMR')
+            return {'path': self.path, 'similarity': 0.95, 'tags': {}}
+
+        with patch.object(routes, 'identify_untagged', side_effect=identify):
+            response = self.client.post('/jobs/search', data={'filepath': untagged})
+            job = self.wait_for_job(response.get_json()['status_url'], '?format=json')
+            html = self.client.post('/', data={'filepath': untagged}).get_data(as_text=True)
+        self.assertIsNone(job['result']['metadata']['title'])
+        self.assertEqual(job['result']['suggested'], {'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        self.assertEqual(job['result']['results'][0]['title'], 'Close Your Eyes')
+        self.assertRegex(html, r'value=""\s+placeholder="Close Your Eyes"')
+        self.assertIn('id="suggested-note"', html)
+
+    def test_save_job(self):
+        response = self.client.post('/jobs/save', data={
+            'filepath': self.path, 'title': 'Saved Title', 'artist': 'KSHMR'})
+        job = self.wait_for_job(response.get_json()['status_url'])
+        self.assertEqual((job['status'], job['result']['status']), ('finished', 'saved'))
+        self.assertEqual(AudioTags(self.path).title, 'Saved Title')
+
+    def read_events(self, response):
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = []
+        for block in response.get_data(as_text=True).split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+    def test_search_stream(self):
+        response = self.client.get('/search/stream', query_string={
+            'filepath': self.path, 'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        events = self.read_events(response)
+        names = [name for name, _ in events]
+        self.assertEqual(names[0], 'artwork')
+        self.assertEqual(names[-1], 'done')
+        self.assertLess(names.index('artwork'), names.index('result'))
+        result = events[names.index('result')][1]
+        self.assertEqual((result['index'], result['title']), (0, 'Close Your Eyes'))
+        self.assertIn(result['coverUrl'], events[0][1]['urls'])
+        self.assertEqual(events[-1][1]['count'], 1)
+        self.assertIn('id="match-card-0"', events[-1][1]['html'])
+        self.assertEqual(self.client.get('/search/stream').status_code, 404)
+
+    def test_pending_page_follows_job_events(self):
+        self.app.config['JOB_INLINE_WAIT'] = 0
+        self.server.delay = 0.3
+        html = self.client.post('/', data={'filepath': self.path}).get_data(as_text=True)
+        events_url = re.search(r'data-search-events="([^"]+)"', html).group(1)
+        events = self.read_events(self.client.get(events_url))
+        self.assertEqual(events[-1][0], 'done')
+        self.assertIn('result', [name for name, _ in events])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/jobs/unknown').status_code, 404)
+        self.assertEqual(self.client.get('/jobs/unknown/events').status_code, 404)
+
+
+class TestArtworkRoute(RouteTestCase):
+    url = 'https://is1-ssl.mzstatic.com/image/thumb/a/source/1000x1000bb.jpg'
+
+    def test_conditional_requests(self):
+        with patch.object(routes, 'get_artwork_variant', return_value=('abc-160-90', b'jpeg')) as get:
+            response = self.client.get('/artwork', query_string={'url': self.url})
+            self.assertEqual((response.status_code, response.data), (200, b'jpeg'))
+            self.assertEqual(response.headers['ETag'], '"abc-160-90"')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            response = self.client.get('/artwork', query_string={'url': self.url},
+                                       headers={'If-None-Match': '"abc-160-90"'})
+            self.assertEqual((response.status_code, response.data), (304, b''))
+            self.assertEqual(get.call_args[0], (self.url, 160))
+
+    def test_rejected_requests(self):
+        response = self.client.get('/artwork', query_string={'url': 'http://10.0.0.1/x.jpg'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/artwork', query_string={'url': self.url, 'size': 'huge'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestInstrumentation(RouteTestCase):
+    search_results = [make_track(1, 'Close Your Eyes', 'KSHMR', trackTimeMillis=5000)]
+
+    def test_server_timing_header(self):
+        self.app.config['SERVER_TIMING'] = True
+        response = self.client.post('/', data={'filepath': self.path})
+        timing = response.headers['Server-Timing']
+        for stage in ('tag_read', 'search', 'render', 'total'):
+            self.assertIn(f'{stage};dur=', timing)
+
+    def test_metrics_endpoint(self):
+        self.client.post('/', data={'filepath': self.path})
+        response = self.client.get('/metrics')
+        text = response.get_data(as_text=True)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('music_finder_stage_seconds_count{stage="http_search"}', text)
+        self.assertIn('music_finder_requests_total{endpoint="main.index",status="200"}', text)
+
+    def test_templates_reload_only_in_debug_mode(self):
+        self.assertIsNone(self.app.config['TEMPLATES_AUTO_RELOAD'])
+        self.assertFalse(self.app.jinja_env.auto_reload)
+        debug_app = create_app({'TESTING': True, 'UPLOAD_FOLDER': self.tmpdir.name, 'DEBUG': True})
+        self.assertTrue(debug_app.jinja_env.auto_reload)
+
+    def test_slow_requests_are_logged(self):
+        self.app.config['SLOW_REQUEST_THRESHOLD'] = 0
+        with self.assertLogs('music_finder_logger', level='WARNING') as cm:
+            self.client.get('/settings')
+        self.assertIn('"endpoint": "main.settings"', cm.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fake_itunes import FakeItunesServer, make_track
+from mp3_fixtures import write_mp3
+from music import batch
+from music.services import itunes_api
+from music.services.albums import assign_tracks, group_albums
+from music.services.cache import MemoryCache, ResultCache
+from music.services.dedupe import DuplicateIndex
+from music.services.http_service import HttpService
+
+TITLES = ['Opening', 'Second Song', 'Interlude', 'Closing Time']
+
+
+def album_tracks():
+    return [make_track(10 + n, title, 'Band', 'The Album', trackNumber=n + 1,
+                       trackTimeMillis=4977) for n, title in enumerate(TITLES)]
+
+
+class TestGrouping(unittest.TestCase):
+    def test_group_albums(self):
+        tags = [{'filepath': f'/music/a/{n}.mp3', 'album': 'The Album', 'albumartist': 'Band',
+                 'artist': f'Guest {n}'} for n in range(3)]
+        tags += [{'filepath': '/music/b/x.mp3', 'album': 'The Album', 'albumartist': 'Band'},
+                 {'filepath': '/music/a/untagged.mp3'}]
+        groups = group_albums(tags)
+        self.assertEqual([len(g) for g in groups], [3, 1, 1])
+        self.assertEqual(groups[0], tags[:3])
+
+    def test_assign_tracks_by_number_and_title(self):
+        group = [{'title': 'Closing Time', 'tracknumber': '4/4'},
+                 {'tracknumber': '1'},
+                 {'title': 'Something else entirely'}]
+        assigned = assign_tracks(group, album_tracks())
+        self.assertEqual([track['trackId'] if track else None for _, track in assigned],
+                         [13, 10, None])
+
+
+class TestAlbumBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'library')
+        for n, title in enumerate(TITLES):
+            write_mp3(os.path.join(self.root, 'album', f'{n + 1:02}.mp3'), seconds=5 + n / 10,
+                      tags={'title': title, 'artist': 'Band', 'albumartist': 'Band',
+                            'album': 'The Album', 'tracknumber': n + 1})
+        self.report = os.path.join(self.tmpdir.name, 'report.jsonl')
+        collection = {"wrapperType": "collection", "collectionId": 100,
+                      "collectionName": "The Album"}
+        self.server = FakeItunesServer(search_results=album_tracks()[:1],
+                                       lookup_results=[collection] + album_tracks()).__enter__()
+        self.patches = [
+            patch.object(itunes_api, 'service', HttpService(self.server.base_url)),
+            patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())),
+            patch.object(itunes_api, 'catalog', None),
+            patch.object(batch, 'duplicate_index',
+                         DuplicateIndex(os.path.join(self.tmpdir.name, 'digests.db'), workers=0)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.server.__exit__(None, None, None)
+        self.tmpdir.cleanup()
+
+    def test_album_costs_two_calls(self):
+        summary = batch.run_batch(self.root, self.report, workers=0)
+        with open(self.report) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual((summary['matched'], summary['albums']), (4, 1))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual([r['match']['trackId'] for r in records], [10, 11, 12, 13])
+        self.assertTrue(all(r['auto'] and r['collection_id'] == 100 for r in records))
+
+    def test_per_track(self):
+        batch.run_batch(self.root, self.report, workers=0, albums=False)
+        self.assertEqual(len(self.server.requests), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
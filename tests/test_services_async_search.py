@@ -0,0 +1,154 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from fake_itunes import FakeItunesServer, make_track
+from music.services import async_search, itunes_api, rate_limit
+from music.services.async_search import build_variants, merge_results, search_variants
+from music.services.cache import MemoryCache, ResultCache
+from music.services.http_service import HttpService
+from music.services.rate_limit import BATCH, INTERACTIVE, RateLimiter
+from music.utils import metrics
+
+TAGS = {'title': 'Close Your Eyes', 'artist': 'KSHMR', 'album': 'Noisy Album Name (Deluxe)'}
+
+
+class TestVariants(unittest.TestCase):
+    def test_build_variants(self):
+        variants = build_variants(TAGS)
+        self.assertEqual([v['name'] for v in variants],
+                         ['all', 'title_artist', 'title', 'artist_album', 'title_artist_song'])
+        self.assertEqual(variants[1]['term'], 'Close Your Eyes KSHMR')
+
+    def test_duplicate_and_empty_variants_are_dropped(self):
+        variants = build_variants({'title': 'Song', 'artist': None, 'album': None})
+        self.assertEqual([(v['name'], v['entity']) for v in variants],
+                         [('all', 'musicTrack'), ('title_artist_song', 'song')])
+        self.assertEqual(build_variants({}), [])
+
+    def test_merge_results_dedupes_by_track_id(self):
+        merged = merge_results([[{'trackId': 1}, {'trackId': 2}], [{'trackId': 2}, {'trackId': 3}]])
+        self.assertEqual([r['trackId'] for r in merged], [1, 2, 3])
+        self.assertEqual(len(merge_results([[{'trackId': 1}], [{'trackId': 3}]], limit=1)), 1)
+
+
+class TestSearchVariants(unittest.TestCase):
+    def setUp(self):
+        # Variants abandoned by a test must finish against that test's patches,
+        # not the next test's or the real service: drain the executor before
+        # the patches (stopped by the cleanups, after tearDown) are undone
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        self.start_patch(patch.object(async_search, '_executor', self.executor))
+        self.start_patch(patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())))
+        self.start_patch(patch.object(itunes_api, 'catalog', None))
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def start_patch(self, patcher):
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_search(self, server, **options):
+        self.start_patch(
+            patch.object(itunes_api, 'service', HttpService(server.base_url, max_retries=0)))
+        return search_variants(TAGS, limit=5, **options)
+
+    def test_noisy_album_still_finds_track(self):
+        def results(query):
+            term = query['term'][0]
+            if 'Noisy' in term:
+                return []
+            return [make_track(1, 'Close Your Eyes', 'KSHMR'), make_track(int(len(term)))]
+
+        with FakeItunesServer(search_results=results) as server:
+            merged = self.run_search(server, enough=99)
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(merged[0]['trackId'], 1)
+        self.assertEqual(len({r['trackId'] for r in merged}), len(merged))
+
+    def test_early_return_on_confident_match(self):
+        def delay(path, query):
+            return 0 if query['term'][0] == 'Close Your Eyes' else 1.0
+
+        with FakeItunesServer(search_results=[make_track(7, 'Close Your Eyes', 'KSHMR')],
+                              delay=delay) as server:
+            started = time.perf_counter()
+            merged = self.run_search(server)
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual([r['trackId'] for r in merged], [7])
+
+    def test_budget_bounds_latency(self):
+        with FakeItunesServer(search_results=[make_track(1)], delay=1.0) as server:
+            started = time.perf_counter()
+            merged = self.run_search(server, budget=0.2)
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(merged, [])
+
+    def test_results_are_reported_per_variant_as_they_arrive(self):
+        def delay(path, query):
+            return 0 if query['term'][0] == 'Close Your Eyes' else 0.3
+
+        reported = []
+        with FakeItunesServer(search_results=[make_track(7, 'Close Your Eyes', 'KSHMR')],
+                              delay=delay) as server:
+            started = time.perf_counter()
+            self.run_search(server, enough=99, on_results=lambda results: reported.append(
+                (time.perf_counter() - started, [r['trackId'] for r in results])))
+        self.assertEqual(len(reported), 5)
+        self.assertLess(reported[0][0], 0.25)
+        self.assertEqual(reported[0][1], [7])
+
+    def test_variants_leave_tokens_for_other_searches(self):
+        limiter = RateLimiter(per_minute=60, burst=5)
+        with FakeItunesServer(search_results=[make_track(1)]) as server:
+            self.start_patch(patch.object(itunes_api, 'service', HttpService(
+                server.base_url, max_retries=0, rate_limiter=limiter)))
+            self.assertEqual(len(async_search.affordable_variants(build_variants(TAGS))), 3)
+            search_variants(TAGS, limit=5, enough=99)
+            self.assertEqual(len(server.requests), 3)
+            # Only the reserve is left: the next user's search still goes out at once
+            started = time.perf_counter()
+            search_variants({'title': 'Other'}, limit=5, enough=99)
+            self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(len(server.requests), 4)
+
+    def test_variants_waiting_for_a_token_give_up_at_the_budget(self):
+        limiter = RateLimiter(per_minute=1, burst=1)
+        with FakeItunesServer(search_results=[make_track(1)]) as server:
+            self.start_patch(patch.object(itunes_api, 'service', HttpService(
+                server.base_url, max_retries=0, rate_limiter=limiter)))
+            started = time.perf_counter()
+            search_variants(TAGS, limit=5, budget=0.2, enough=99)
+            # Abandoned variants leave the limiter's queue instead of holding threads
+            self.executor.shutdown(wait=True)
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(limiter.status()['waiting']['interactive'], 0)
+
+    def test_variants_keep_the_callers_context(self):
+        limiter = RateLimiter(per_minute=6000, burst=10)
+        before = {name: rate_limit.wait_seconds.count(name) for name in (BATCH, INTERACTIVE)}
+        with FakeItunesServer(search_results=[make_track(1)]) as server:
+            self.start_patch(patch.object(itunes_api, 'service', HttpService(
+                server.base_url, max_retries=0, rate_limiter=limiter)))
+            token = metrics.start_request()
+            with rate_limit.lane(BATCH):
+                search_variants(TAGS, limit=5, enough=99)
+            timings = metrics.end_request(token)
+        self.assertEqual(rate_limit.wait_seconds.count(BATCH) - before[BATCH], 5)
+        self.assertEqual(timings['http_search'][1], 5)
+        self.assertEqual(rate_limit.wait_seconds.count(INTERACTIVE), before[INTERACTIVE])
+
+    def test_all_variants_failing_raises(self):
+        with patch.object(async_search.itunes_api, 'search_tracks',
+                          side_effect=ConnectionError('offline')):
+            with self.assertRaises(ConnectionError):
+                search_variants(TAGS)
+
+
+if __name__ == '__main__':
+    unittest.main()
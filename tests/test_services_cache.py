@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fake_itunes import FakeItunesServer, make_track
+from music.services import itunes_api
+from music.services.cache import MemoryCache, ResultCache, SqliteCache, make_search_key
+from music.services.http_service import HttpService
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestSearchKey(unittest.TestCase):
+    def test_key_is_normalized(self):
+        self.assertEqual(make_search_key(['Close  Your Eyes', 'KSHMR'], 5),
+                         make_search_key(['close your eyes ', None, 'kshmr'], 5))
+
+    def test_key_depends_on_limit_and_entity(self):
+        self.assertNotEqual(make_search_key(['a'], 5), make_search_key(['a'], 10))
+        self.assertNotEqual(make_search_key(['a'], 5), make_search_key(['a'], 5, 'song'))
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertEqual(cache.get('a'), '1')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = MemoryCache(ttl=10, clock=clock)
+        cache.set('a', '1')
+        clock.now += 11
+        self.assertIsNone(cache.get('a'))
+
+
+class TestSqliteCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'nested', 'cache.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_persists_across_instances(self):
+        first = SqliteCache(self.path)
+        first.set('a', '[1]')
+        first.close()
+        second = SqliteCache(self.path)
+        self.assertEqual(second.get('a'), '[1]')
+        second.close()
+
+    def test_size_and_ttl_eviction(self):
+        clock = FakeClock()
+        cache = SqliteCache(self.path, max_entries=2, ttl=10, clock=clock)
+        for key in 'abc':
+            clock.now += 1
+            cache.set(key, '1')
+        self.assertIsNone(cache.get('a'))
+        clock.now += 20
+        self.assertIsNone(cache.get('c'))
+        cache.close()
+
+
+class TestResultCache(unittest.TestCase):
+    def test_disk_hit_promotes_to_memory(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            disk = SqliteCache(os.path.join(tmpdir, 'cache.db'))
+            disk.set('k', '[{"trackId": 1}]')
+            memory = MemoryCache()
+            cache = ResultCache(memory, disk)
+            self.assertEqual(cache.get('k'), [{"trackId": 1}])
+            self.assertIsNotNone(memory.get('k'))
+            self.assertIsNone(cache.get('missing'))
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+            disk.close()
+
+
+class TestGetSongInfoCache(unittest.TestCase):
+    def test_repeat_lookup_is_served_from_cache(self):
+        with FakeItunesServer(search_results=[make_track(1)]) as server:
+            with patch.object(itunes_api, 'service', HttpService(server.base_url)), \
+                    patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())), \
+                    patch.object(itunes_api, 'catalog', None):
+                first = itunes_api.get_song_info(['Song', 'Artist'], limit=5)
+                second = itunes_api.get_song_info(['song', ' artist'], limit=5)
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(first, second)
+        self.assertIn('1000x1000', second[0]['artworkUrl1000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fake_itunes import FakeItunesServer, make_track
+from music.services import itunes_api
+from music.services.cache import MemoryCache, ResultCache
+from music.services.catalog import Catalog, build_match_query
+from music.services.http_service import HttpService
+
+
+def make_album(collection_id: int, name: str = 'Album', artist_id: int = 1) -> dict:
+    return {"wrapperType": "collection", "collectionId": collection_id, "artistId": artist_id,
+            "collectionName": name, "artworkUrl100": "http://example.com/100x100bb.jpg"}
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(os.path.join(self.tmpdir.name, 'catalog.db'))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmpdir.cleanup()
+
+    def test_match_query(self):
+        self.assertEqual(build_match_query('Close your-Eyes'), '"close"* "your"* "eyes"*')
+        self.assertIsNone(build_match_query(' !? '))
+
+    def test_ingest_dedupes_by_id(self):
+        self.catalog.ingest([make_track(1), make_track(2), make_album(100)])
+        self.catalog.ingest([make_track(1, 'Renamed'), make_album(100), {"wrapperType": "artist"}])
+        self.assertEqual(self.catalog.stats(), {'tracks': 2, 'collections': 1, 'artists': 0})
+        self.assertEqual(self.catalog.get_track(1)['trackName'], 'Renamed')
+        self.assertEqual([r['trackId'] for r in self.catalog.search('renamed')], [1])
+
+    def test_prefix_search(self):
+        self.catalog.ingest([make_track(1, 'Close Your Eyes', 'KSHMR'),
+                             make_track(2, 'Open Your Heart', 'Someone')])
+        self.assertEqual([r['trackId'] for r in self.catalog.search('clos kshm')], [1])
+        self.assertEqual(len(self.catalog.search('your')), 2)
+        self.assertEqual(self.catalog.search('close someone'), [])
+
+
+class TestCatalogLookups(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(os.path.join(self.tmpdir.name, 'catalog.db'))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmpdir.cleanup()
+
+    def patches(self, server):
+        return (patch.object(itunes_api, 'service', HttpService(server.base_url, max_retries=0)),
+                patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())),
+                patch.object(itunes_api, 'catalog', self.catalog))
+
+    def test_ingested_artist_resolves_offline(self):
+        songs = [make_track(i, f'Song {i}', 'KSHMR', artistId=7) for i in range(1, 4)]
+        with FakeItunesServer(lookup_results=lambda q: songs if q['entity'] == ['song']
+                              else [make_album(100, artist_id=7)]) as server:
+            service, cache, catalog = self.patches(server)
+            with service, cache, catalog:
+                itunes_api.get_music_by_artist_id(7)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(self.catalog.ingested_artists([7, 8]), {7})
+
+        # The server is gone now: lookups must be answered by the catalog
+        with service, cache, catalog:
+            results = itunes_api.get_song_info(['Song 2', 'KSHMR'])
+        self.assertEqual([r['trackId'] for r in results], [2])
+        self.assertIn('1000x1000', results[0]['artworkUrl1000'])
+
+    def test_partial_catalog_goes_to_network(self):
+        self.catalog.ingest([make_track(1, 'Song', 'Artist')])
+        with FakeItunesServer(search_results=[make_track(1), make_track(2)]) as server:
+            service, cache, catalog = self.patches(server)
+            with service, cache, catalog:
+                results = itunes_api.get_song_info(['Song', 'Artist'])
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual([r['trackId'] for r in results], [1, 2])
+        self.assertIsNotNone(self.catalog.get_track(2))
+
+    def test_truncated_discography_is_not_marked(self):
+        songs = [make_track(i, f'Song {i}', 'KSHMR', artistId=7) for i in range(1, 4)]
+        with FakeItunesServer(lookup_results=lambda q: songs if q['entity'] == ['song']
+                              else [make_album(100, artist_id=7)]) as server:
+            service, cache, catalog = self.patches(server)
+            with service, cache, catalog:
+                itunes_api.get_music_by_artist_id(7, limit=3)
+        self.assertEqual(self.catalog.ingested_artists([7]), set())
+
+    def test_full_page_from_catalog_still_goes_to_network(self):
+        self.catalog.ingest([make_track(1, 'Song', 'Artist')])
+        with FakeItunesServer(search_results=[make_track(2)]) as server:
+            service, cache, catalog = self.patches(server)
+            with service, cache, catalog:
+                results = itunes_api.search_tracks('Song Artist', limit=1)
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual([r['trackId'] for r in results], [2])
+
+    def test_cached_search_skips_catalog(self):
+        with FakeItunesServer(search_results=[make_track(1)]) as server:
+            service, cache, catalog = self.patches(server)
+            with service, cache, catalog:
+                itunes_api.search_tracks('Song')
+                with patch.object(self.catalog, 'search', side_effect=AssertionError):
+                    results = itunes_api.search_tracks('Song')
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual([r['trackId'] for r in results], [1])
+
+    def test_partial_catalog_answers_when_offline(self):
+        self.catalog.ingest([make_track(1, 'Song', 'Artist')])
+        with FakeItunesServer() as server:
+            service, cache, catalog = self.patches(server)
+        with service, cache, catalog:
+            results = itunes_api.get_song_info(['Song', 'Artist'])
+        self.assertEqual([r['trackId'] for r in results], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
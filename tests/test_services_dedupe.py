@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+from mutagen.apev2 import APEv2
+from mutagen.id3 import ID3, TIT2
+
+from mp3_fixtures import write_mp3
+from music.services.dedupe import DuplicateIndex, hash_file
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        self.original = write_mp3(os.path.join(self.root, 'a', 'song.mp3'), seconds=3,
+                                  tags={'title': 'Song', 'artist': 'Artist'})
+        # Same audio with a larger ID3v2 tag and ID3v1 and APEv2 tags at the end
+        self.copy = write_mp3(os.path.join(self.root, 'b', 'copy.mp3'), seconds=3)
+        id3 = ID3()
+        id3.add(TIT2(encoding=3, text=['A much longer title for the same recording']))
+        id3.save(self.copy, v1=2, v2_version=4, padding=lambda info: 5000)
+        ape = APEv2()
+        ape['Title'] = 'Copy'
+        ape.save(self.copy)
+        self.other = write_mp3(os.path.join(self.root, 'a', 'other.mp3'), seconds=4,
+                               tags={'title': 'Song', 'artist': 'Artist'})
+        self.index = DuplicateIndex(os.path.join(self.root, 'digests.db'), workers=0)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def test_digest_ignores_tags(self):
+        self.assertNotEqual(os.path.getsize(self.original), os.path.getsize(self.copy))
+        self.assertEqual(hash_file(self.original), hash_file(self.copy))
+        self.assertNotEqual(hash_file(self.original)[0], hash_file(self.other)[0])
+        self.assertIsNotNone(hash_file(os.path.join(self.root, 'missing.mp3'))[1])
+
+    def test_scan_groups_copies_and_skips_unchanged(self):
+        self.assertEqual(self.index.scan([self.root])['hashed'], 3)
+        self.assertEqual(self.index.groups(), [sorted([self.original, self.copy])])
+        self.assertEqual(self.index.stats(), {'files': 3, 'distinct': 2, 'duplicates': 1})
+
+        write_mp3(self.other, seconds=3)
+        summary = self.index.scan([self.root])
+        self.assertEqual((summary['hashed'], summary['unchanged']), (1, 2))
+        self.assertEqual(len(self.index.shared_digests()), 1)
+        self.assertEqual(len(self.index.groups()[0]), 3)
+
+    def test_files_without_audio_are_skipped(self):
+        for name in ('empty.mp3', 'tag_only.mp3'):
+            ID3().save(os.path.join(self.root, name))
+        self.assertEqual(hash_file(os.path.join(self.root, 'empty.mp3')), (None, None))
+        summary = self.index.scan([self.root])
+        self.assertEqual((summary['hashed'], summary['empty'], summary['failed']), (3, 2, 0))
+        self.assertEqual(self.index.stats()['files'], 3)
+
+    def test_scan_drops_deleted_files(self):
+        self.index.scan([self.root])
+        os.remove(self.copy)
+        summary = self.index.scan([self.root])
+        self.assertEqual(summary['removed'], 1)
+        self.assertEqual(self.index.groups(), [])
+        self.assertEqual(self.index.stats()['files'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
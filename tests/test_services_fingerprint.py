@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from mp3_fixtures import write_mp3
+from music.modules import AudioTags
+from music.services import fingerprint
+from music.services.fingerprint import FingerprintIndex, identify_untagged
+
+
+def chords(seed: int, seconds: float = 30.0, rate: int = fingerprint.RATE) -> np.ndarray:
+    """A random sequence of three-note chords, changing every two seconds."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(2.0 * rate)) / rate
+    parts = []
+    for _ in range(int(seconds / 2)):
+        notes = rng.choice(np.arange(48, 72), size=3, replace=False)
+        freqs = 440.0 * 2 ** ((notes - 69) / 12)
+        parts.append(sum(np.sin(2 * np.pi * f * t) for f in freqs))
+    return (np.concatenate(parts) / 3).astype(np.float32)
+
+
+def reencode(samples: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Quieter, slightly shifted and noisy: roughly what a lossy re-encode does."""
+    noise = np.random.default_rng(seed).normal(0, 0.05, len(samples) + 50)
+    return (np.concatenate([np.zeros(50), samples * 0.5]) + noise).astype(np.float32)
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_same_audio_matches_different_audio_does_not(self):
+        original = fingerprint.fingerprint(chords(1))
+        self.assertEqual(original.shape, (fingerprint.SIZE,))
+        self.assertAlmostEqual(float(np.linalg.norm(original)), 1.0, places=5)
+        self.assertGreater(float(original @ fingerprint.fingerprint(reencode(chords(1)))), 0.9)
+        self.assertLess(float(original @ fingerprint.fingerprint(chords(2))), 0.5)
+
+    def test_silence_and_short_audio_are_rejected(self):
+        with self.assertRaises(ValueError):
+            fingerprint.fingerprint(np.zeros(fingerprint.RATE * 30, dtype=np.float32))
+        with self.assertRaises(ValueError):
+            fingerprint.fingerprint(chords(1, seconds=2))
+
+
+class TestFingerprintIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index = FingerprintIndex(os.path.join(self.tmpdir.name, 'fingerprints.db'), workers=0)
+        self.audio = {}
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def track(self, name: str, seed: int, tags: dict = None) -> str:
+        path = write_mp3(os.path.join(self.tmpdir.name, name), tags=tags)
+        self.audio[path] = chords(seed)
+        return path
+
+    def decode(self, path, seconds=None):
+        return self.audio[path]
+
+    def test_add_files_fingerprints_tagged_files_once(self):
+        tagged = self.track('tagged.mp3', 1, {'title': 'Song', 'artist': 'Artist'})
+        untagged = self.track('untagged.mp3', 1)
+        with patch.object(fingerprint, 'decoder_available', return_value=True), \
+                patch.object(fingerprint, 'decode', side_effect=self.decode):
+            summary = self.index.add_files([tagged, untagged])
+            self.assertEqual((summary["added"], summary["untagged"]), (1, 1))
+            self.assertEqual(self.index.add_files([tagged])["unchanged"], 1)
+        self.assertEqual(self.index.stats()["fingerprints"], 1)
+
+    def test_add_files_counts_missing_files_as_failed(self):
+        tagged = self.track('tagged.mp3', 1, {'title': 'Song', 'artist': 'Artist'})
+        with patch.object(fingerprint, 'decoder_available', return_value=True), \
+                patch.object(fingerprint, 'decode', side_effect=self.decode):
+            summary = self.index.add_files([os.path.join(self.tmpdir.name, 'gone.mp3'), tagged])
+        self.assertEqual((summary["added"], summary["failed"]), (1, 1))
+
+    def test_lookup_finds_reencode_and_skips_unknown(self):
+        self.index.add(self.track('a.mp3', 1), fingerprint.fingerprint(chords(1)),
+                       {'title': 'First', 'artist': 'A'})
+        self.index.add(self.track('b.mp3', 2), fingerprint.fingerprint(chords(2)),
+                       {'title': 'Second', 'artist': 'B'})
+        match = self.index.lookup(fingerprint.fingerprint(reencode(chords(2))))
+        self.assertEqual(match["tags"]["title"], 'Second')
+        self.assertGreater(match["similarity"], 0.9)
+        self.assertIsNone(self.index.lookup(fingerprint.fingerprint(chords(3))))
+
+    def test_identify_untagged_fills_empty_fields(self):
+        source = self.track('tagged.mp3', 1)
+        self.index.add(source, fingerprint.fingerprint(chords(1)),
+                       {'title': 'Song', 'artist': 'Artist', 'album': 'Album', 'genre': None})
+        copy = self.track('copy.mp3', 1)
+        self.audio[copy] = reencode(chords(1))
+        audio = AudioTags(copy)
+        with patch.object(fingerprint, 'fingerprint_index', self.index), \
+                patch.object(fingerprint, 'decoder_available', return_value=True), \
+                patch.object(fingerprint, 'decode', side_effect=self.decode):
+            match = identify_untagged(audio, ['title', 'artist', 'album'])
+        self.assertEqual(match["path"], os.path.abspath(source))
+        self.assertEqual((audio.title, audio.artist, audio.album), ('Song', 'Artist', 'Album'))
+
+    def test_identify_untagged_needs_a_decoder(self):
+        audio = AudioTags(self.track('copy.mp3', 1))
+        with patch.object(fingerprint, 'decoder_available', return_value=False):
+            self.assertIsNone(identify_untagged(audio, ['title', 'artist', 'album']))
+        self.assertIsNone(audio.title)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from fake_itunes import FakeItunesServer, make_track
+from music.services import http_service
+from music.services.http_service import HttpService, get_session, parse_retry_after
+
+
+class TestRetryAfter(unittest.TestCase):
+    def test_parse_seconds(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+
+    def test_parse_http_date_in_the_past(self):
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_parse_invalid(self):
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+
+class TestHttpService(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeItunesServer(search_results=[make_track(1)]).__enter__()
+        self.delays = []
+        self.service = HttpService(self.server.base_url, max_retries=2)
+        self.service.sleep = self.delays.append
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+
+    def test_session_is_shared(self):
+        self.assertIs(HttpService().session, get_session())
+        self.assertIs(self.service.session, HttpService('x').session)
+
+    def test_retries_server_errors_then_succeeds(self):
+        self.server.failures = [(503, {}), (429, {'Retry-After': '1'})]
+        response = self.service.get('/search', params={'term': 'a b'})
+        self.assertEqual(response.json()['resultCount'], 1)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.delays[1], 1.0)
+        self.assertIn('term=a+b', self.server.requests[-1])
+
+    def test_gives_up_after_max_retries(self):
+        self.server.failures = [(500, {})] * 3
+        with self.assertLogs(http_service.log, level='ERROR'):
+            self.assertIsNone(self.service.get('/search'))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.failures = [(403, {})]
+        with self.assertLogs(http_service.log, level='ERROR'):
+            self.assertIsNone(self.service.get('/search'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_long_retry_after_is_not_waited_out(self):
+        self.server.failures = [(429, {'Retry-After': '3600'})]
+        with self.assertLogs(http_service.log, level='ERROR'):
+            self.assertIsNone(self.service.get('/search'))
+        self.assertEqual(self.delays, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
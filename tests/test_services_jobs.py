@@ -0,0 +1,96 @@
+import threading
+import unittest
+
+from music.services.jobs import JobQueue
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.jobs = JobQueue(workers=2, ttl=60, max_retained=3,
+                             dedicated={'batch': 1}, clock=self.clock)
+
+    def tearDown(self):
+        self.jobs.shutdown(wait=True)
+
+    def test_result_and_failure(self):
+        job = self.jobs.wait(self.jobs.submit('search', lambda a, b=0: a + b, 1, b=2), 5)
+        self.assertEqual((job['kind'], job['status'], job['result']), ('search', 'finished', 3))
+
+        def fail():
+            raise ConnectionError('offline')
+        job = self.jobs.wait(self.jobs.submit('search', fail), 5)
+        self.assertEqual((job['status'], job['error'], job['error_type']),
+                         ('failed', 'offline', 'ConnectionError'))
+        self.assertIsNone(self.jobs.get('unknown'))
+
+    def test_progress_is_published_while_running(self):
+        release = threading.Event()
+
+        def work(progress):
+            progress({'processed': 1})
+            release.wait(5)
+            return {'processed': 2}
+        job_id = self.jobs.submit('batch', work, progress=True)
+        self.assertEqual(self.jobs.wait(job_id, 0.2)['progress'], {'processed': 1})
+        self.assertEqual(self.jobs.get(job_id)['status'], 'running')
+        release.set()
+        self.assertEqual(self.jobs.wait(job_id, 5)['result'], {'processed': 2})
+
+    def test_follow_yields_each_change_until_finished(self):
+        events = [threading.Event() for _ in range(2)]
+        steps = list(events)
+
+        def work(progress):
+            for step, event in enumerate(events):
+                event.wait(5)
+                progress(step)
+            return 'done'
+        job_id = self.jobs.submit('search', work, progress=True)
+        seen = []
+        for job in self.jobs.follow(job_id, heartbeat=0.05):
+            if job is None:
+                # Nothing changed; let the job take its next step
+                if steps:
+                    steps.pop(0).set()
+                continue
+            seen.append((job['status'], job['progress']))
+        self.assertEqual(seen[-1], ('finished', 1))
+        self.assertIn(('running', 0), seen)
+        self.assertEqual(list(self.jobs.follow('unknown', heartbeat=0.05)), [])
+
+    def test_dedicated_pool_does_not_block_shared(self):
+        release = threading.Event()
+        batch_id = self.jobs.submit('batch', release.wait, 5)
+        queued_id = self.jobs.submit('batch', lambda: 'second')
+        search = self.jobs.wait(self.jobs.submit('search', lambda: 'fast'), 5)
+        self.assertEqual(search['status'], 'finished')
+        self.assertEqual(self.jobs.get(queued_id)['status'], 'queued')
+        release.set()
+        self.assertEqual(self.jobs.wait(batch_id, 5)['status'], 'finished')
+        self.assertEqual(self.jobs.wait(queued_id, 5)['result'], 'second')
+
+    def test_finished_jobs_expire(self):
+        first = self.jobs.submit('save', lambda: 1)
+        self.jobs.wait(first, 5)
+        self.clock.now += 30
+        ids = [self.jobs.submit('save', lambda: 1) for _ in range(3)]
+        for job_id in ids:
+            self.jobs.wait(job_id, 5)
+        # Over max_retained: the oldest finished job goes first
+        self.assertIsNone(self.jobs.get(first))
+        self.assertEqual(len(self.jobs.list('save')), 3)
+        self.clock.now += 61
+        self.assertEqual(self.jobs.list(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from mp3_fixtures import write_mp3
+from music import create_app, routes
+from music.modules import AudioTags
+from music.services import library
+from music.services.library import LibraryIndex, LibraryWatcher
+
+
+class LibraryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'music')
+        self.first = write_mp3(os.path.join(self.root, 'a', '01.mp3'),
+                               tags={'title': 'Close Your Eyes', 'artist': 'KSHMR'})
+        self.second = write_mp3(os.path.join(self.root, 'b', '02.mp3'),
+                                tags={'title': 'Other Song', 'artist': 'Someone'})
+        self.index = LibraryIndex(os.path.join(self.tmpdir.name, 'library.db'), workers=0)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+
+class TestLibraryIndex(LibraryTestCase):
+    def test_incremental_scan(self):
+        summary = self.index.scan([self.root])
+        self.assertEqual((summary['added'], summary['unchanged']), (2, 0))
+
+        with patch.object(library, 'read_file_tags', wraps=library.read_file_tags) as mock_read:
+            summary = self.index.scan([self.root])
+        self.assertEqual((summary['added'], summary['unchanged']), (0, 2))
+        mock_read.assert_not_called()
+
+        write_mp3(self.first, seconds=2, tags={'title': 'Retagged', 'artist': 'KSHMR'})
+        os.remove(self.second)
+        third = write_mp3(os.path.join(self.root, 'c', '03.mp3'))
+        with patch.object(library, 'read_file_tags', wraps=library.read_file_tags) as mock_read:
+            summary = self.index.scan([self.root])
+        self.assertEqual((summary['added'], summary['updated'], summary['removed']), (1, 1, 1))
+        self.assertEqual(sorted(c.args[0] for c in mock_read.call_args_list),
+                         sorted([self.first, third]))
+        self.assertEqual(self.index.get(self.first)['title'], 'Retagged')
+        self.assertIsNone(self.index.get(self.second))
+
+    def test_missing_root_keeps_index(self):
+        self.index.scan([self.root])
+        self.index.scan([os.path.join(self.tmpdir.name, 'unmounted')])
+        self.assertEqual(self.index.stats()['files'], 2)
+
+    def test_list_search_status_and_pages(self):
+        self.index.scan([self.root])
+        files, total = self.index.list('clos kshm')
+        self.assertEqual((total, files[0]['path']), (1, self.first))
+        self.assertEqual(self.index.set_status([self.second, '/elsewhere.mp3'], 'saved'), 1)
+        files, total = self.index.list(status='saved')
+        self.assertEqual([f['path'] for f in files], [self.second])
+        files, total = self.index.list(page=2, per_page=1)
+        self.assertEqual((total, [f['path'] for f in files]), (2, [self.second]))
+
+    def test_load_tags_uses_index_for_unchanged_files(self):
+        self.index.scan([self.root])
+        with patch.object(library, 'AudioTags', wraps=AudioTags) as mock_tags:
+            audio = self.index.load_tags(self.first)
+            self.assertEqual((audio.title, audio.bitrate), ('Close Your Eyes', 128))
+            self.assertEqual(mock_tags.call_args.args, ())
+            write_mp3(self.first, tags={'title': 'Changed'})
+            self.assertEqual(self.index.load_tags(self.first).title, 'Changed')
+            self.assertEqual(mock_tags.call_args.args, (self.first,))
+
+    def test_update_paths(self):
+        self.index.scan([self.root])
+        os.remove(self.first)
+        new = write_mp3(os.path.join(self.root, 'b', 'new.mp3'))
+        summary = self.index.update_paths([self.first, new, os.path.join(self.root, 'b')])
+        self.assertEqual(summary['removed'], 1)
+        self.assertIsNotNone(self.index.get(new))
+        self.assertEqual(self.index.stats()['files'], 2)
+
+
+class TestLibraryWatcher(LibraryTestCase):
+    def check_watcher(self, use_inotify):
+        watcher = LibraryWatcher(self.index, [self.root], interval=0.1,
+                                 use_inotify=use_inotify, settle=0.1).start()
+        try:
+            self.assertTrue(self.wait_for(lambda: self.index.stats()['files'] == 2))
+            new = write_mp3(os.path.join(self.root, 'd', 'new.mp3'), tags={'title': 'New'})
+            self.assertTrue(self.wait_for(lambda: self.index.get(new) is not None))
+            os.remove(self.first)
+            self.assertTrue(self.wait_for(lambda: self.index.get(self.first) is None))
+        finally:
+            watcher.stop()
+        return watcher
+
+    def test_polling(self):
+        self.assertEqual(self.check_watcher(use_inotify=False).mode, 'polling')
+
+    @unittest.skipUnless(os.path.exists('/proc/sys/fs/inotify'), 'inotify not available')
+    def test_inotify(self):
+        self.assertEqual(self.check_watcher(use_inotify=True).mode, 'inotify')
+
+
+class TestLibraryRoute(LibraryTestCase):
+    def test_library_listing(self):
+        self.index.scan([self.root])
+        app = create_app({'TESTING': True, 'UPLOAD_FOLDER': self.tmpdir.name})
+        with patch.object(routes, 'library_index', self.index):
+            client = app.test_client()
+            html = client.get('/library?q=kshmr').get_data(as_text=True)
+            data = client.get('/library?format=json&per_page=1&page=2').get_json()
+        self.assertIn('Close Your Eyes', html)
+        self.assertNotIn('Other Song', html)
+        self.assertEqual((data['total'], data['files'][0]['path']), (2, self.second))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+
+from fake_itunes import FakeItunesServer, make_track
+from music.services import rate_limit
+from music.services.http_service import HttpService
+from music.services.rate_limit import BATCH, INTERACTIVE, RateLimiter, RateLimitTimeout
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_then_steady_rate(self):
+        limiter = RateLimiter(per_minute=600, burst=2)  # one token every 0.1s
+        started = time.monotonic()
+        waits = [limiter.acquire() for _ in range(4)]
+        elapsed = time.monotonic() - started
+        self.assertLess(max(waits[:2]), 0.05)
+        self.assertGreater(elapsed, 0.17)
+        self.assertLess(elapsed, 0.5)
+
+    def test_interactive_calls_overtake_queued_batch_calls(self):
+        limiter = RateLimiter(per_minute=300, burst=1)  # one token every 0.2s
+        limiter.acquire()
+        served = []
+
+        def call(name):
+            limiter.acquire(name)
+            served.append(name)
+
+        batch = [threading.Thread(target=call, args=(BATCH,)) for _ in range(2)]
+        for thread in batch:
+            thread.start()
+        time.sleep(0.05)
+        self.assertEqual(limiter.status()['waiting'][BATCH], 2)
+        self.assertEqual(rate_limit.queue_depth.get(BATCH), 2)
+        interactive = threading.Thread(target=call, args=(INTERACTIVE,))
+        interactive.start()
+        for thread in batch + [interactive]:
+            thread.join(5)
+        self.assertEqual(served, [INTERACTIVE, BATCH, BATCH])
+        self.assertEqual(rate_limit.queue_depth.get(BATCH), 0)
+
+    def test_lane_context(self):
+        self.assertEqual(rate_limit.current_lane(), INTERACTIVE)
+        with rate_limit.lane(BATCH):
+            self.assertEqual(rate_limit.current_lane(), BATCH)
+        with self.assertRaises(ValueError):
+            with rate_limit.lane('unknown'):
+                pass
+
+    def test_timeout(self):
+        limiter = RateLimiter(per_minute=1, burst=1)
+        limiter.acquire()
+        with self.assertRaises(RateLimitTimeout):
+            limiter.acquire(timeout=0.05)
+        self.assertEqual(limiter.status()['waiting'][INTERACTIVE], 0)
+
+    def test_deadline_context(self):
+        limiter = RateLimiter(per_minute=1, burst=1)
+        limiter.acquire()
+        started = time.monotonic()
+        with rate_limit.deadline(started + 0.05):
+            with self.assertRaises(RateLimitTimeout):
+                limiter.acquire()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(limiter.status()['waiting'][INTERACTIVE], 0)
+
+    def test_throttled_response_pauses_everyone_and_retries(self):
+        limiter = RateLimiter(per_minute=6000, burst=5)
+        with FakeItunesServer(search_results=[make_track(1)]) as server:
+            server.failures = [(403, {'Retry-After': '0.3'})]
+            service = HttpService(server.base_url, max_retries=2, rate_limiter=limiter)
+            service.sleep = lambda delay: self.fail('throttled calls wait in the limiter')
+            started = time.monotonic()
+            response = service.get('/search')
+            elapsed = time.monotonic() - started
+        self.assertEqual(response.json()['resultCount'], 1)
+        self.assertEqual(len(server.requests), 2)
+        self.assertGreater(elapsed, 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
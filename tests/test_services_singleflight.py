@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from fake_itunes import FakeItunesServer, make_track
+from music.services import itunes_api
+from music.services.cache import MemoryCache, ResultCache
+from music.services.http_service import HttpService
+from music.services.singleflight import SingleFlight, calls_total
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.group = SingleFlight('test')
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def slow(self, value):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return [{'value': value}]
+
+    def run_concurrently(self, value, callers=5):
+        def call():
+            try:
+                return self.group.do('key', self.slow, value)
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=callers) as pool:
+            first = pool.submit(call)
+            self.assertTrue(self.started.wait(5))
+            rest = [pool.submit(call) for _ in range(callers - 1)]
+            deadline = time.monotonic() + 5
+            while (calls_total.get('test', 'collapsed') < self.collapsed_before + callers - 1
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+            self.release.set()
+            return [first.result()] + [f.result() for f in rest]
+
+    def test_concurrent_calls_share_one_result(self):
+        self.collapsed_before = calls_total.get('test', 'collapsed')
+        results = self.run_concurrently('album')
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(r == [{'value': 'album'}] for r in results))
+        self.assertEqual(calls_total.get('test', 'collapsed') - self.collapsed_before, 4)
+        self.assertEqual(self.group.in_flight(), 0)
+        # Nothing is kept once the call is over
+        self.assertEqual(self.group.do('key', lambda: 'again'), 'again')
+
+    def test_callers_get_their_own_copy(self):
+        self.collapsed_before = calls_total.get('test', 'collapsed')
+        results = self.run_concurrently('album', callers=3)
+        results[0][0]['value'] = 'changed'
+        results[1].append('extra')
+        self.assertEqual(results[2], [{'value': 'album'}])
+
+    def test_errors_are_shared(self):
+        self.collapsed_before = calls_total.get('test', 'collapsed')
+        error = ConnectionError('offline')
+        results = self.run_concurrently(error, callers=3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [error] * 3)
+
+
+class TestCollapsedSearches(unittest.TestCase):
+    def test_identical_searches_send_one_request(self):
+        with FakeItunesServer(search_results=[make_track(1)], delay=0.3) as server, \
+                patch.object(itunes_api, 'service', HttpService(server.base_url)), \
+                patch.object(itunes_api, 'search_cache', ResultCache(MemoryCache())), \
+                patch.object(itunes_api, 'catalog', None):
+            with ThreadPoolExecutor(max_workers=6) as pool:
+                futures = [pool.submit(itunes_api.get_song_info, ['Close Your Eyes', 'KSHMR'])
+                           for _ in range(6)]
+                results = [f.result() for f in futures]
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual([r[0]['trackId'] for r in results], [1] * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
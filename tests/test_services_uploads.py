@@ -0,0 +1,152 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from mp3_fixtures import write_mp3
+from music import create_app
+from music.services import uploads
+from music.services.uploads import UploadError, UploadStore
+
+
+class RecordingStream(io.BytesIO):
+    """Request body that remembers the size of every read."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+class TestUploadStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.now = [1000.0]
+        self.store = UploadStore(os.path.join(self.tmpdir.name, 'uploads'), max_size=1 << 20,
+                                 chunk_size=1024, ttl=60, clock=lambda: self.now[0])
+        with open(write_mp3(os.path.join(self.tmpdir.name, 'song.mp3'), seconds=2,
+                            tags={'title': 'Close Your Eyes'}), 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_resumed_upload_is_streamed_in_chunks(self):
+        upload = self.store.create('../My Song.mp3', len(self.data))
+        first = RecordingStream(self.data[:5000])
+        upload = self.store.append(upload['id'], first, 0)
+        self.assertEqual(upload['offset'], 5000)
+        self.assertFalse(upload['complete'])
+        self.assertTrue(all(size == 1024 for size in first.reads))
+
+        with self.assertRaises(UploadError) as caught:
+            self.store.append(upload['id'], io.BytesIO(self.data[100:]), 100)
+        self.assertEqual((caught.exception.status, caught.exception.upload['offset']), (409, 5000))
+
+        upload = self.store.append(upload['id'], io.BytesIO(self.data[5000:]), 5000)
+        self.assertTrue(upload['complete'])
+        self.assertEqual(os.path.basename(upload['filepath']), 'My_Song.mp3')
+        self.assertEqual(upload['tags']['title'], 'Close Your Eyes')
+        with open(upload['filepath'], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    @unittest.skipIf(uploads.fcntl is None, 'file locks need fcntl')
+    def test_appends_wait_for_other_processes(self):
+        upload = self.store.create('song.mp3', len(self.data))
+        done = threading.Event()
+
+        def append():
+            self.store.append(upload['id'], io.BytesIO(self.data), 0)
+            done.set()
+
+        # A lock taken through another open file is what another process would hold
+        with open(os.path.join(self.store.folder, upload['id'], uploads.LOCK), 'a') as f:
+            uploads.fcntl.flock(f, uploads.fcntl.LOCK_EX)
+            thread = threading.Thread(target=append)
+            thread.start()
+            self.assertFalse(done.wait(0.2))
+        thread.join(5)
+        self.assertTrue(self.store.get(upload['id'])['complete'])
+
+    def test_body_past_declared_size_is_dropped(self):
+        upload = self.store.create('song.mp3', 10)
+        self.store.append(upload['id'], io.BytesIO(b'12345'), 0)
+        with self.assertRaises(UploadError) as caught:
+            self.store.append(upload['id'], io.BytesIO(b'6789012'), 5)
+        self.assertEqual(caught.exception.status, 413)
+        self.assertEqual(self.store.get(upload['id'])['offset'], 5)
+
+    def test_rejected_uploads(self):
+        for filename, size, status in (('song.wav', 10, 400), ('song.mp3', 0, 400),
+                                       ('song.mp3', 2 << 20, 413)):
+            with self.assertRaises(UploadError) as caught:
+                self.store.create(filename, size)
+            self.assertEqual(caught.exception.status, status)
+        with self.assertRaises(UploadError):
+            self.store.get('../../etc')
+
+    def test_idle_uploads_expire(self):
+        old = self.store.create('old.mp3', 10)
+        self.store.append(old['id'], io.BytesIO(b'12345'), 0)
+        self.assertIn(old['id'], uploads._locks)
+        self.now[0] += 50
+        fresh = self.store.create('fresh.mp3', 10)
+        self.now[0] += 20
+        self.assertEqual(self.store.expire(), 1)
+        self.assertNotIn(old['id'], uploads._locks)
+        self.assertTrue(self.store.get(fresh['id']))
+        with self.assertRaises(UploadError):
+            self.store.get(old['id'])
+
+
+class TestUploadRoutes(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = create_app({'TESTING': True, 'UPLOAD_FOLDER': self.tmpdir.name})
+        self.client = self.app.test_client()
+        with open(write_mp3(os.path.join(self.tmpdir.name, 'song.mp3'), seconds=2,
+                            tags={'title': 'Close Your Eyes'}), 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_upload_resume_and_download(self):
+        response = self.client.post('/uploads', json={'filename': 'song.mp3', 'size': len(self.data)})
+        self.assertEqual(response.status_code, 201)
+        url = response.get_json()['upload']['upload_url']
+
+        response = self.client.patch(url, data=self.data[:3000], headers={'Upload-Offset': '0'})
+        self.assertEqual(response.headers['Upload-Offset'], '3000')
+        response = self.client.patch(url, data=self.data, headers={'Upload-Offset': '0'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(url).headers['Upload-Offset'], '3000')
+
+        response = self.client.patch(url, data=self.data[3000:], headers={'Upload-Offset': '3000'})
+        upload = response.get_json()['upload']
+        self.assertTrue(upload['complete'])
+        self.assertEqual(upload['tags']['title'], 'Close Your Eyes')
+        download = self.client.get(url + '/file')
+        self.assertEqual(download.data, self.data)
+        download.close()
+
+        self.assertEqual(self.client.delete(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_multi_file_create_is_all_or_nothing(self):
+        response = self.client.post('/uploads', json={'files': [
+            {'filename': 'a.mp3', 'size': 10}, {'filename': 'b.mp3', 'size': 20}]})
+        self.assertEqual([u['size'] for u in response.get_json()['uploads']], [10, 20])
+
+        response = self.client.post('/uploads', json={'files': [
+            {'filename': 'c.mp3', 'size': 10}, {'filename': 'd.txt', 'size': 20}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len([d for d in os.listdir(self.tmpdir.name) if len(d) == 32]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from music.utils.matching import (confident_match, is_confident, rank_candidates,
+                                  score_candidates, similarity, trigrams)
+
+LOCAL = {'title': 'Close Your Eyes', 'artist': 'KSHMR', 'album': 'Close Your Eyes - Single',
+         'duration': 185.2, 'tracknumber': '1/2', 'discnumber': '1'}
+
+
+def candidate(title, artist='KSHMR', album='Close Your Eyes - Single', millis=185000,
+              track=1, disc=1):
+    return {'trackName': title, 'artistName': artist, 'collectionName': album,
+            'trackTimeMillis': millis, 'trackNumber': track, 'discNumber': disc}
+
+
+class TestMatching(unittest.TestCase):
+    def test_trigram_similarity(self):
+        self.assertEqual(similarity(trigrams('Close Your Eyes!'), trigrams('close  your eyes')), 1.0)
+        self.assertLess(similarity(trigrams('Close Your Eyes'), trigrams('Open Arms')), 0.2)
+        self.assertEqual(similarity(trigrams(''), trigrams('a')), 0.0)
+
+    def test_exact_match_scores_one(self):
+        self.assertAlmostEqual(score_candidates(LOCAL, [candidate('Close Your Eyes')])[0], 1.0)
+
+    def test_ranking(self):
+        candidates = [
+            candidate('Something Else', artist='Other', millis=240000, track=5),
+            candidate('Close Your Eyes (VIP Mix)', millis=230000),
+            candidate('Close Your Eyes'),
+        ]
+        ranked = rank_candidates(LOCAL, candidates)
+        self.assertEqual([c['trackName'] for _, c in ranked],
+                         ['Close Your Eyes', 'Close Your Eyes (VIP Mix)', 'Something Else'])
+        self.assertTrue(is_confident(ranked[0][0]))
+        self.assertFalse(is_confident(ranked[2][0]))
+
+    def test_duration_tolerance(self):
+        near, far = score_candidates(LOCAL, [candidate('Close Your Eyes', millis=186500),
+                                             candidate('Close Your Eyes', millis=300000)])
+        self.assertAlmostEqual(near, 1.0)
+        self.assertAlmostEqual(far, 0.8)
+
+    def test_missing_local_values_are_ignored(self):
+        score = score_candidates({'title': 'Close Your Eyes'}, [candidate('Close Your Eyes')])[0]
+        self.assertEqual(score, 1.0)
+        self.assertEqual(score_candidates({}, [candidate('x')]), [0.0])
+
+    def test_confident_match_predicate(self):
+        confident = confident_match(LOCAL)
+        self.assertTrue(confident(candidate('Close Your Eyes')))
+        self.assertFalse(confident(candidate('Other', artist='Someone', millis=1000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from music.utils import metrics
+from music.utils.logger import log_slow_request
+from music.utils.metrics import Registry, server_timing_header, timed
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_render(self):
+        registry = Registry()
+        histogram = registry.histogram('latency_seconds', 'Latency.', ('stage',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'read')
+        histogram.observe(0.5, 'read')
+        histogram.observe(5, 'read')
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{stage="read",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{stage="read",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{stage="read",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_count{stage="read"} 3', lines)
+
+    def test_counter_escapes_labels(self):
+        registry = Registry()
+        registry.counter('hits_total', 'Hits.', ('path',)).inc('say "hi"')
+        self.assertIn('hits_total{path="say \\"hi\\""} 1', registry.render())
+
+    def test_timed_records_request_stages_and_failures(self):
+        token = metrics.start_request()
+        failures = metrics.stage_errors.get('test_stage')
+        with timed('test_stage'):
+            pass
+        with self.assertRaises(ValueError), timed('test_stage'):
+            raise ValueError()
+        timings = metrics.end_request(token)
+        self.assertEqual(timings['test_stage'][1], 2)
+        self.assertEqual(metrics.stage_errors.get('test_stage'), failures + 1)
+        self.assertRegex(server_timing_header(timings, 0.5),
+                         r'^test_stage;dur=\d+\.\d, total;dur=500\.0$')
+
+    def test_log_slow_request_threshold(self):
+        self.assertFalse(log_slow_request({'path': '/', 'duration': 0.2}, threshold=1))
+        with self.assertLogs('music_finder_logger', level='WARNING') as cm:
+            self.assertTrue(log_slow_request({'path': '/', 'duration': 2.5}, threshold=1))
+        self.assertIn('"duration": 2.5', cm.output[0])
+        self.assertFalse(log_slow_request({'duration': 99}, threshold=-1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+from mp3_fixtures import FRAME_SECONDS, write_mp3
+from music.utils import mpeg
+from music.utils.mpeg import MPEGError, parse_header, read_stream_info
+
+# MPEG-1 Layer III, 44.1 kHz stereo frames by bitrate index
+BITRATE_INDEX = {64: 5, 128: 9, 320: 14}
+
+
+def frame(bitrate: int = 128, body: bytes = b'') -> bytes:
+    header = bytes([0xff, 0xfb, BITRATE_INDEX[bitrate] << 4, 0x00])
+    size = 144 * bitrate * 1000 // 44100
+    return (header + body).ljust(size, b'\0')
+
+
+class CountingFile(io.BytesIO):
+    """In-memory file (so it cannot be memory-mapped) that counts the bytes read."""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestReadStreamInfo(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parse_header(self):
+        header = parse_header(b'\xff\xfb\x90\x00')
+        self.assertEqual((header.version, header.layer, header.bitrate, header.sample_rate),
+                         (1, 3, 128, 44100))
+        self.assertEqual((header.size, header.samples), (417, 1152))
+        self.assertIsNone(parse_header(b'\xff\xfb\xf0\x00'))
+        self.assertIsNone(parse_header(b'ID3\x03'))
+
+    def test_constant_bitrate_file_with_tags(self):
+        path = write_mp3(os.path.join(self.tmpdir.name, 'song.mp3'), seconds=30,
+                         tags={'title': 'Song'}, artwork=b'\xff\xd8' + bytes(5000))
+        with open(path, 'ab') as f:
+            f.write(b'TAG' + bytes(125))
+        with open(path, 'rb') as f:
+            info = read_stream_info(f)
+        frames = int(30 / FRAME_SECONDS)
+        self.assertEqual((info.bitrate, info.exact, info.method), (128000, False, 'cbr'))
+        self.assertAlmostEqual(info.duration, frames * 417 * 8 / 128000, places=3)
+
+    def test_xing_header_gives_exact_length(self):
+        xing = bytes(32) + b'Xing' + struct.pack('>III', 3, 1000, 1000 * 300)
+        data = frame(128, xing) + frame(320) * 5 + frame(64) * 5
+        info = read_stream_info(io.BytesIO(data))
+        self.assertTrue(info.exact)
+        self.assertEqual(info.method, 'xing')
+        self.assertAlmostEqual(info.duration, 1000 * 1152 / 44100)
+
+    def test_vbri_header_gives_exact_length(self):
+        vbri = bytes(32) + b'VBRI' + struct.pack('>HHHII', 1, 0, 75, 500 * 300, 500)
+        info = read_stream_info(io.BytesIO(frame(128, vbri) + frame(320) * 5))
+        self.assertEqual((info.exact, info.method), (True, 'vbri'))
+        self.assertAlmostEqual(info.duration, 500 * 1152 / 44100)
+
+    def test_variable_bitrate_without_header_is_sampled(self):
+        # Alternating 64 and 320 kbps frames: the head alone would say 64 kbps
+        data = (frame(64) + frame(320)) * 2000
+        info = read_stream_info(io.BytesIO(data))
+        self.assertEqual((info.exact, info.method), (False, 'sampled'))
+        self.assertAlmostEqual(info.duration, 4000 * FRAME_SECONDS, delta=4000 * FRAME_SECONDS * 0.05)
+
+    def test_reads_are_bounded_by_file_size(self):
+        data = frame(128) * 50000  # about 20 MB
+        f = CountingFile(data)
+        info = read_stream_info(f)
+        self.assertEqual(info.method, 'cbr')
+        self.assertLess(f.bytes_read, mpeg.HEAD_SIZE + mpeg.TAIL_SIZE + 1024)
+
+    def test_not_mpeg(self):
+        with self.assertRaises(MPEGError):
+            read_stream_info(io.BytesIO(b'RIFF' + bytes(10000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
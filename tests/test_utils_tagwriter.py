@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from mutagen.id3 import APIC, ID3, TIT2
+
+from mp3_fixtures import write_mp3
+from music.utils import tagwriter
+from music.utils.tagwriter import needed_size, write_tag
+
+
+class TestWriteTag(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_mp3(os.path.join(self.tmpdir.name, 'song.mp3'), seconds=60)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_outgrown_tag_grows_geometrically(self):
+        id3 = ID3()
+        id3.add(TIT2(encoding=3, text=['Song']))
+        first = write_tag(id3, self.path, padding=1024, growth=1.5)
+        self.assertEqual(first['padding'], 1024)
+
+        cover = b'\xff\xd8' + bytes(20000)
+        id3 = ID3(self.path)
+        id3.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover))
+        needed = needed_size(id3)
+        second = write_tag(id3, self.path, padding=1024, growth=1.5)
+        self.assertFalse(second['in_place'])
+        self.assertEqual(second['tag_size'], needed + int(needed * 0.5))
+        self.assertEqual(second['bytes_written'], os.path.getsize(self.path))
+        self.assertEqual(ID3(self.path).getall('APIC')[0].data, cover)
+
+    def test_large_padding_is_kept(self):
+        id3 = ID3()
+        id3.add(TIT2(encoding=3, text=['A long title to start with']))
+        first = write_tag(id3, self.path, padding=200000)
+        before = tagwriter.bytes_written_total.get('in_place')
+
+        id3 = ID3(self.path)
+        id3.setall('TIT2', [TIT2(encoding=3, text=['Short'])])
+        second = write_tag(id3, self.path)
+        self.assertTrue(second['in_place'])
+        self.assertEqual(second['tag_size'], first['tag_size'])
+        self.assertEqual(tagwriter.bytes_written_total.get('in_place') - before, first['tag_size'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,26 @@
+import io
+import os
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
+
+from PIL import Image
+from mutagen.id3 import ID3
+
+from mp3_fixtures import write_mp3
 from music.utils import thumbnail
 
 
+def make_image(size=(1200, 1200), fmt='PNG') -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 10, 10)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
 class TestThumbnailUtils(unittest.TestCase):
-    @patch('music.utils.thumbnail.requests.get')
+    @patch('music.utils.thumbnail.service.get')
     @patch('music.utils.thumbnail.create_temp_file')
     @patch('music.utils.thumbnail.get_logger')
     def test_download_thumbnail_success(self, mock_logger, mock_create_temp_file, mock_requests_get):
@@ -18,28 +34,133 @@ class TestThumbnailUtils(unittest.TestCase):
         mock_requests_get.assert_called_once_with(url)
         mock_create_temp_file.assert_called_once_with(b'data', suffix='.png')
 
-    @patch('music.utils.thumbnail.MP3')
-    @patch('music.utils.thumbnail.ID3')
-    @patch('music.utils.thumbnail.Image.open')
+    @patch('music.utils.thumbnail.service.get')
+    @patch('music.utils.thumbnail.create_temp_file')
+    @patch('music.utils.thumbnail.get_logger')
+    def test_download_thumbnail_failure(self, mock_logger, mock_create_temp_file, mock_requests_get):
+        mock_requests_get.return_value = None
+        with self.assertRaises(OSError):
+            thumbnail.download_thumbnail('http://example.com/missing.png')
+        mock_create_temp_file.assert_not_called()
+
+    @patch('music.utils.thumbnail.embed_artwork')
     @patch('music.utils.thumbnail.get_logger')
-    @patch('music.utils.thumbnail.open', create=True)
     @patch('music.utils.thumbnail.os.remove')
-    def test_embed_thumbnail_success(self, mock_remove, mock_open, mock_logger, mock_image_open, mock_id3, mock_mp3):
-        # Setup mocks
-        mock_img = MagicMock()
-        mock_img.format = 'JPEG'
-        mock_image_open.return_value.__enter__.return_value = mock_img
-        mock_audio = MagicMock()
-        mock_mp3.return_value = mock_audio
-        mock_audio.tags = MagicMock()
-        mock_audio.tags.add = MagicMock()
-        mock_audio.save = MagicMock()
-        # Call function
-        thumbnail.embed_thumbnail('audio.mp3', 'cover.jpg')
-        mock_image_open.assert_called()
-        mock_mp3.assert_called()
-        mock_audio.save.assert_called()
-        mock_remove.assert_called()
+    def test_embed_thumbnail_success(self, mock_remove, mock_logger, mock_embed_artwork):
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
+            f.write(make_image((50, 50)))
+        try:
+            thumbnail.embed_thumbnail('audio.mp3', f.name)
+        finally:
+            os.unlink(f.name)
+        audio_filename, artwork = mock_embed_artwork.call_args[0]
+        self.assertEqual(audio_filename, 'audio.mp3')
+        self.assertTrue(artwork.startswith(b'\xff\xd8'))
+        mock_remove.assert_called_once_with(f.name)
+
+
+class TestArtworkPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = thumbnail.ArtworkCache(os.path.join(self.tmpdir.name, 'artwork'))
+        self.png = make_image()
+        response = MagicMock()
+        response.content = self.png
+        self.get_patch = patch('music.utils.thumbnail.service.get', return_value=response)
+        self.mock_get = self.get_patch.start()
+
+    def tearDown(self):
+        self.get_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_prepare_artwork_resizes_in_memory(self):
+        data = thumbnail.prepare_artwork(self.png, max_size=300, quality=80)
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (300, 300)))
+
+    def test_prepare_artwork_keeps_small_jpeg(self):
+        jpeg = make_image((100, 100), 'JPEG')
+        self.assertIs(thumbnail.prepare_artwork(jpeg, max_size=300), jpeg)
+        self.assertEqual(thumbnail.prepare_artwork(b'not an image'), b'not an image')
+
+    def test_fetch_artwork_is_cached_by_url_and_content(self):
+        first = thumbnail.fetch_artwork('http://example.com/a.png', self.cache)
+        second = thumbnail.fetch_artwork('http://example.com/a.png', self.cache)
+        other = thumbnail.fetch_artwork('http://example.com/b.png', self.cache)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0], other[0])
+        self.assertEqual(self.mock_get.call_count, 2)
+        objects = os.path.join(self.cache.directory, 'objects')
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(objects)), 1)
+
+    def test_cache_is_pruned_by_age_and_size(self):
+        cache = thumbnail.ArtworkCache(self.cache.directory, max_bytes=250, ttl=3600)
+        now = time.time()
+        for n, age in enumerate((7200, 300, 200, 100)):
+            cache.put_variant(f'{n:02}' * 32, 'small', b'x' * 100)
+            path = cache._path('variants', f"{f'{n:02}' * 32}-small")
+            os.utime(path, (now - age, now - age))
+        # The expired file goes, then the oldest until 250 bytes are left
+        self.assertEqual(cache.prune(), 2)
+        self.assertEqual([cache.get_variant(f'{n:02}' * 32, 'small') is not None for n in range(4)],
+                         [False, False, True, True])
+
+    def test_images_in_use_outlive_older_files(self):
+        cache = thumbnail.ArtworkCache(self.cache.directory, max_bytes=10 ** 6, ttl=3600)
+        content_hash = cache.put_url('http://example.com/old.png', self.png)
+        object_path = cache._path('objects', content_hash)
+        hour_ago = time.time() - 3700
+        os.utime(object_path, (hour_ago, hour_ago))
+        # A new URL for the same image keeps it alive with its pointer
+        cache.put_url('http://example.com/new.png', self.png)
+        os.utime(cache._path('urls', cache.url_key('http://example.com/old.png')),
+                 (hour_ago, hour_ago))
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual(cache.get_url('http://example.com/new.png')[0], content_hash)
+
+    def test_concurrent_fetches_share_one_download(self):
+        def slow_get(url):
+            time.sleep(0.2)
+            return self.mock_get.return_value
+        self.mock_get.side_effect = slow_get
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: thumbnail.fetch_artwork(
+                'http://example.com/album.png', self.cache), range(4)))
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_get_artwork_reuses_variant(self):
+        with patch('music.utils.thumbnail.prepare_artwork',
+                   wraps=thumbnail.prepare_artwork) as mock_prepare:
+            first = thumbnail.get_artwork('http://example.com/a.png', 200, 80, self.cache)
+            second = thumbnail.get_artwork('http://example.com/a.png', 200, 80, self.cache)
+        self.assertEqual(first, second)
+        self.assertEqual(mock_prepare.call_count, 1)
+
+    def test_artwork_variant_downloads_display_size(self):
+        url = 'https://is1-ssl.mzstatic.com/image/thumb/a/source/1000x1000bb.jpg'
+        etag, data = thumbnail.get_artwork_variant(url, 160, 80, self.cache)
+        self.assertEqual(self.mock_get.call_args[0][0],
+                         'https://is1-ssl.mzstatic.com/image/thumb/a/source/160x160bb.jpg')
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.size, (160, 160))
+        self.assertEqual(thumbnail.get_artwork_variant(url, 160, 80, self.cache), (etag, data))
+        self.assertNotEqual(thumbnail.get_artwork_variant(url, 300, 80, self.cache)[0], etag)
+        self.assertFalse(thumbnail.allowed_artwork_url('http://127.0.0.1/x.jpg', ['mzstatic.com']))
+
+    def test_embed_many_fetches_each_url_once(self):
+        files = [write_mp3(os.path.join(self.tmpdir.name, f'{i}.mp3'), seconds=1,
+                           tags={'title': str(i)}) for i in range(4)]
+        jobs = [(path, 'http://example.com/album.png') for path in files]
+        jobs.append((os.path.join(self.tmpdir.name, 'missing', 'x.mp3'),
+                     'http://example.com/album.png'))
+        status = thumbnail.embed_many(jobs, workers=3, max_size=100, cache=self.cache)
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.assertEqual([status[path] for path in files], [None] * 4)
+        self.assertIsNotNone(status[jobs[-1][0]])
+        tags = ID3(files[0])
+        self.assertEqual(tags['TIT2'].text, ['0'])
+        self.assertTrue(tags.getall('APIC')[0].data.startswith(b'\xff\xd8'))
 
 
 if __name__ == '__main__':